@@ -36,12 +36,32 @@ def create_app():
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get("SESSION_SECRET", "inventory_tracking_system_stage2_key")
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
+    
+    # Edge nodes record a store's movements in a local database (see edge.py)
+    edge_store_id = os.environ.get("EDGE_STORE_ID")
+    if edge_store_id and not app.config['SQLALCHEMY_DATABASE_URI']:
+        from edge import DEFAULT_EDGE_DATABASE_URL
+        app.config['SQLALCHEMY_DATABASE_URI'] = DEFAULT_EDGE_DATABASE_URL
+    
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
+    # API bearer tokens share their signing secret with the stage3 services
+    app.config['JWT_SECRET'] = os.environ.get("JWT_SECRET", app.config['SECRET_KEY'])
+    
+    # Group commit for sales: 0 commits each sale on its own (see group_commit.py)
+    app.config['SALE_BATCH_WINDOW_MS'] = int(os.environ.get("SALE_BATCH_WINDOW_MS", "0"))
+    app.config['SALE_BATCH_SIZE'] = int(os.environ.get("SALE_BATCH_SIZE", "100"))
+    
+    # Document numbers each worker reserves at a time (see numbering.py)
+    app.config['DOCUMENT_NUMBER_BLOCK'] = int(os.environ.get("DOCUMENT_NUMBER_BLOCK", "50"))
+    
+    # Share of requests traced with tracemalloc, 0 for none (see memtrack.py)
+    app.config['MEMORY_SAMPLE_RATE'] = float(os.environ.get("MEMORY_SAMPLE_RATE", "0"))
+    
     # Additional configuration from environment variables
     app.config['DEBUG'] = os.environ.get("FLASK_DEBUG", "1") == "1"
     app.config['FLASK_ENV'] = os.environ.get("FLASK_ENV", "development")
@@ -64,13 +84,17 @@ def create_app():
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
-    # Import User model for login manager
-    from models import User
+    # Users are served from a per-worker cache of detached snapshots
+    from identity import load_user_snapshot, touch_last_login
     
     @login_manager.user_loader
     def load_user(user_id):
         """Load user by ID for Flask-Login"""
-        return User.query.get(int(user_id))
+        return load_user_snapshot(int(user_id))
+    
+    # API clients may authenticate with a bearer token instead of a session
+    from tokens import load_user_from_request
+    login_manager.request_loader(load_user_from_request)
     
     # Process before request
     @app.before_request
@@ -81,10 +105,9 @@ def create_app():
         # Update session timeout
         session.permanent = True
         
-        # Update last seen for logged in users
-        if current_user.is_authenticated:
-            current_user.last_login = datetime.utcnow()
-            db.session.commit()
+        # Update last seen for logged in users (token requests stay stateless)
+        if current_user.is_authenticated and not current_user.is_token:
+            touch_last_login(current_user, datetime.utcnow())
         
         # Store permission checks
         if request.endpoint and 'store_id' in request.view_args:
@@ -98,10 +121,43 @@ def create_app():
     with app.app_context():
         # Ensure models are imported before creating tables
         from models import StorePermission  # noqa
-
+        
+        # Keep per-store revisions in step with product and movement writes
+        import revisions  # noqa
+        
+        # Record product and movement writes as events for downstream services
+        import outbox  # noqa
+        
+        # Number new sales orders, purchase orders and transfers per store
+        import numbering  # noqa
+        
+        # Local edge databases take many small writes from the counters
+        if edge_store_id and db.engine.dialect.name == 'sqlite':
+            from edge import configure_sqlite
+            configure_sqlite(db.engine)
+        
         # Create database tables if they don't exist
         db.create_all()
         
+        # Add columns and indexes introduced since the tables were created
+        from schema import add_sqlite_autoincrement, create_added_indexes, relax_columns, upgrade_schema
+        for table_name, column_name in upgrade_schema(db):
+            app.logger.info(f"Added column {table_name}.{column_name}")
+        for table_name, column_name in relax_columns(db):
+            app.logger.info(f"Made column {table_name}.{column_name} nullable")
+        for table_name in add_sqlite_autoincrement(db):
+            app.logger.info(f"Rebuilt table {table_name} with AUTOINCREMENT ids")
+        created, failed = create_added_indexes(db)
+        for index_name in created:
+            app.logger.info(f"Created index {index_name}")
+        for index_name in failed:
+            app.logger.warning(f"Could not create index {index_name}; existing rows conflict with it")
+        
+        from revisions import init_store_revisions
+        started = init_store_revisions()
+        if started:
+            app.logger.info(f"Started revisions of {started} stores")
+        
         # Register blueprints
         from views.auth import bp as auth_bp
         from views.store import bp as store_bp
@@ -110,6 +166,7 @@ def create_app():
         from views.supplier import bp as supplier_bp
         from views.report import bp as report_bp
         from views.api import bp as api_bp
+        from views.admin import bp as admin_bp
         
         app.register_blueprint(auth_bp)
         app.register_blueprint(store_bp)
@@ -118,6 +175,15 @@ def create_app():
         app.register_blueprint(supplier_bp)
         app.register_blueprint(report_bp)
         app.register_blueprint(api_bp)
+        app.register_blueprint(admin_bp)
+        
+        # Administrators can profile single requests (see profiler.py)
+        from profiler import init_profiler
+        init_profiler(app)
+        
+        # Sampled requests log their peak allocation (see memtrack.py)
+        from memtrack import init_memory_tracking
+        init_memory_tracking(app)
         
         # Register a root route
         @app.route('/')
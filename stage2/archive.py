@@ -0,0 +1,179 @@
+"""
+Kiryana Inventory System - Movement Archival
+
+Moves InventoryMovement rows older than a retention window into the
+inventory_movement_archive table in id-ordered batches, rolling each
+product's archived movements up into an InventoryOpeningBalance row. The
+hot ledger then only holds recent history, which is what listings and most
+reports look at.
+
+Reports that may reach back past the archive horizon (the latest cutoff
+archived for a store) read through movement_ledger(), which adds the
+archive with UNION ALL only when the requested date range needs it.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+
+from app import db
+from models import InventoryMovement, InventoryMovementArchive, InventoryOpeningBalance
+
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_BATCH_SIZE = 10000
+
+# Columns shared by the hot ledger and the archive
+LEDGER_COLUMNS = ('id', 'product_id', 'store_id', 'movement_type', 'quantity', 'unit_price',
+                  'reference', 'notes', 'created_by', 'movement_date', 'created_at', 'idempotency_key')
+
+# Sign of each movement type in a product's stock level
+STOCK_SIGN = {
+    'stock_in': 1,
+    'transfer_in': 1,
+    'sale': -1,
+    'removal': -1,
+    'transfer_out': -1,
+}
+
+
+def archive_horizon(store_id=None):
+    """Latest archive cutoff of a store (or of any store), None if nothing was archived"""
+    query = db.session.query(func.max(InventoryOpeningBalance.as_of))
+    if store_id is not None:
+        query = query.filter(InventoryOpeningBalance.store_id == store_id)
+    return query.scalar()
+
+
+def includes_archive(store_id, start_date):
+    """Whether a query starting at start_date (None = all time) must read the archive
+
+    Pass store_id=None for chain-wide queries.
+    """
+    horizon = archive_horizon(store_id)
+    return horizon is not None and (start_date is None or start_date < horizon)
+
+
+def movement_ledger(include_archive=False):
+    """Selectable with InventoryMovement's columns, plus archived rows if asked"""
+    hot = InventoryMovement.__table__
+    if not include_archive:
+        return hot
+
+    archive = InventoryMovementArchive.__table__
+    return union_all(
+        select(*[hot.c[name] for name in LEDGER_COLUMNS]),
+        select(*[archive.c[name] for name in LEDGER_COLUMNS])
+    ).subquery('movement_ledger')
+
+
+def _roll_up(batch_filter, cutoff):
+    """Add the movements matching batch_filter to the opening balances"""
+    movement = InventoryMovement.__table__
+
+    rows = db.session.execute(
+        select(
+            movement.c.store_id,
+            movement.c.product_id,
+            movement.c.movement_type,
+            func.count().label('count'),
+            func.sum(movement.c.quantity).label('quantity'),
+            func.sum(movement.c.quantity * movement.c.unit_price).label('value')
+        ).where(*batch_filter).group_by(
+            movement.c.store_id, movement.c.product_id, movement.c.movement_type
+        )
+    ).all()
+
+    keys = {(r.store_id, r.product_id) for r in rows}
+    balances = {
+        (b.store_id, b.product_id): b
+        for b in InventoryOpeningBalance.query.filter(
+            InventoryOpeningBalance.store_id.in_({k[0] for k in keys}),
+            InventoryOpeningBalance.product_id.in_({k[1] for k in keys})
+        ).all()
+    } if keys else {}
+
+    for r in rows:
+        balance = balances.get((r.store_id, r.product_id))
+        if balance is None:
+            balance = InventoryOpeningBalance(
+                store_id=r.store_id,
+                product_id=r.product_id,
+                as_of=cutoff,
+                quantity=0,
+                stock_in_quantity=0,
+                sale_quantity=0,
+                removal_quantity=0,
+                sale_value=0,
+                movement_count=0
+            )
+            db.session.add(balance)
+            balances[(r.store_id, r.product_id)] = balance
+
+        quantity = int(r.quantity or 0)
+        balance.quantity += STOCK_SIGN.get(r.movement_type, 0) * quantity
+        balance.movement_count += int(r.count)
+        balance.as_of = max(balance.as_of, cutoff)
+
+        if r.movement_type == 'stock_in':
+            balance.stock_in_quantity += quantity
+        elif r.movement_type == 'sale':
+            balance.sale_quantity += quantity
+            balance.sale_value += float(r.value or 0)
+        elif r.movement_type == 'removal':
+            balance.removal_quantity += quantity
+
+
+def archive_movements(retention_days=DEFAULT_RETENTION_DAYS, store_id=None,
+                      batch_size=DEFAULT_BATCH_SIZE, cutoff=None, progress=None):
+    """Move movements dated before the cutoff into the archive
+
+    Works in id-ordered batches, each copied, rolled up and deleted in its
+    own transaction, so the hot table stays usable while a large backlog is
+    archived. The ids of a batch are read once and the three steps work on
+    exactly those rows, so a backdated movement committed meanwhile is left
+    for a later run rather than deleted without being archived. Returns
+    the number of archived movements.
+    """
+    movement = InventoryMovement.__table__
+    archive = InventoryMovementArchive.__table__
+
+    cutoff = cutoff or (datetime.utcnow() - timedelta(days=retention_days)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+    base_filter = [movement.c.movement_date < cutoff]
+    if store_id:
+        base_filter.append(movement.c.store_id == store_id)
+
+    archived = 0
+    last_id = 0
+
+    while True:
+        ids = db.session.execute(
+            select(movement.c.id).where(movement.c.id > last_id, *base_filter)
+            .order_by(movement.c.id).limit(batch_size)
+        ).scalars().all()
+
+        if not ids:
+            break
+
+        batch_filter = [movement.c.id.in_(ids)]
+
+        _roll_up(batch_filter, cutoff)
+
+        db.session.execute(insert(archive).from_select(
+            [*LEDGER_COLUMNS, 'archived_at'],
+            select(
+                *[movement.c[name] for name in LEDGER_COLUMNS],
+                literal(datetime.utcnow(), archive.c.archived_at.type)
+            ).where(*batch_filter)
+        ))
+        result = db.session.execute(delete(movement).where(*batch_filter))
+        db.session.commit()
+
+        archived += result.rowcount
+        last_id = ids[-1]
+
+        if progress:
+            progress(archived)
+
+    return archived
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark: hot query latency before and after archiving old movements.
+
+Seeds a ledger spread over several years, times the queries that listings
+and reports run against recent data, archives everything older than the
+retention window and times them again. A report reaching past the archive
+horizon is timed too, since it has to read the archive as well.
+
+The defaults keep the run short on SQLite; point --database-url at
+PostgreSQL and raise --stores/--movements (e.g. 500 x 100000 for a 50M-row
+ledger) for production-sized numbers.
+
+    python benchmarks/bench_archive.py --stores 20 --movements 20000 --history-days 1095
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Movement archival benchmark')
+    parser.add_argument('--stores', type=int, default=20)
+    parser.add_argument('--products', type=int, default=100, help='Products per store')
+    parser.add_argument('--movements', type=int, default=20000, help='Movements per store')
+    parser.add_argument('--history-days', type=int, default=1095, help='Days of history to spread movements over')
+    parser.add_argument('--retention-days', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    from models import InventoryMovement
+    import archive
+    import views.report as report
+
+    logging.disable(logging.INFO)
+    random.seed(42)
+
+    with app.app_context():
+        seed_stores(db, 1, args.stores + 1, args.products, args.movements, history_days=args.history_days)
+        store_id = 1
+        now = datetime.now()
+
+        queries = {
+            'movement report, last 30 days': lambda: report.fetch_movements(
+                store_id, start_date=now - timedelta(days=30), end_date=now),
+            'sales report, last 30 days': lambda: report.fetch_movements(
+                store_id, movement_type='sale', start_date=now - timedelta(days=30), end_date=now),
+            'recent movements (dashboard)': lambda: InventoryMovement.query.filter_by(store_id=store_id).order_by(
+                InventoryMovement.movement_date.desc()).limit(10).all(),
+            'sales report, last year': lambda: report.fetch_movements(
+                store_id, movement_type='sale', start_date=now - timedelta(days=365), end_date=now),
+        }
+
+        before = {name: best_of(fn, args.repeat) for name, fn in queries.items()}
+        hot_rows = InventoryMovement.query.count()
+
+        started = time.perf_counter()
+        archived = archive.archive_movements(retention_days=args.retention_days)
+        archive_seconds = time.perf_counter() - started
+        db.session.expire_all()
+
+        after = {name: best_of(fn, args.repeat) for name, fn in queries.items()}
+
+        print(f"ledger: {hot_rows} rows; archived {archived} older than {args.retention_days} days "
+              f"in {archive_seconds:.1f}s ({archived / archive_seconds:.0f} rows/s)")
+        print(f"{'query':<32} {'before ms':>10} {'after ms':>10} {'speed-up':>9}")
+        for name in queries:
+            print(f"{name:<32} {before[name]:>10.1f} {after[name]:>10.1f} {before[name] / after[name]:>8.1f}x")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
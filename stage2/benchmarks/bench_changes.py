@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: delta sync versus re-downloading a store's full catalog.
+
+Seeds one store with a large catalog, records the client's watermark, then
+changes a handful of products through the ORM (as the views do) and deletes
+a few. Compares the response size and latency of /api/store/<id>/products
+with /api/store/<id>/changes?since=<watermark>.
+
+    python benchmarks/bench_changes.py --products 100000 --changes 50
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed_get(client, path, repeat):
+    best = None
+    response = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta sync benchmark')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--changes', type=int, default=50, help='Products edited after the watermark')
+    parser.add_argument('--deletes', type=int, default=5, help='Products deleted after the watermark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    from models import Product
+
+    logging.disable(logging.INFO)
+    app.config['WTF_CSRF_ENABLED'] = False
+    random.seed(42)
+
+    with app.app_context():
+        seed_stores(db, 1, 2, args.products, 0)
+
+    client = app.test_client()
+    client.post('/auth/login', data={
+        'username': os.environ.get('ADMIN_USERNAME', 'admin'),
+        'password': os.environ.get('ADMIN_PASSWORD', 'admin_secure_password')
+    })
+
+    watermark = client.get('/api/store/1/changes?since=0').get_json()['version']
+
+    with app.app_context():
+        # seed_stores numbers store 1's products from args.products upwards
+        ids = random.sample(range(args.products, 2 * args.products), args.changes + args.deletes)
+        for product_id in ids[:args.changes]:
+            product = db.session.get(Product, product_id)
+            product.unit_price = round(product.unit_price * 1.05, 2)
+            product.current_quantity += 1
+            db.session.commit()
+        for product_id in ids[args.changes:]:
+            db.session.delete(db.session.get(Product, product_id))
+            db.session.commit()
+
+    full_ms, full = timed_get(client, '/api/store/1/products', args.repeat)
+    delta_ms, delta = timed_get(client, f'/api/store/1/changes?since={watermark}', args.repeat)
+    payload = delta.get_json()
+
+    print(f"{'request':<28} {'ms':>9} {'bytes':>12} {'products':>9} {'deleted':>8}")
+    print(f"{'full catalog':<28} {full_ms:>9.1f} {len(full.data):>12} {len(full.get_json()):>9} {'':>8}")
+    print(f"{'changes since watermark':<28} {delta_ms:>9.1f} {len(delta.data):>12} "
+          f"{len(payload['products']):>9} {len(payload['deleted']):>8}")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Benchmark: consolidated chain-wide report versus opening every store's report.
+
+Seeds a scratch database with a growing number of stores and, at each size,
+times the per-store approach (the existing single-store report queries run
+once per store) against the grouped consolidated queries, cold and cached.
+The number of SQL statements issued is reported alongside the timings.
+
+    python benchmarks/bench_consolidated.py --stores 1 10 50 100 500
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class QueryCounter:
+    """Counts statements executed on an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def seed_stores(db, first, last, products_per_store, movements_per_store, history_days=60):
+    """Bulk insert stores first..last-1 with products and sale movements"""
+    from sqlalchemy import insert
+    from models import Store, Product, InventoryMovement
+
+    now = datetime.utcnow()
+    categories = ['Grocery', 'Dairy', 'Beverages', 'Snacks', 'Household']
+
+    db.session.execute(insert(Store), [
+        {'id': s, 'name': f'Bench Store {s}', 'code': f'BENCH{s:04d}', 'is_active': True}
+        for s in range(first, last)
+    ])
+
+    products = []
+    for s in range(first, last):
+        for p in range(products_per_store):
+            products.append({
+                'id': s * products_per_store + p,
+                'name': f'Product {p}',
+                'sku': f'SKU{p:05d}',
+                'category': categories[p % len(categories)],
+                'unit_price': round(random.uniform(10, 500), 2),
+                'current_quantity': random.randint(0, 100),
+                'reorder_level': 10,
+                'store_id': s
+            })
+    db.session.execute(insert(Product), products)
+
+    movements = []
+    for s in range(first, last):
+        for _ in range(movements_per_store):
+            if len(movements) >= 100000:
+                db.session.execute(insert(InventoryMovement), movements)
+                movements = []
+            movements.append({
+                'product_id': s * products_per_store + random.randrange(products_per_store),
+                'store_id': s,
+                'movement_type': 'sale',
+                'quantity': random.randint(1, 5),
+                'unit_price': round(random.uniform(10, 500), 2),
+                'movement_date': now - timedelta(days=random.randint(0, history_days), seconds=random.randint(0, 86399))
+            })
+    if movements:
+        db.session.execute(insert(InventoryMovement), movements)
+    db.session.commit()
+
+
+def per_store_reports(db, start_date, end_date):
+    """What an admin gets today: the single-store report queries, once per store"""
+    from sqlalchemy import func
+    from models import Store, Product, InventoryMovement
+
+    results = []
+    for store in Store.query.filter_by(is_active=True).all():
+        products = Product.query.filter_by(store_id=store.id).all()
+        total_value = sum(p.current_quantity * p.unit_price for p in products)
+        low_stock = Product.query.filter(
+            Product.store_id == store.id,
+            Product.current_quantity <= Product.reorder_level
+        ).count()
+        sales = db.session.query(
+            Product.category,
+            func.sum(InventoryMovement.quantity * InventoryMovement.unit_price)
+        ).join(InventoryMovement).filter(
+            InventoryMovement.store_id == store.id,
+            InventoryMovement.movement_type == 'sale',
+            InventoryMovement.movement_date.between(start_date, end_date)
+        ).group_by(Product.category).all()
+        results.append((store.id, total_value, low_stock, sales))
+    return results
+
+
+def measure(counter, fn, repeat):
+    best = None
+    queries = 0
+    for _ in range(repeat):
+        counter.count = 0
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        queries = counter.count
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consolidated report benchmark')
+    parser.add_argument('--stores', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument('--products', type=int, default=50, help='Products per store')
+    parser.add_argument('--movements', type=int, default=200, help='Sale movements per store')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    import consolidated
+
+    logging.disable(logging.INFO)
+    random.seed(42)
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        start_date, end_date = consolidated.period_range('last30')
+
+        print(f"{'stores':>7} {'per-store ms':>13} {'queries':>8} {'grouped ms':>11} {'queries':>8} {'cached ms':>10}")
+
+        seeded = 1
+        for target in sorted(args.stores):
+            seed_stores(db, seeded, target + 1, args.products, args.movements)
+            seeded = target + 1
+
+            per_store_ms, per_store_queries = measure(
+                counter, lambda: per_store_reports(db, start_date, end_date), args.repeat)
+            grouped_ms, grouped_queries = measure(
+                counter, lambda: consolidated.build_report('last30'), args.repeat)
+
+            consolidated.get_report('last30', refresh=True)
+            cached_ms, _ = measure(counter, lambda: consolidated.get_report('last30'), args.repeat)
+
+            print(f"{target:>7} {per_store_ms:>13.1f} {per_store_queries:>8} "
+                  f"{grouped_ms:>11.1f} {grouped_queries:>8} {cached_ms:>10.3f}")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
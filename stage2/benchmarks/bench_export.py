@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: full versus incremental columnar export of the movement ledger.
+
+Seeds a scratch ledger, exports it once, appends a small batch of new
+movements and exports again. The incremental run should cost roughly in
+proportion to the new rows, and peak Python memory should track the chunk
+size rather than the ledger size.
+
+    python benchmarks/bench_export.py --stores 50 --movements 20000 --new 1000
+"""
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed_export(ledger_export, engine, output_dir, chunk_size):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = ledger_export.export_movements(engine, output_dir, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ledger export benchmark')
+    parser.add_argument('--stores', type=int, default=50)
+    parser.add_argument('--products', type=int, default=100, help='Products per store')
+    parser.add_argument('--movements', type=int, default=20000, help='Movements per store')
+    parser.add_argument('--new', type=int, default=1000, help='Movements appended before the incremental run')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from sqlalchemy import insert
+    from app import app, db
+    from bench_consolidated import seed_stores
+    from models import InventoryMovement
+    import ledger_export
+
+    logging.disable(logging.INFO)
+    random.seed(42)
+    output_dir = tempfile.mkdtemp(prefix='ledger-export-')
+
+    with app.app_context():
+        seed_stores(db, 1, args.stores + 1, args.products, args.movements)
+        total = args.stores * args.movements
+
+        result, elapsed, peak = timed_export(ledger_export, db.engine, output_dir, args.chunk_size)
+        print(f"full export:        {result['rows']:>9} rows {elapsed:7.2f}s "
+              f"{result['rows'] / elapsed:>10.0f} rows/s  peak {peak / 1e6:6.1f} MB")
+
+        db.session.execute(insert(InventoryMovement), [{
+            'product_id': args.products + random.randrange(args.products),
+            'store_id': 1,
+            'movement_type': 'sale',
+            'quantity': 1,
+            'unit_price': 10.0
+        } for _ in range(args.new)])
+        db.session.commit()
+
+        result, elapsed, peak = timed_export(ledger_export, db.engine, output_dir, args.chunk_size)
+        print(f"incremental export: {result['rows']:>9} rows {elapsed:7.2f}s "
+              f"{result['rows'] / elapsed:>10.0f} rows/s  peak {peak / 1e6:6.1f} MB "
+              f"({args.new / total:.1%} of ledger)")
+
+    shutil.rmtree(output_dir)
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
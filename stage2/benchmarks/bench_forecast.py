@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark: fit demand models for a large synthetic catalog.
+
+Generates a Poisson day x product sales matrix (100k SKUs x 365 days by
+default) and times the vectorised fitting and reorder level computation.
+
+    python benchmarks/bench_forecast.py --products 100000 --days 365
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import forecasting
+
+
+def timed(label, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print(f"{label:<28} {time.perf_counter() - started:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forecasting benchmark')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    # Skewed demand: a few fast movers, a long tail of slow ones
+    rates = rng.pareto(1.5, size=args.products).astype(np.float32)
+    quantities = timed("generate matrix", lambda: rng.poisson(rates, size=(args.days, args.products)).astype(np.float32))
+    lead_times = rng.integers(2, 15, size=args.products)
+
+    print(f"matrix: {args.days} days x {args.products} products "
+          f"({quantities.nbytes / 1e6:.0f} MB)")
+
+    demand, deviation = timed("exponential smoothing", forecasting.exponential_smoothing, quantities)
+    timed("  reorder levels", forecasting.suggest_reorder_levels, demand, deviation, lead_time_days=lead_times)
+
+    demand, deviation = timed("moving average", forecasting.moving_average, quantities)
+    timed("  reorder levels", forecasting.suggest_reorder_levels, demand, deviation, lead_time_days=lead_times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark: group commit versus one commit per sale.
+
+Concurrent clients (threads) record sales of random products in one store.
+The baseline commits each sale with movements.record_movement(), as the
+sales view does by default; the group commit runs submit them to a
+group_commit.SaleBatcher with increasing batch windows. For every client
+count it prints throughput and latency percentiles, i.e. one point of each
+throughput/latency curve.
+
+    python benchmarks/bench_group_commit.py --clients 1,4,16,64 --windows 2,5,10
+    python benchmarks/bench_group_commit.py --database-url postgresql://localhost/kiryana_bench
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run_clients(app, clients, sales_per_client, product_ids, record):
+    """Record sales from concurrent clients; returns (sales/s, latencies in ms)"""
+    latencies = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client(seed):
+        rng = random.Random(seed)
+        own = []
+        with app.app_context():
+            start.wait()
+            for _ in range(sales_per_client):
+                began = time.perf_counter()
+                record(rng.choice(product_ids))
+                own.append((time.perf_counter() - began) * 1000)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - began), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group commit benchmark')
+    parser.add_argument('--clients', default='1,4,16,64', help='Comma-separated concurrent client counts')
+    parser.add_argument('--windows', default='2,5,10', help='Comma-separated batch windows in ms')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--sales', type=int, default=100, help='Sales per client')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from sqlalchemy import update
+    from sqlalchemy.exc import OperationalError
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    from group_commit import SaleBatcher
+    from models import Product, InventoryMovement
+    from movements import record_movement
+
+    logging.disable(logging.INFO)
+    client_counts = [int(n) for n in args.clients.split(',')]
+
+    with app.app_context():
+        seed_stores(db, 1, 2, args.products, 0)
+        db.session.execute(update(Product).values(current_quantity=10 ** 9))
+        db.session.commit()
+    # seed_stores numbers store 1's products from args.products upwards
+    product_ids = list(range(args.products, 2 * args.products))
+
+    def new_sale(product_id):
+        return InventoryMovement(product_id=product_id, store_id=1, movement_type='sale', quantity=1, unit_price=1.0)
+
+    def commit_each(product_id):
+        while True:
+            try:
+                record_movement(new_sale(product_id), db.session.get(Product, product_id))
+                return
+            except OperationalError:
+                # Lock timeouts (e.g. "database is locked" on SQLite)
+                db.session.rollback()
+
+    print(f"{'mode':<16} {'clients':>7} {'sales/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    def report(mode, clients, throughput, latencies):
+        print(f"{mode:<16} {clients:>7} {throughput:>9.0f} {percentile(latencies, 50):>8.2f} "
+              f"{percentile(latencies, 95):>8.2f} {percentile(latencies, 99):>8.2f}")
+
+    for clients in client_counts:
+        throughput, latencies = run_clients(app, clients, args.sales, product_ids, commit_each)
+        report('commit per sale', clients, throughput, latencies)
+
+    for window in (int(w) for w in args.windows.split(',')):
+        batcher = SaleBatcher(app, window_ms=window, batch_size=args.batch_size)
+        for clients in client_counts:
+            throughput, latencies = run_clients(
+                app, clients, args.sales, product_ids,
+                lambda product_id: batcher.submit(new_sale(product_id))
+            )
+            report(f'group {window} ms', clients, throughput, latencies)
+
+    with app.app_context():
+        recorded = InventoryMovement.query.count()
+        expected = args.sales * sum(client_counts) * (1 + len(args.windows.split(',')))
+        print(f"Recorded {recorded} sales (expected {expected})")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: concurrent sales of one hot product, with and without stock shards.
+
+Each terminal is a thread with its own session that records sales of the
+same product through movements.record_movement(), as the sales view does.
+Without shards every sale updates the product row, so terminals queue on
+its row lock; with shards they spread over N counter rows. Prints sales per
+second and median latency for each terminal count.
+
+Row locks need a server database; SQLite takes one lock for the whole file
+and will not scale either way:
+
+    python benchmarks/bench_hot_sku.py --database-url postgresql://localhost/kiryana_bench \\
+        --terminals 1,2,4,8,16 --shards 8
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_terminals(app, db, product_id, terminals, sales_per_terminal):
+    """Record sales from concurrent terminals; returns (sales/s, median ms, retries)"""
+    from sqlalchemy.exc import OperationalError
+    from models import Product, InventoryMovement
+    from movements import record_movement
+
+    latencies = []
+    retries = [0]
+    lock = threading.Lock()
+    start = threading.Barrier(terminals + 1)
+
+    def terminal():
+        own = []
+        with app.app_context():
+            start.wait()
+            for _ in range(sales_per_terminal):
+                began = time.perf_counter()
+                while True:
+                    try:
+                        product = db.session.get(Product, product_id)
+                        record_movement(InventoryMovement(
+                            product_id=product_id,
+                            store_id=product.store_id,
+                            movement_type='sale',
+                            quantity=1,
+                            unit_price=product.unit_price
+                        ), product)
+                        break
+                    except OperationalError:
+                        # Lock timeouts (e.g. "database is locked" on SQLite)
+                        db.session.rollback()
+                        with lock:
+                            retries[0] += 1
+                own.append(time.perf_counter() - began)
+                db.session.expire_all()
+            db.session.remove()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=terminal) for _ in range(terminals)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    return len(latencies) / elapsed, statistics.median(latencies) * 1000, retries[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot product contention benchmark')
+    parser.add_argument('--terminals', default='1,2,4,8', help='Comma-separated terminal counts')
+    parser.add_argument('--sales', type=int, default=200, help='Sales per terminal')
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    from models import Product
+    from shards import fold_shards, set_shard_count
+
+    logging.disable(logging.INFO)
+    terminal_counts = [int(n) for n in args.terminals.split(',')]
+
+    with app.app_context():
+        seed_stores(db, 1, 2, 10, 0)
+        # seed_stores numbers store 1's products from 10 upwards
+        product_id = 10
+        product = db.session.get(Product, product_id)
+        product.current_quantity = 10 ** 9
+        db.session.commit()
+
+    print(f"{'mode':<10} {'terminals':>9} {'sales/s':>10} {'p50 ms':>8} {'retries':>8}")
+    for shard_count in (0, args.shards):
+        with app.app_context():
+            set_shard_count(db.session.get(Product, product_id), shard_count)
+        mode = f'{shard_count} shards' if shard_count else 'row'
+
+        for terminals in terminal_counts:
+            throughput, p50, retries = run_terminals(app, db, product_id, terminals, args.sales)
+            print(f"{mode:<10} {terminals:>9} {throughput:>10.0f} {p50:>8.2f} {retries:>8}")
+
+        with app.app_context():
+            fold_shards()
+
+    with app.app_context():
+        product = db.session.get(Product, product_id)
+        expected = 10 ** 9 - 2 * sum(terminal_counts) * args.sales
+        print(f"Final quantity {product.current_quantity} (expected {expected})")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
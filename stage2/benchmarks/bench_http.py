@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end HTTP latency of the hot endpoints.
+
+Concurrent clients (threads), each logged in with its own session, request
+one endpoint at a time: the store dashboard, the product API, a sale POST,
+the sales report and the sales chart data. For every endpoint and client
+count it prints p50/p95/p99 latency, throughput, SQL statements per request
+and the number of failed (4xx/5xx) responses.
+
+Two modes drive the same application:
+
+    client    Flask's test client in this process; measures the app and the
+              database without any network or server overhead.
+    gunicorn  A local gunicorn server on --port, requested over HTTP, so
+              worker and thread settings are part of the measurement.
+
+Without --database-url a scratch SQLite file is filled by
+generate_dataset.py first. Results can be saved as a JSON baseline and
+compared with one saved by an earlier version:
+
+    python benchmarks/bench_http.py --clients 1,8 --output before.json
+    python benchmarks/bench_http.py --clients 1,8 --compare before.json
+    python benchmarks/bench_http.py --mode gunicorn --workers 4 --threads 4 \\
+        --database-url postgresql://localhost/kiryana_bench --store-id 3
+
+With --trace-memory the server traces every request with tracemalloc (see
+memtrack.py) and the peak allocation is recorded next to the timings, which
+are then inflated by the tracing. Only one request per process is traced at
+a time, so use one client to trace every request.
+
+The sale POST records real sales (one unit of a random product per request);
+leave it out with --endpoints when pointing at a database you want to keep.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(APP_DIR)
+sys.path.append(BENCH_DIR)
+
+# Endpoint -> (method, path); {store} is replaced by --store-id
+ENDPOINTS = {
+    'store.dashboard': ('GET', '/store/{store}/dashboard'),
+    'api.get_products': ('GET', '/api/store/{store}/products'),
+    'inventory.sales': ('POST', '/inventory/store/{store}/sales'),
+    'report.sales_report': ('GET', '/report/store/{store}/sales?period=last30'),
+    'report.sales_chart_data': ('GET', '/report/store/{store}/chart/sales?period=last30'),
+}
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+# Set by memtrack.py on requests traced with tracemalloc
+MEMORY_PEAK_HEADER = 'X-Memory-Peak'
+
+
+def instrumented_app():
+    """The application with a per-request SQL statement count header
+
+    Also the gunicorn entry point ('bench_http:instrumented_app()'), so both
+    modes count queries the same way. CSRF checks are turned off so the
+    clients can log in and post without scraping tokens.
+    """
+    from flask import g, has_request_context
+    from sqlalchemy import event
+
+    from app import app, db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    def count_query(*args, **kwargs):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    @app.after_request
+    def add_query_count(response):
+        response.headers[QUERY_COUNT_HEADER] = str(g.get('query_count', 0))
+        return response
+
+    return app
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class TestClient:
+    """One logged-in session on the in-process test client"""
+
+    def __init__(self, app, username, password):
+        self.client = app.test_client()
+        self.request('POST', '/auth/login', {'username': username, 'password': password})
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers
+
+
+class HttpClient:
+    """One logged-in session over a keep-alive HTTP connection"""
+
+    def __init__(self, host, port, username, password):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookies = SimpleCookie()
+        self.request('POST', '/auth/login', {'username': username, 'password': password})
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v.value}' for k, v in self.cookies.items())
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(cookie)
+        return response.status, response.headers
+
+
+def run_endpoint(make_client, clients, requests_per_client, method, path, form):
+    """Request one endpoint from concurrent clients; returns a result dict"""
+    latencies = []
+    queries = []
+    peaks = []
+    errors = [0]
+    lock = threading.Lock()
+    sessions = [make_client() for _ in range(clients)]
+    start = threading.Barrier(clients + 1)
+
+    def client(session, seed):
+        rng = random.Random(seed)
+        own_latencies, own_queries, own_peaks, own_errors = [], [], [], 0
+        start.wait()
+        for _ in range(requests_per_client):
+            data = form(rng) if form else None
+            began = time.perf_counter()
+            status, headers = session.request(method, path, data)
+            own_latencies.append((time.perf_counter() - began) * 1000)
+            own_queries.append(int(headers.get(QUERY_COUNT_HEADER, 0)))
+            if headers.get(MEMORY_PEAK_HEADER):
+                own_peaks.append(int(headers[MEMORY_PEAK_HEADER]) / 1024)
+            if status >= 400:
+                own_errors += 1
+        with lock:
+            latencies.extend(own_latencies)
+            queries.extend(own_queries)
+            peaks.extend(own_peaks)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client, args=(s, i)) for i, s in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_per_request': sum(queries) / len(queries),
+    }
+    if peaks:
+        result.update(peak_kib_p50=percentile(peaks, 50), peak_kib_max=max(peaks))
+    return result
+
+
+def generate_scratch_dataset(database_url, stores, products, sales):
+    subprocess.run([
+        sys.executable, os.path.join(BENCH_DIR, 'generate_dataset.py'),
+        '--stores', str(stores), '--products', str(products), '--sales', str(sales),
+        '--years', '1', '--database-url', database_url
+    ], check=True, stdout=subprocess.DEVNULL)
+
+
+def dataset_summary(app, db, store_id):
+    """Row counts recorded with the results, and the store's sellable products"""
+    from models import Store, Product, InventoryMovement
+
+    with app.app_context():
+        products = db.session.execute(
+            db.select(Product.id, Product.unit_price)
+            .where(Product.store_id == store_id, Product.current_quantity > 0)
+        ).all()
+        summary = {
+            'dialect': db.engine.dialect.name,
+            'stores': Store.query.count(),
+            'products': Product.query.count(),
+            'movements': InventoryMovement.query.count(),
+            'store_id': store_id,
+        }
+    return summary, [tuple(p) for p in products]
+
+
+def start_gunicorn(args, env):
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{args.port}',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--chdir', BENCH_DIR,
+        '--log-level', 'warning',
+        'bench_http:instrumented_app()'
+    ], env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('gunicorn exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn did not start listening within 60 s')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """Print the change of each result against a saved baseline"""
+    print(f"\nChange against baseline {baseline['meta'].get('revision')} ({baseline['meta'].get('created_at')}):")
+    print(f"{'endpoint':<26} {'clients':>7} {'p50':>8} {'p99':>8} {'req/s':>8} {'queries':>8} {'peak mem':>8}")
+    for name, by_clients in results.items():
+        for clients, result in by_clients.items():
+            old = baseline['results'].get(name, {}).get(clients)
+            if not old:
+                continue
+
+            def change(key):
+                if not old.get(key) or key not in result:
+                    return '    n/a'
+                return f"{(result[key] - old[key]) / old[key] * 100:+7.0f}%"
+
+            print(f"{name:<26} {clients:>7} {change('p50_ms')} {change('p99_ms')} "
+                  f"{change('throughput')} {result['queries_per_request'] - old['queries_per_request']:+8.1f} "
+                  f"{change('peak_kib_max')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end HTTP benchmark')
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated endpoint names')
+    parser.add_argument('--clients', default='1,8', help='Comma-separated concurrent client counts')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per client per endpoint')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per endpoint')
+    parser.add_argument('--store-id', type=int, default=1)
+    parser.add_argument('--username', default=os.environ.get('ADMIN_USERNAME', 'admin'))
+    parser.add_argument('--password', default=os.environ.get('ADMIN_PASSWORD', 'admin_secure_password'))
+    parser.add_argument('--database-url', help='Database to benchmark (default: a generated scratch SQLite file)')
+    parser.add_argument('--stores', type=int, default=2, help='Stores in the generated dataset')
+    parser.add_argument('--products', type=int, default=500, help='Products per store in the generated dataset')
+    parser.add_argument('--sales', type=int, default=20000, help='Sales lines per store in the generated dataset')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record peak memory per request with tracemalloc (inflates latencies)')
+    parser.add_argument('--output', help='Save the results as a JSON baseline')
+    parser.add_argument('--compare', help='JSON baseline to compare the results with')
+    args = parser.parse_args()
+
+    names = args.endpoints.split(',')
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+        generate_scratch_dataset(os.environ['DATABASE_URL'], args.stores, args.products, args.sales)
+    # Errors should be answered with a 500, not raised into the client
+    os.environ['FLASK_DEBUG'] = '0'
+    if args.trace_memory:
+        os.environ['MEMORY_SAMPLE_RATE'] = '1'
+
+    # Failing requests are counted in the errors column instead of logged
+    logging.disable(logging.ERROR)
+    app = instrumented_app()
+    from app import db
+
+    dataset, products = dataset_summary(app, db, args.store_id)
+    if not products and 'inventory.sales' in names:
+        parser.error(f'store {args.store_id} has no products in stock to sell')
+
+    def sale_form(rng):
+        product_id, unit_price = rng.choice(products)
+        return {
+            'product_id': product_id,
+            'quantity': 1,
+            'unit_price': unit_price,
+            'idempotency_key': uuid.uuid4().hex,
+        }
+
+    server = None
+    if args.mode == 'gunicorn':
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([APP_DIR, BENCH_DIR]))
+        server = start_gunicorn(args, env)
+
+        def make_client():
+            return HttpClient('127.0.0.1', args.port, args.username, args.password)
+    else:
+        def make_client():
+            return TestClient(app, args.username, args.password)
+
+    results = {}
+    try:
+        print(f"{'endpoint':<26} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'queries':>8} {'errors':>7} {'peak KiB':>9}")
+        for name in names:
+            method, path = ENDPOINTS[name]
+            path = path.format(store=args.store_id)
+            form = sale_form if method == 'POST' else None
+            if args.warmup:
+                run_endpoint(make_client, 1, args.warmup, method, path, form)
+            results[name] = {}
+            for clients in (int(n) for n in args.clients.split(',')):
+                result = run_endpoint(make_client, clients, args.requests, method, path, form)
+                results[name][str(clients)] = result
+                print(f"{name:<26} {clients:>7} {result['throughput']:>8.0f} {result['p50_ms']:>8.2f} "
+                      f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                      f"{result['queries_per_request']:>8.1f} {result['errors']:>7} "
+                      f"{result.get('peak_kib_max', 0):>9.0f}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        meta = {
+            'revision': git_revision(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'mode': args.mode,
+            'requests_per_client': args.requests,
+            'trace_memory': args.trace_memory,
+            'dataset': dataset,
+        }
+        if args.mode == 'gunicorn':
+            meta.update(workers=args.workers, threads=args.threads)
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
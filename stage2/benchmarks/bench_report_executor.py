@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-store analytic reports computed serially and over a process pool.
+
+Seeds a scratch database and runs report_executor.run_reports for every store
+with an increasing number of worker processes. Speed-up is bounded by the
+number of cores and, for SQLite, by the single database file.
+
+    python benchmarks/bench_report_executor.py --stores 200 --workers 1 2 4 8
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel report executor benchmark')
+    parser.add_argument('--stores', type=int, default=200)
+    parser.add_argument('--products', type=int, default=200, help='Products per store')
+    parser.add_argument('--movements', type=int, default=2000, help='Sale movements per store')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    import report_executor
+
+    logging.disable(logging.INFO)
+    random.seed(42)
+
+    with app.app_context():
+        seed_stores(db, 1, args.stores + 1, args.products, args.movements)
+        database_url = db.engine.url.render_as_string(hide_password=False)
+
+    store_ids = list(range(1, args.stores + 1))
+    print(f"{args.stores} stores, {args.products} products and {args.movements} movements each, "
+          f"{os.cpu_count()} CPU(s)")
+    print(f"{'workers':>8} {'seconds':>9} {'stores/s':>9} {'speed-up':>9}")
+
+    baseline = None
+    for workers in args.workers:
+        started = time.perf_counter()
+        report_executor.run_reports(store_ids, database_url, days=args.days, workers=workers)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {args.stores / elapsed:>9.1f} {baseline / elapsed:>8.2f}x")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
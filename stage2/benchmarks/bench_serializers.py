@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: API product list serialization, ORM + jsonify versus schema rows.
+
+Seeds one store with a large catalog and times building the
+/api/store/<id>/products response body three ways: the previous ORM
+instances + dict comprehension + jsonify path, the schema path encoded with
+the standard json module, and the schema path encoded with orjson. Query
+time is included, since fetching ORM instances is part of the old cost.
+
+    python benchmarks/bench_serializers.py --products 50000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def orm_jsonify(db, store_id):
+    """The api blueprint's previous implementation"""
+    from flask import jsonify
+    from models import Product
+
+    products = Product.query.filter_by(store_id=store_id).all()
+    products_json = [{
+        'id': p.id,
+        'name': p.name,
+        'sku': p.sku,
+        'barcode': p.barcode,
+        'category': p.category,
+        'unit_price': p.unit_price,
+        'current_quantity': p.current_quantity,
+        'reorder_level': p.reorder_level,
+        'is_low_stock': p.is_low_stock()
+    } for p in products]
+    body = jsonify(products_json).get_data()
+    db.session.expunge_all()
+    return body
+
+
+def schema_rows(db, store_id):
+    from models import Product
+    from serializers import PRODUCT, json_response
+
+    rows = db.session.execute(PRODUCT.select().where(Product.store_id == store_id))
+    return json_response(PRODUCT.rows(rows)).get_data()
+
+
+def measure(fn, repeat):
+    best = None
+    body = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API serialization benchmark')
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url', help='Database to seed (default: a scratch SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app, db
+    from bench_consolidated import seed_stores
+    import serializers
+
+    logging.disable(logging.INFO)
+    # Compare against production output; debug mode pretty-prints jsonify
+    app.json.compact = True
+
+    with app.app_context(), app.test_request_context():
+        seed_stores(db, 1, 2, args.products, 0)
+
+        orjson = serializers.orjson
+        results = [('orm + jsonify', measure(lambda: orm_jsonify(db, 1), args.repeat))]
+
+        serializers.orjson = None
+        results.append(('schema + json', measure(lambda: schema_rows(db, 1), args.repeat)))
+        serializers.orjson = orjson
+        if orjson is not None:
+            results.append(('schema + orjson', measure(lambda: schema_rows(db, 1), args.repeat)))
+
+        baseline = results[0][1][0]
+        print(f"{'path':<16} {'ms':>9} {'rows/s':>12} {'speedup':>8} {'bytes':>10}")
+        for name, (elapsed, size) in results:
+            print(f"{name:<16} {elapsed * 1000:>9.1f} {args.products / elapsed:>12,.0f} "
+                  f"{baseline / elapsed:>7.1f}x {size:>10}")
+
+    if scratch:
+        os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for load tests and benchmarks.
+
+Creates N stores with M products each, a shared supplier base, and years of
+trading history. Sales follow a Zipf distribution over each store's products
+(a few fast movers, a long tail) with busier weekends, and are grouped into
+sales orders with their sale movements. Every week each store buys back what
+it sold from each product's supplier, as a received purchase order with
+stock-in movements, so stock levels stay plausible.
+
+History is generated in parallel worker processes, one store and a few
+weeks at a time. On PostgreSQL each worker loads its rows with COPY (or
+executemany without psycopg2); SQLite allows a single writer, so workers
+only generate and the parent inserts with executemany.
+
+    # ~50M movements: 100 stores x 500k sales lines over 3 years
+    python benchmarks/generate_dataset.py --stores 100 --products 2000 \\
+        --sales 500000 --years 3 --database-url postgresql://localhost/kiryana_bench
+
+    python benchmarks/generate_dataset.py --stores 5 --products 500 --sales 20000 \\
+        --database-url sqlite:///kiryana_bench.db
+
+Rows are inserted with explicit IDs past the current maximum, so the
+generator can add to an existing database. It bypasses the ORM hooks, so no
+outbox events or revisions are written for the generated history.
+"""
+
+import argparse
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = ['Grocery', 'Dairy', 'Beverages', 'Snacks', 'Household', 'Personal Care', 'Bakery', 'Frozen']
+PAYMENT_METHODS = ['cash', 'card', 'upi']
+# Relative sales by weekday, Monday first
+WEEKDAY_WEIGHTS = np.array([0.9, 0.85, 0.9, 0.95, 1.1, 1.3, 1.25])
+
+MOVEMENT_COLUMNS = ('product_id', 'store_id', 'movement_type', 'quantity', 'unit_price',
+                    'reference', 'movement_date', 'created_at')
+SALES_ORDER_COLUMNS = ('id', 'store_id', 'order_number', 'status', 'payment_method', 'payment_status',
+                       'created_at', 'updated_at')
+SALES_ITEM_COLUMNS = ('sales_order_id', 'product_id', 'quantity', 'unit_price', 'discount_percent', 'created_at')
+PURCHASE_ORDER_COLUMNS = ('id', 'supplier_id', 'store_id', 'order_number', 'status', 'expected_delivery_date',
+                          'created_at', 'updated_at')
+PURCHASE_ITEM_COLUMNS = ('purchase_order_id', 'product_id', 'quantity_ordered', 'quantity_received',
+                         'unit_price', 'created_at')
+
+# Set in each worker process
+_engine = None
+
+
+def write_rows(conn, table, columns, rows):
+    """Bulk insert rows (tuples) with COPY on psycopg2, executemany otherwise"""
+    if not rows:
+        return
+    if conn.dialect.name == 'postgresql' and conn.dialect.driver == 'psycopg2':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        return
+    placeholder = '?' if conn.dialect.paramstyle == 'qmark' else '%s'
+    conn.exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})",
+        rows
+    )
+
+
+def zipf_weights(count, exponent, rng):
+    """Sales probability of each product: Zipf over a random popularity ranking"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def to_datetimes(values):
+    """Timestamps as strings in SQLAlchemy's SQLite format, which PostgreSQL also parses
+
+    Formatting in the workers keeps the single SQLite writer from spending
+    its time in the driver's datetime adapter.
+    """
+    return np.char.replace(np.datetime_as_string(values, unit='us'), 'T', ' ').tolist()
+
+
+def generate_chunk(task):
+    """Sales and purchases of one store over a few weeks, as {table: rows}"""
+    (store_id, chunk, weeks, start_day, plan) = task
+    rng = np.random.default_rng([plan['seed'], store_id, chunk])
+
+    product_ids = plan['product_base'] + plan['store_index'][store_id] * plan['products'] + np.arange(plan['products'])
+    prices = plan['prices'][store_id]
+    costs = plan['costs'][store_id]
+    suppliers = plan['suppliers'][store_id]
+    popularity = plan['popularity'][store_id]
+
+    days = np.arange(start_day, start_day + weeks * 7, dtype='datetime64[D]')
+    day_weights = WEEKDAY_WEIGHTS[(days.astype('int64') + 3) % 7]  # 1970-01-01 was a Thursday
+    lines = int(round(plan['lines_per_week'] * weeks))
+
+    # Sale lines, in time order
+    picks = rng.choice(len(product_ids), size=lines, p=popularity)
+    quantities = 1 + rng.poisson(0.6, size=lines)
+    line_days = rng.choice(days, size=lines, p=day_weights / day_weights.sum())
+    seconds = rng.integers(8 * 3600, 22 * 3600, size=lines)
+    times = line_days.astype('datetime64[s]') + seconds.astype('timedelta64[s]')
+    order = np.argsort(times, kind='stable')
+    picks, quantities, times = picks[order], quantities[order], times[order]
+
+    # Consecutive lines form one order
+    sizes = 1 + rng.poisson(1.5, size=lines)
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    starts = starts[starts < lines]
+    order_of_line = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, lines)))
+
+    # Each chunk owns a range of IDs and per-store numbers; unused ones are gaps
+    store_offset = plan['store_index'][store_id] * plan['chunks']
+    first_number = chunk * plan['order_stride'] + 1
+    order_ids = (plan['order_base'] + store_offset * plan['order_stride'] + first_number - 1 + np.arange(len(starts))).tolist()
+    numbers = [f"SO-{store_id}-{n:06d}" for n in range(first_number, first_number + len(starts))]
+    order_times = to_datetimes(times[starts])
+    methods = rng.choice(PAYMENT_METHODS, size=len(starts)).tolist()
+
+    line_times = to_datetimes(times)
+    line_products = product_ids[picks].tolist()
+    line_quantities = quantities.tolist()
+    line_prices = prices[picks].tolist()
+    line_orders = order_of_line.tolist()
+
+    result = {
+        'sales_order': [
+            (oid, store_id, number, 'completed', method, 'paid', created, created)
+            for oid, number, method, created in zip(order_ids, numbers, methods, order_times)
+        ],
+        'sales_order_item': [
+            (order_ids[o], pid, qty, price, 0.0, created)
+            for o, pid, qty, price, created in zip(line_orders, line_products, line_quantities, line_prices, line_times)
+        ],
+        'inventory_movement': [
+            (pid, store_id, 'sale', qty, price, numbers[o], created, created)
+            for o, pid, qty, price, created in zip(line_orders, line_products, line_quantities, line_prices, line_times)
+        ],
+        'purchase_order': [],
+        'purchase_order_item': [],
+    }
+
+    # Weekly restock of what was sold, one received purchase order per supplier
+    po_number = chunk * plan['po_stride'] + 1
+    po_id = plan['po_base'] + store_offset * plan['po_stride'] + po_number - 1
+    week_of_line = ((times.astype('datetime64[D]') - days[0]).astype('int64') // 7)
+    restocked = np.zeros(len(product_ids), dtype=np.int64)
+    for week in range(weeks):
+        in_week = week_of_line == week
+        sold = np.bincount(picks[in_week], weights=quantities[in_week], minlength=len(product_ids)).astype(np.int64)
+        ordered_at = (days[0] + week * 7 + 7).astype('datetime64[s]') + np.timedelta64(7 * 3600, 's')
+        received_at = to_datetimes(np.array([ordered_at]))[0]
+        for supplier_id in np.unique(suppliers[sold > 0]).tolist():
+            items = np.nonzero((sold > 0) & (suppliers == supplier_id))[0]
+            number = f"PO-{store_id}-{po_number:06d}"
+            result['purchase_order'].append(
+                (po_id, supplier_id, store_id, number, 'received', received_at[:10], received_at, received_at)
+            )
+            for i in items.tolist():
+                quantity = int(sold[i])
+                result['purchase_order_item'].append((po_id, product_ids[i].item(), quantity, quantity,
+                                                      costs[i].item(), received_at))
+                result['inventory_movement'].append((product_ids[i].item(), store_id, 'stock_in', quantity,
+                                                     costs[i].item(), number, received_at, received_at))
+                restocked[i] += quantity
+            po_id += 1
+            po_number += 1
+
+    net = restocked - np.bincount(picks, weights=quantities, minlength=len(product_ids)).astype(np.int64)
+    return store_id, result, net
+
+
+def load_chunk(task):
+    """Generate a chunk and insert it from this worker (servers with row locking)"""
+    store_id, result, net = generate_chunk(task)
+    with _engine.begin() as conn:
+        insert_chunk(conn, result)
+    return store_id, None, net
+
+
+def insert_chunk(conn, result):
+    write_rows(conn, 'sales_order', SALES_ORDER_COLUMNS, result['sales_order'])
+    write_rows(conn, 'sales_order_item', SALES_ITEM_COLUMNS, result['sales_order_item'])
+    write_rows(conn, 'purchase_order', PURCHASE_ORDER_COLUMNS, result['purchase_order'])
+    write_rows(conn, 'purchase_order_item', PURCHASE_ITEM_COLUMNS, result['purchase_order_item'])
+    write_rows(conn, 'inventory_movement', MOVEMENT_COLUMNS, result['inventory_movement'])
+
+
+def init_worker(database_url):
+    global _engine
+    from sqlalchemy import create_engine
+    _engine = create_engine(database_url)
+
+
+def next_id(conn, table):
+    return (conn.exec_driver_sql(f"SELECT MAX(id) FROM {table}").scalar() or 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic inventory dataset')
+    parser.add_argument('--stores', type=int, default=10)
+    parser.add_argument('--products', type=int, default=1000, help='Products per store')
+    parser.add_argument('--sales', type=int, default=100000, help='Sale lines per store over the whole history')
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--suppliers', type=int, default=20)
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of product popularity')
+    parser.add_argument('--chunk-weeks', type=int, default=4, help='Weeks of history per worker task')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', help='Target database (default: DATABASE_URL)')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    if not os.environ.get('DATABASE_URL'):
+        parser.error('--database-url or DATABASE_URL is required')
+
+    # Creates any missing tables
+    from app import app, db
+    from models import DocumentSequence
+
+    logging.disable(logging.INFO)
+    with app.app_context():
+        engine = db.engine
+    database_url = engine.url.render_as_string(hide_password=False)
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+
+    weeks = max(1, int(round(args.years * 52)))
+    chunks = (weeks + args.chunk_weeks - 1) // args.chunk_weeks
+    first_day = np.datetime64(date.today() - timedelta(weeks=weeks), 'D')
+
+    with engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+
+        store_base = next_id(conn, 'store')
+        product_base = next_id(conn, 'product')
+        supplier_base = next_id(conn, 'supplier')
+        now = datetime.utcnow()
+        store_ids = list(range(store_base, store_base + args.stores))
+
+        write_rows(conn, 'store', ('id', 'name', 'code', 'location', 'is_active', 'created_at', 'updated_at'), [
+            (s, f'Synthetic Store {s}', f'SYN{s:05d}', f'City {s % 50}', True, now, now) for s in store_ids
+        ])
+        supplier_ids = list(range(supplier_base, supplier_base + args.suppliers))
+        write_rows(conn, 'supplier', ('id', 'name', 'contact_name', 'email', 'is_active', 'created_at', 'updated_at'), [
+            (s, f'Supplier {s}', f'Contact {s}', f'orders{s}@supplier.example.com', True, now, now) for s in supplier_ids
+        ])
+
+        plan = {
+            'seed': args.seed,
+            'products': args.products,
+            'product_base': product_base,
+            'store_index': {s: i for i, s in enumerate(store_ids)},
+            'chunks': chunks,
+            'lines_per_week': args.sales / weeks,
+            # Upper bounds on the orders of one chunk, so every chunk owns an ID range
+            'order_stride': int(args.sales / weeks * args.chunk_weeks) + 1,
+            'po_stride': args.chunk_weeks * args.suppliers,
+            'order_base': next_id(conn, 'sales_order'),
+            'po_base': next_id(conn, 'purchase_order'),
+            'prices': {}, 'costs': {}, 'suppliers': {}, 'popularity': {},
+        }
+
+        initial = {}
+        for index, store_id in enumerate(store_ids):
+            prices = np.round(rng.lognormal(3.5, 0.8, size=args.products), 2)
+            costs = np.round(prices * rng.uniform(0.7, 0.85, size=args.products), 2)
+            product_suppliers = rng.choice(supplier_ids, size=args.products)
+            quantities = rng.integers(20, 200, size=args.products)
+            first_id = product_base + index * args.products
+            plan['prices'][store_id] = prices
+            plan['costs'][store_id] = costs
+            plan['suppliers'][store_id] = product_suppliers
+            plan['popularity'][store_id] = zipf_weights(args.products, args.zipf, rng)
+            initial[store_id] = quantities
+
+            write_rows(conn, 'product', ('id', 'name', 'sku', 'category', 'unit_price', 'cost_price',
+                                         'current_quantity', 'reorder_level', 'store_id', 'created_at',
+                                         'updated_at', 'updated_version', 'shard_count'), [
+                (first_id + p, f'Product {p}', f'SKU{p:06d}', CATEGORIES[p % len(CATEGORIES)], prices[p].item(),
+                 costs[p].item(), quantities[p].item(), 10, store_id, now, now, 0, 0)
+                for p in range(args.products)
+            ])
+            write_rows(conn, 'supplier_product', ('supplier_id', 'product_id', 'supplier_sku', 'cost_price',
+                                                  'lead_time_days', 'minimum_order_quantity', 'is_preferred',
+                                                  'created_at', 'updated_at'), [
+                (product_suppliers[p].item(), first_id + p, f'SUP-{first_id + p}', costs[p].item(), 2, 1, True, now, now)
+                for p in range(args.products)
+            ])
+
+    print(f"Created {args.stores} stores, {args.stores * args.products} products, {args.suppliers} suppliers "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    tasks = [
+        (store_id, chunk, min(args.chunk_weeks, weeks - chunk * args.chunk_weeks),
+         first_day + chunk * args.chunk_weeks * 7, plan)
+        for store_id in store_ids for chunk in range(chunks)
+    ]
+    net = {store_id: np.zeros(args.products, dtype=np.int64) for store_id in store_ids}
+    single_writer = engine.dialect.name == 'sqlite'
+    history_started = time.perf_counter()
+    movements = 0
+
+    with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(database_url,)) as pool:
+        if single_writer:
+            # Workers generate, the parent inserts
+            with engine.begin() as conn:
+                conn.exec_driver_sql("PRAGMA synchronous=OFF")
+                for done, (store_id, result, delta) in enumerate(pool.imap_unordered(generate_chunk, tasks), 1):
+                    insert_chunk(conn, result)
+                    net[store_id] += delta
+                    movements += len(result['inventory_movement'])
+                    if done % 50 == 0 or done == len(tasks):
+                        print(f"  {done}/{len(tasks)} chunks, {movements:,} movements", end='\r')
+        else:
+            for done, (store_id, _, delta) in enumerate(pool.imap_unordered(load_chunk, tasks), 1):
+                net[store_id] += delta
+                if done % 50 == 0 or done == len(tasks):
+                    print(f"  {done}/{len(tasks)} chunks", end='\r')
+    print()
+
+    with engine.begin() as conn:
+        # Stock on hand after the generated history
+        conn.exec_driver_sql(
+            "UPDATE product SET current_quantity = " + ('?' if conn.dialect.paramstyle == 'qmark' else '%s') +
+            " WHERE id = " + ('?' if conn.dialect.paramstyle == 'qmark' else '%s'),
+            [(int(max(0, initial[s][p] + net[s][p])), product_base + i * args.products + p)
+             for i, s in enumerate(store_ids) for p in range(args.products)]
+        )
+
+        # Let the number allocator continue after the generated documents
+        for table, doc_type in (('sales_order', 'sales_order'), ('purchase_order', 'purchase_order')):
+            rows = conn.exec_driver_sql(f"SELECT store_id, order_number FROM {table} WHERE id IN "
+                                        f"(SELECT MAX(id) FROM {table} GROUP BY store_id)").all()
+            sequences = DocumentSequence.__table__
+            for store_id, number in rows:
+                if store_id not in plan['store_index']:
+                    continue
+                conn.execute(sequences.delete().where(sequences.c.store_id == store_id,
+                                                      sequences.c.doc_type == doc_type))
+                conn.execute(sequences.insert().values(store_id=store_id, doc_type=doc_type,
+                                                       next_value=int(number.rsplit('-', 1)[1]) + 1))
+
+        if conn.dialect.name == 'postgresql':
+            # Explicit IDs do not advance the serial sequences
+            for table in ('store', 'supplier', 'product', 'sales_order', 'purchase_order'):
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+                )
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+        total = conn.exec_driver_sql("SELECT COUNT(*) FROM inventory_movement").scalar()
+
+    elapsed = time.perf_counter() - history_started
+    print(f"Loaded history in {elapsed:.1f}s; inventory_movement now has {total:,} rows")
+    print(f"Total {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
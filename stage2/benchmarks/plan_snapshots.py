@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Query-plan snapshots for the report, listing and API queries.
+
+Requests each report, inventory listing and API endpoint below through the
+test client and captures the SELECT statements it issues, with their
+parameters. Every statement is named after the first endpoint that issued
+it (report.sales_report#2 is the second new statement of the sales report)
+and explained against the dataset:
+
+    PostgreSQL  EXPLAIN (ANALYZE, FORMAT JSON), inside a rolled back transaction
+    SQLite      EXPLAIN QUERY PLAN
+
+A plan's fingerprint hashes its shape (node types, tables, indexes, join
+and sort nodes) but not its costs or row counts, so it only changes when
+the planner picks a different plan. The first run writes the snapshot
+file; later runs compare against it and list every changed plan, with the
+sequential scans and sorts spilling to disk (SQLite: temporary sort
+b-trees) it now contains. The exit status is 1 if a changed plan has
+gained such a step, so the check can run in CI. --update rewrites the
+snapshot after an intended change.
+
+    python benchmarks/plan_snapshots.py --snapshot plans/sqlite.json
+    python benchmarks/plan_snapshots.py --snapshot plans/postgres.json \\
+        --database-url postgresql://localhost/kiryana_bench --store-id 3
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Endpoint -> path; {store} and {product} are filled from --store-id
+ENDPOINTS = {
+    'report.inventory_report': '/report/store/{store}/inventory',
+    'report.movement_report': '/report/store/{store}/movements',
+    'report.movement_report.sales': '/report/store/{store}/movements?movement_type=sale',
+    'report.sales_report': '/report/store/{store}/sales',
+    'report.sales_report.lastyear': '/report/store/{store}/sales?period=lastyear',
+    'report.sales_chart_data': '/report/store/{store}/chart/sales',
+    'report.consolidated_report_data': '/report/consolidated/data',
+    'inventory.movements': '/inventory/store/{store}/movements',
+    'api.get_products': '/api/store/{store}/products',
+    'api.get_changes': '/api/store/{store}/changes?since=0',
+    'api.get_product': '/api/store/{store}/product/{product}',
+    'api.get_product_movements': '/api/store/{store}/product/{product}/movements',
+    'api.get_low_stock': '/api/store/{store}/low-stock',
+    'api.get_suppliers': '/api/store/{store}/suppliers',
+    'api.get_recent_movements': '/api/store/{store}/recent-movements',
+}
+
+
+def capture_statements(app, db, paths, username, password):
+    """Request each path; returns {name: (statement, parameters)} in request order"""
+    from flask import has_request_context
+    from sqlalchemy import event
+
+    captured = {}
+    seen = set()
+    current = {}
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context() or executemany:
+            return
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')) or statement in seen:
+            return
+        seen.add(statement)
+        current['count'] += 1
+        captured[f"{current['name']}#{current['count']}"] = (statement, parameters)
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': username, 'password': password})
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        for name, path in paths.items():
+            current.update(name=name, count=0)
+            status = client.get(path).status_code
+            if status >= 400:
+                print(f"warning: {name} answered {status}; its plans are from the statements it reached",
+                      file=sys.stderr)
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return captured
+
+
+def sqlite_plan(conn, statement, parameters):
+    """Indented EXPLAIN QUERY PLAN lines and the flagged steps"""
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    depth = {0: -1}
+    lines, flags = [], []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+        # "SCAN t USING INDEX" walks an index; a bare SCAN reads the table
+        if detail.startswith('SCAN ') and ' USING ' not in detail and detail != 'SCAN CONSTANT ROW':
+            flags.append(detail)
+        if 'TEMP B-TREE' in detail:
+            flags.append(detail)
+    return lines, flags
+
+
+def postgresql_plan(conn, statement, parameters):
+    """Plan shape lines from EXPLAIN ANALYZE and the flagged steps"""
+    result = conn.exec_driver_sql('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(result, str):
+        result = json.loads(result)
+    lines, flags = [], []
+
+    def walk(node, depth):
+        shape = [node['Node Type']]
+        for key in ('Strategy', 'Join Type', 'Relation Name', 'Index Name', 'Sort Key', 'Group Key'):
+            if key in node:
+                shape.append(f"{key}={node[key]}")
+        lines.append('  ' * depth + ' '.join(str(part) for part in shape))
+        if node['Node Type'] == 'Seq Scan':
+            flags.append(f"Seq Scan on {node.get('Relation Name')}")
+        if node.get('Sort Space Type') == 'Disk':
+            flags.append(f"Sort spilled to disk ({node.get('Sort Method')}, {node.get('Sort Space Used')} kB)")
+        for child in node.get('Plans', []):
+            walk(child, depth + 1)
+
+    walk(result[0]['Plan'], 0)
+    return lines, flags
+
+
+def explain_all(db, app, captured):
+    """Plan, fingerprint and flags for each captured statement"""
+    plans = {}
+    with app.app_context():
+        engine = db.engine
+    explain = postgresql_plan if engine.dialect.name == 'postgresql' else sqlite_plan
+
+    with engine.connect() as conn:
+        for name, (statement, parameters) in captured.items():
+            # ANALYZE runs the statement, so nothing it does is kept
+            transaction = conn.begin()
+            try:
+                lines, flags = explain(conn, statement, parameters)
+            except Exception as e:
+                lines, flags = [f'error: {e.__class__.__name__}: {str(e).splitlines()[0]}'], []
+            finally:
+                transaction.rollback()
+            plans[name] = {
+                'statement': statement,
+                'fingerprint': hashlib.sha1('\n'.join(lines).encode()).hexdigest()[:16],
+                'plan': lines,
+                'flags': flags,
+            }
+    return plans
+
+
+def compare(plans, snapshot):
+    """Print changed, new and missing plans; returns True if a change gained a flagged step"""
+    regressed = False
+    old_plans = snapshot['queries']
+
+    for name, plan in plans.items():
+        old = old_plans.get(name)
+        if old is None:
+            print(f"NEW      {name}")
+            continue
+        if old['statement'] != plan['statement']:
+            print(f"SQL      {name} (statement changed)")
+        if old['fingerprint'] == plan['fingerprint']:
+            continue
+        gained = [flag for flag in plan['flags'] if flag not in old['flags']]
+        print(f"CHANGED  {name} {old['fingerprint']} -> {plan['fingerprint']}")
+        print('  was:')
+        for line in old['plan']:
+            print('    ' + line)
+        print('  now:')
+        for line in plan['plan']:
+            print('    ' + line)
+        for flag in gained:
+            print(f"  FLAG: {flag}")
+        regressed = regressed or bool(gained)
+
+    for name in old_plans:
+        if name not in plans:
+            print(f"MISSING  {name}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query-plan snapshots')
+    parser.add_argument('--snapshot', required=True, help='Snapshot file to write or compare against')
+    parser.add_argument('--update', action='store_true', help='Rewrite the snapshot with the current plans')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated endpoint names')
+    parser.add_argument('--store-id', type=int, default=1)
+    parser.add_argument('--username', default=os.environ.get('ADMIN_USERNAME', 'admin'))
+    parser.add_argument('--password', default=os.environ.get('ADMIN_PASSWORD', 'admin_secure_password'))
+    parser.add_argument('--database-url', help='Database to explain against (default: a generated scratch SQLite file)')
+    args = parser.parse_args()
+
+    names = args.endpoints.split(',')
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    from bench_http import generate_scratch_dataset
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        # The same seed always gives the same dataset, and so the same plans
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+        generate_scratch_dataset(os.environ['DATABASE_URL'], 2, 500, 20000)
+    os.environ['FLASK_DEBUG'] = '0'
+
+    logging.disable(logging.ERROR)
+    from app import app, db
+    from models import Product
+
+    # The client logs in without scraping a CSRF token
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        product_id = db.session.execute(
+            db.select(Product.id).where(Product.store_id == args.store_id).order_by(Product.id)
+        ).scalar()
+        dialect = db.engine.dialect.name
+    paths = {name: ENDPOINTS[name].format(store=args.store_id, product=product_id) for name in names}
+
+    captured = capture_statements(app, db, paths, args.username, args.password)
+    plans = explain_all(db, app, captured)
+
+    flagged = sum(1 for plan in plans.values() if plan['flags'])
+    print(f"Explained {len(plans)} statements on {dialect}; {flagged} contain scans or sorts")
+
+    regressed = False
+    if args.update or not os.path.exists(args.snapshot):
+        os.makedirs(os.path.dirname(os.path.abspath(args.snapshot)), exist_ok=True)
+        with open(args.snapshot, 'w') as f:
+            json.dump({
+                'meta': {
+                    'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                    'dialect': dialect,
+                    'store_id': args.store_id,
+                },
+                'queries': plans,
+            }, f, indent=2)
+        print(f"Saved snapshot to {args.snapshot}")
+    else:
+        with open(args.snapshot) as f:
+            snapshot = json.load(f)
+        if snapshot['meta']['dialect'] != dialect:
+            parser.error(f"snapshot is for {snapshot['meta']['dialect']}, database is {dialect}")
+        regressed = compare(plans, snapshot)
+        changed = sum(1 for name, plan in plans.items()
+                      if name in snapshot['queries'] and snapshot['queries'][name]['fingerprint'] != plan['fingerprint'])
+        print(f"{changed} plans changed" + ("; new scans or sorts found" if regressed else ""))
+
+    if scratch:
+        os.unlink(scratch.name)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Kiryana Inventory System - In-process caching
+
+A small thread-safe TTL cache for values that are expensive to compute and
+may be a little stale, such as chain-wide report aggregates. Each worker
+process keeps its own copy.
+"""
+
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Dictionary-like cache whose entries expire after a fixed number of seconds"""
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return a cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ttl seconds (defaults to the cache ttl)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                self._evict()
+            self._data[key] = (expires_at, value)
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Return the cached value for key, computing and storing it if needed"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def invalidate(self, key):
+        """Drop a single entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self):
+        """Drop expired entries, or the oldest one if none have expired (lock held)"""
+        now = time.monotonic()
+        expired = [k for k, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        if not expired and self._data:
+            oldest = min(self._data, key=lambda k: self._data[k][0])
+            del self._data[oldest]
+
+    def __len__(self):
+        return len(self._data)
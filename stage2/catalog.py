@@ -0,0 +1,379 @@
+"""
+Kiryana Inventory System - Catalog Import and Export
+
+Loads a store's product catalog from CSV or JSON lines and writes it back
+out in the same shape, so an export can be edited and imported again.
+Products are matched by SKU within the store: known SKUs are updated, new
+ones are created.
+
+An import reads the store's catalog once up front instead of querying
+per row, validates every row, skips rows that would change nothing, and
+writes each chunk of rows with one multi-row INSERT and one UPDATE
+executemany per set of columns given.
+Each chunk commits on its own, bumps the store revision once and adds its
+product.created / product.updated outbox events, as ORM writes would. A
+chunk the database rejects is retried row by row so the offending rows
+are reported and the rest of the chunk still goes in.
+
+Empty cells (and nulls in JSON) leave a stored value alone; new products
+get the defaults of the add product form. Catalog values are the effective
+ones: a store product linked to a product master exports the master's
+values where it has no override, and an imported value equal to the
+master's clears the override instead of storing a copy. A new product
+whose SKU has a master elsewhere in the chain is linked to it and needs no
+name of its own. Stock levels are not part of
+the catalog: they only change through inventory movements.
+"""
+
+import csv
+import io
+import json
+import math
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from masters import MasterIndex, overrides
+from models import INHERITED_COLUMNS, Product, product_catalog, catalog_column
+from outbox import PRODUCT_FIELDS, add_events
+from revisions import bump_revision
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 2000
+# Rows read from the database at a time by an export
+EXPORT_CHUNK_SIZE = 1000
+# Errors kept for the report; the rest are only counted
+MAX_ERRORS = 1000
+
+# Columns of an import or export file, in export order
+CATALOG_FIELDS = ('sku', 'name', 'barcode', 'description', 'category', 'unit_price',
+                  'cost_price', 'reorder_level', 'location_in_store', 'image_url')
+
+# Longest value of each text column (None: unlimited)
+TEXT_FIELDS = {
+    'sku': 50,
+    'name': 100,
+    'barcode': 50,
+    'description': None,
+    'category': 50,
+    'location_in_store': 100,
+    'image_url': 255,
+}
+NUMBER_FIELDS = {'unit_price': float, 'cost_price': float, 'reorder_level': int}
+
+# Values of new products for columns the file leaves empty
+NEW_PRODUCT_DEFAULTS = {
+    'barcode': None,
+    'description': None,
+    'category': None,
+    'unit_price': 0,
+    'cost_price': None,
+    'reorder_level': 10,
+    'location_in_store': None,
+    'image_url': None,
+}
+
+
+class CatalogError(ValueError):
+    """A catalog file that cannot be read at all"""
+
+
+def detect_format(filename, default='csv'):
+    """Format of a catalog file from its extension"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt):
+    """(line number, record) pairs of a text stream; records are dicts
+
+    A JSON line that is not an object is returned as None so that it is
+    reported like any other invalid row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames or 'sku' not in reader.fieldnames:
+            raise CatalogError("The CSV header has no sku column")
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            yield line, record if isinstance(record, dict) else None
+    else:
+        raise CatalogError(f"Unknown catalog format: {fmt}")
+
+
+def clean_row(record):
+    """Validated column values of a record; raises ValueError with the reason
+
+    Columns that are missing or empty are left out of the result.
+    """
+    if record is None:
+        raise ValueError("not a JSON object")
+
+    values = {}
+    for field, limit in TEXT_FIELDS.items():
+        value = record.get(field)
+        if value is None:
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+        if limit and len(value) > limit:
+            raise ValueError(f"{field} is longer than {limit} characters")
+        values[field] = value
+
+    for field, convert in NUMBER_FIELDS.items():
+        value = record.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        kind = 'a whole number' if convert is int else 'a number'
+        try:
+            number = convert(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be {kind}, got {value!r}")
+        if convert is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{field} must be {kind}, got {value!r}")
+        if not math.isfinite(number) or number < 0:
+            raise ValueError(f"{field} must be zero or more, got {value!r}")
+        values[field] = number
+
+    if 'sku' not in values:
+        raise ValueError("sku is required")
+    return values
+
+
+class ImportResult:
+    """Counts and row errors of a catalog import"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []  # (line, sku, message), at most MAX_ERRORS; see sorted_errors()
+        self.duration = 0
+
+    def add_error(self, line, sku, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, sku, message))
+
+    def sorted_errors(self):
+        # Rows rejected by the database are found after the rows around them
+        return sorted(self.errors, key=lambda error: error[0])
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.duration if self.duration else 0
+
+    def summary(self):
+        verb = "Would create" if self.dry_run else "Created"
+        return (f"{verb} {self.created} and {'update' if self.dry_run else 'updated'} {self.updated} "
+                f"products from {self.rows} rows ({self.unchanged} unchanged, {self.error_count} errors) "
+                f"in {self.duration:.2f}s, {self.rows_per_second:.0f} rows/s")
+
+
+def _product_event(row, event_type):
+    return {
+        'store_id': row['store_id'],
+        'event_type': event_type,
+        'aggregate_id': row['id'],
+        'data': {field: row[field] for field in PRODUCT_FIELDS}
+    }
+
+
+def _write_chunk(session, store_id, new_rows, changed_rows, existing, masters):
+    """Insert and update one chunk of (line, values) rows; returns {sku: id} of the new products"""
+    table = Product.__table__
+    revision = bump_revision(store_id, session)
+    now = datetime.utcnow()
+
+    created = {}
+    events = []
+    if new_rows:
+        # values are effective values: linked products store only their overrides
+        rows = [{'master_id': None, **NEW_PRODUCT_DEFAULTS, **values,
+                 'store_id': store_id, 'current_quantity': 0, 'shard_count': 0,
+                 'created_at': now, 'updated_at': now, 'updated_version': revision}
+                for _, values in new_rows]
+        params = [{**row, **overrides(row, masters.values[row['master_id']])} if row['master_id'] else row
+                  for row in rows]
+        created = dict(session.execute(insert(table).returning(table.c.sku, table.c.id), params).all())
+        for row in rows:
+            row['id'] = created[row['sku']]
+            events.append(_product_event(row, 'product.created'))
+
+    # An executemany needs the same columns in every row: group by the
+    # columns each row changes, which for one edit is usually a few groups
+    groups = {}
+    for _, values in changed_rows:
+        stored = existing[values['sku']]
+        if stored.master_id:
+            master_values = masters.values[stored.master_id]
+            values = {column: None if column in INHERITED_COLUMNS and value == master_values[column] else value
+                      for column, value in values.items()}
+        columns = tuple(sorted(column for column in values if column != 'sku'))
+        groups.setdefault(columns, []).append((stored.id, values))
+    for columns, rows in groups.items():
+        statement = (
+            update(table).where(table.c.id == bindparam('b_id'))
+            .values({**{column: bindparam(f'b_{column}') for column in columns},
+                     'updated_at': now, 'updated_version': revision})
+        )
+        session.execute(statement, [
+            {'b_id': product_id, **{f'b_{column}': values[column] for column in columns}}
+            for product_id, values in rows
+        ])
+
+    # Events of updates carry the effective rows, including columns the file left alone
+    if changed_rows:
+        ids = [existing[values['sku']].id for _, values in changed_rows]
+        fields = [catalog_column(field) for field in PRODUCT_FIELDS]
+        events.extend(_product_event(row._mapping, 'product.updated')
+                      for row in session.execute(
+                          select(*fields).select_from(product_catalog).where(table.c.id.in_(ids))))
+    add_events(events, session)
+    return created
+
+
+def import_catalog(store_id, rows, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, progress=None):
+    """Create and update a store's products from (line, record) pairs
+
+    rows is what read_rows() yields. With dry_run the rows are validated
+    and counted but nothing is written. progress, if given, is called
+    with the number of rows read after each chunk.
+    """
+    session = db.session
+    result = ImportResult(dry_run)
+    started = time.perf_counter()
+
+    # SKU -> ID, master and effective catalog values of the store's products,
+    # and the chain's masters; the lookups of the import, so rows that change
+    # nothing are skipped without a write
+    table = Product.__table__
+    existing = {row.sku: row for row in session.execute(
+        select(table.c.id, table.c.master_id, *[catalog_column(field) for field in CATALOG_FIELDS])
+        .select_from(product_catalog)
+        .where(table.c.store_id == store_id, table.c.sku.isnot(None))
+    )}
+    masters = MasterIndex.load()
+    seen = {}  # SKU -> line of its first row in the file
+    new_rows, changed_rows = [], []
+
+    def flush():
+        if dry_run:
+            result.created += len(new_rows)
+            result.updated += len(changed_rows)
+        else:
+            _write_rows(session, store_id, new_rows, changed_rows, existing, masters, result)
+        new_rows.clear()
+        changed_rows.clear()
+        if progress:
+            progress(result.rows)
+
+    for line, record in rows:
+        result.rows += 1
+        try:
+            values = clean_row(record)
+        except ValueError as e:
+            sku = record.get('sku') if record else None
+            result.add_error(line, sku, str(e))
+            continue
+
+        sku = values['sku']
+        if sku in seen:
+            result.add_error(line, sku, f"duplicate of the row on line {seen[sku]}")
+            continue
+        seen[sku] = line
+
+        stored = existing.get(sku)
+        if stored is not None:
+            # Only the columns that differ are written
+            changes = {field: value for field, value in values.items() if getattr(stored, field) != value}
+            if changes:
+                changed_rows.append((line, {'sku': sku, **changes}))
+            else:
+                result.unchanged += 1
+        else:
+            master_id = masters.match(sku, values.get('barcode'))
+            if master_id:
+                values = {**masters.values[master_id], **values, 'master_id': master_id}
+            elif 'name' not in values:
+                result.add_error(line, sku, "name is required for a new product")
+                continue
+            new_rows.append((line, values))
+
+        if len(new_rows) + len(changed_rows) >= chunk_size:
+            flush()
+    if new_rows or changed_rows:
+        flush()
+
+    result.duration = time.perf_counter() - started
+    return result
+
+
+def _write_rows(session, store_id, new_rows, changed_rows, existing, masters, result):
+    """Write a chunk in one transaction; if the database rejects it, retry row by row"""
+    try:
+        created = _write_chunk(session, store_id, new_rows, changed_rows, existing, masters)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        if len(new_rows) + len(changed_rows) > 1:
+            for row in new_rows:
+                _write_rows(session, store_id, [row], [], existing, masters, result)
+            for row in changed_rows:
+                _write_rows(session, store_id, [], [row], existing, masters, result)
+        else:
+            line, values = (new_rows or changed_rows)[0]
+            result.add_error(line, values['sku'], str(getattr(e, 'orig', e)).splitlines()[0])
+        return
+
+    result.created += len(created)
+    result.updated += len(changed_rows)
+
+
+def export_lines(store_id, fmt):
+    """Lines of a store's catalog in import format, a chunk of rows at a time"""
+    if fmt not in FORMATS:
+        raise CatalogError(f"Unknown catalog format: {fmt}")
+
+    query = (
+        select(*[catalog_column(field) for field in CATALOG_FIELDS])
+        .select_from(product_catalog)
+        .where(Product.store_id == store_id)
+        .order_by(Product.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(CATALOG_FIELDS)
+
+    for chunk in db.session.execute(query).partitions():
+        if fmt == 'csv':
+            writer.writerows(chunk)
+        else:
+            for row in chunk:
+                buffer.write(json.dumps(dict(zip(CATALOG_FIELDS, row))) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -7,6 +7,7 @@ This CLI allows you to manage inventory operations directly from the terminal.
 import argparse
 import os
 import sys
+from contextlib import nullcontext
 from datetime import datetime
 from tabulate import tabulate
 
@@ -17,14 +18,25 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 def setup_cli():
     """Setup the CLI environment and database connection"""
     from app import app
+    from flask import has_app_context
+    # Commands run from the shell share its application context
+    if has_app_context():
+        return nullcontext()
     return app.app_context()
 
+class CommandError(Exception):
+    """A command that cannot be carried out; run_command() prints it as an error"""
+
 # Import models after setting path
 from app import db
-from models import Product, InventoryMovement, Store
+from models import Product, ProductMaster, InventoryMovement, Store, catalog_column, product_catalog
+from memtrack import MemoryTrace, format_size
+from movements import find_movement, record_movement
 
 # Initialize parser
 parser = argparse.ArgumentParser(description='Kiryana Inventory CLI')
+parser.add_argument('--trace-memory', action='store_true',
+                    help='Report peak memory and top allocation sites of the command (slows it down)')
 subparsers = parser.add_subparsers(dest='command', help='Command to run')
 
 # Product Commands
@@ -45,6 +57,34 @@ def register_product_commands():
     show_parser = subparsers.add_parser('show-product', help='Show product details')
     show_parser.add_argument('--id', type=int, help='Product ID')
     show_parser.add_argument('--sku', help='Product SKU')
+    
+    # Bulk catalog import and export
+    import_parser = subparsers.add_parser('import-products', help='Create and update products from a CSV or JSONL catalog')
+    import_parser.add_argument('--store-id', '--store', type=int, required=True, help='Store the products belong to')
+    import_parser.add_argument('--file', required=True, help='Catalog file, or - for stdin')
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from the file extension, else csv)')
+    import_parser.add_argument('--chunk-size', type=int, default=2000, help='Rows written per transaction (default: 2000)')
+    import_parser.add_argument('--dry-run', action='store_true', help='Validate and count the rows without writing')
+    
+    export_parser = subparsers.add_parser('export-products', help='Write a store\'s catalog as CSV or JSONL')
+    export_parser.add_argument('--store-id', '--store', type=int, required=True, help='Store to export')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='Output format (default: csv)')
+    export_parser.add_argument('--output', help='Output file (default: stdout)')
+    
+    # Product masters
+    migrate_parser = subparsers.add_parser('migrate-product-master', help='Link store products to chain-wide product masters by SKU or barcode')
+    migrate_parser.add_argument('--batch-size', type=int, default=5000, help='Products read per transaction (default: 5000)')
+    migrate_parser.add_argument('--dry-run', action='store_true', help='Count what would be linked without writing')
+    
+    master_parser = subparsers.add_parser('update-master', help='Change a product master for every store at once')
+    master_parser.add_argument('--sku', required=True, help='SKU of the master')
+    master_parser.add_argument('--name', help='Product name')
+    master_parser.add_argument('--barcode', help='Barcode')
+    master_parser.add_argument('--description', help='Description')
+    master_parser.add_argument('--category', help='Category')
+    master_parser.add_argument('--price', type=float, help='Unit price')
+    master_parser.add_argument('--cost-price', type=float, help='Cost price')
+    master_parser.add_argument('--image-url', help='Image URL')
 
 # Inventory Commands
 def register_inventory_commands():
@@ -55,6 +95,7 @@ def register_inventory_commands():
     stock_in_parser.add_argument('--price', type=float, help='Unit price (optional, will use product price if not specified)')
     stock_in_parser.add_argument('--reference', help='Reference (Invoice/PO)')
     stock_in_parser.add_argument('--notes', help='Additional notes')
+    stock_in_parser.add_argument('--idempotency-key', help='Key making a retried command safe (repeats are not applied twice)')
     
     # Record sale
     sale_parser = subparsers.add_parser('sale', help='Record a sale')
@@ -63,6 +104,7 @@ def register_inventory_commands():
     sale_parser.add_argument('--price', type=float, help='Unit price (optional, will use product price if not specified)')
     sale_parser.add_argument('--reference', help='Reference (Receipt number)')
     sale_parser.add_argument('--notes', help='Additional notes')
+    sale_parser.add_argument('--idempotency-key', help='Key making a retried command safe (repeats are not applied twice)')
     
     # Record removal
     removal_parser = subparsers.add_parser('removal', help='Record inventory removal')
@@ -70,17 +112,150 @@ def register_inventory_commands():
     removal_parser.add_argument('--quantity', type=int, required=True, help='Quantity')
     removal_parser.add_argument('--reason', choices=['damaged', 'expired', 'stolen', 'other'], default='other', help='Removal reason')
     removal_parser.add_argument('--notes', help='Additional notes')
+    removal_parser.add_argument('--idempotency-key', help='Key making a retried command safe (repeats are not applied twice)')
+    
+    # Sharded stock counters for hot products
+    shards_parser = subparsers.add_parser('stock-shards', help='List, configure or fold sharded stock counters')
+    shards_parser.add_argument('--product-id', type=int, help='Product to configure')
+    shards_parser.add_argument('--shards', type=int, help='Number of stock shards (0 stops sharding)')
+    shards_parser.add_argument('--fold', action='store_true', help='Fold shard counters into product quantities')
+    shards_parser.add_argument('--interval', type=float, help='With --fold, keep folding every N seconds')
 
 # Report Commands
 def register_report_commands():
     # Inventory report
     inventory_parser = subparsers.add_parser('inventory', help='Show current inventory')
+    add_output_arguments(inventory_parser)
     
     # Movement report
     movement_parser = subparsers.add_parser('movements', help='Show inventory movements')
     movement_parser.add_argument('--product-id', type=int, help='Filter by product ID')
-    movement_parser.add_argument('--type', choices=['stock_in', 'sale', 'removal'], help='Filter by movement type')
+    movement_parser.add_argument('--type', choices=['stock_in', 'sale', 'removal', 'transfer_in', 'transfer_out'], help='Filter by movement type')
     movement_parser.add_argument('--days', type=int, default=30, help='Number of days to show (default: 30)')
+    add_output_arguments(movement_parser)
+    
+    # Per-store analytic report (valuation, movement summary, top products)
+    report_parser = subparsers.add_parser('report', help='Show analytic report per store')
+    report_scope = report_parser.add_mutually_exclusive_group()
+    report_scope.add_argument('--all-stores', action='store_true', help='Report on every active store')
+    report_scope.add_argument('--store-id', type=int, action='append', help='Store ID (can be repeated, default: first store)')
+    report_parser.add_argument('--workers', type=int, default=1, help='Worker processes to compute stores in parallel (default: 1)')
+    report_parser.add_argument('--days', type=int, default=30, help='Number of days of movements (default: 30)')
+    report_parser.add_argument('--top', type=int, default=5, help='Top products per store (default: 5)')
+    
+    # Columnar export of the movement ledger
+    export_parser = subparsers.add_parser('export-movements', help='Export movements to partitioned Parquet/Arrow files')
+    export_parser.add_argument('--output', required=True, help='Output directory')
+    export_parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet', help='File format (default: parquet)')
+    export_parser.add_argument('--chunk-size', type=int, default=50000, help='Rows fetched per chunk (default: 50000)')
+    export_parser.add_argument('--full', action='store_true', help='Export the whole ledger into a new directory, ignoring any watermark')
+    
+    # Move old movements out of the hot ledger
+    archive_parser = subparsers.add_parser('archive-movements', help='Archive movements older than the retention window')
+    archive_parser.add_argument('--retention-days', type=int, default=365, help='Days of movements to keep in the hot ledger (default: 365)')
+    archive_parser.add_argument('--store-id', type=int, help='Only archive this store')
+    archive_parser.add_argument('--batch-size', type=int, default=10000, help='Movements moved per transaction (default: 10000)')
+
+# Forecasting Commands
+def register_forecast_commands():
+    # Demand forecast and suggested reorder levels
+    forecast_parser = subparsers.add_parser('forecast', help='Forecast demand and suggest reorder levels')
+    forecast_parser.add_argument('--store-id', type=int, help='Store ID (default: first store)')
+    forecast_parser.add_argument('--method', choices=['ses', 'ma'], default='ses', help='Exponential smoothing or moving average (default: ses)')
+    forecast_parser.add_argument('--days', type=int, default=365, help='Days of sales history to use (default: 365)')
+    forecast_parser.add_argument('--alpha', type=float, default=0.3, help='Smoothing factor for ses (default: 0.3)')
+    forecast_parser.add_argument('--window', type=int, default=28, help='Window in days for ma (default: 28)')
+    forecast_parser.add_argument('--lead-time', type=int, help='Lead time in days (default: preferred supplier lead time, else 7)')
+    forecast_parser.add_argument('--service-factor', type=float, default=1.65, help='Safety stock multiplier (default: 1.65)')
+    forecast_parser.add_argument('--top', type=int, default=20, help='Number of products to display (default: 20)')
+    forecast_parser.add_argument('--apply', action='store_true', help='Write suggested reorder levels to the products')
+
+# Access Commands
+def register_access_commands():
+    # API bearer token for POS devices and scripts
+    token_parser = subparsers.add_parser('issue-token', help='Issue an API bearer token for a user')
+    token_parser.add_argument('--username', required=True, help='User the token acts as')
+    token_parser.add_argument('--ttl', type=int, help='Token lifetime in seconds (default: API_TOKEN_TTL or 900, at most API_TOKEN_MAX_TTL)')
+
+# Edge Commands
+def register_edge_commands():
+    # Sync a store-local edge database with the central server
+    sync_parser = subparsers.add_parser('edge-sync', help='Push local movements upstream and pull catalog changes (edge mode)')
+    sync_parser.add_argument('--once', action='store_true', help='Sync once and exit instead of looping')
+    sync_parser.add_argument('--interval', type=int, default=30, help='Seconds between syncs (default: 30)')
+    sync_parser.add_argument('--batch-size', type=int, default=500, help='Movements per upstream batch (default: 500)')
+
+def register_event_commands():
+    # Relay outbox events to downstream services
+    relay_parser = subparsers.add_parser('outbox-relay', help='Publish inventory events from the outbox to a sink')
+    relay_parser.add_argument('--sink', required=True, help='file:///path, tcp://host:port, a file path, or - for stdout')
+    relay_parser.add_argument('--name', default='default', help='Relay name; each name keeps its own checkpoint (default: default)')
+    relay_parser.add_argument('--once', action='store_true', help='Publish pending events and exit instead of looping')
+    relay_parser.add_argument('--interval', type=float, default=2, help='Seconds between polls (default: 2)')
+    relay_parser.add_argument('--batch-size', type=int, default=500, help='Events per published batch (default: 500)')
+    relay_parser.add_argument('--prune', action='store_true', help='Delete events every relay has published')
+
+# Shell Commands
+def register_shell_commands():
+    # Run many commands in one process
+    shell_parser = subparsers.add_parser('shell', help='Run commands line by line from stdin or a file in one session')
+    shell_parser.add_argument('--file', help='Script with one command per line (default: stdin)')
+    shell_parser.add_argument('--stop-on-error', action='store_true', help='Stop at the first line that fails')
+    shell_parser.add_argument('--timing', action='store_true', help='Print the time each command took')
+
+def add_output_arguments(command_parser):
+    """Options of the commands that stream rows"""
+    command_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='table',
+                                help='table for reading, csv or jsonl for other tools (default: table)')
+    command_parser.add_argument('--store-id', '--store', type=int, help='Only rows of this store')
+    command_parser.add_argument('--limit', type=int, help='Stop after this many rows')
+
+# Streamed output
+OUTPUT_FORMATS = ['table', 'csv', 'jsonl']
+# Rows fetched from the database at a time
+STREAM_CHUNK_SIZE = 1000
+# Rows per grid in table format; each page is measured on its own
+TABLE_PAGE_SIZE = 500
+
+def stream_rows(query):
+    """Rows of a select, fetched from the database in chunks"""
+    return db.session.execute(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+
+def json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def write_rows(output_format, fields, records, headers, table_row):
+    """Write records (tuples in fields order) as they arrive; returns the count
+
+    csv and jsonl write one line per record with raw values. The table
+    format converts records with table_row and prints a grid every
+    TABLE_PAGE_SIZE rows, so no format holds more than a page in memory.
+    """
+    import csv
+    import json
+    
+    count = 0
+    if output_format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    elif output_format == 'jsonl':
+        for record in records:
+            sys.stdout.write(json.dumps(dict(zip(fields, record)), default=json_value) + '\n')
+            count += 1
+    else:
+        page = []
+        for record in records:
+            page.append(table_row(record))
+            count += 1
+            if len(page) == TABLE_PAGE_SIZE:
+                print(tabulate(page, headers=headers, tablefmt="grid"), flush=True)
+                page = []
+        if page:
+            print(tabulate(page, headers=headers, tablefmt="grid"))
+    return count
 
 # Command Handlers
 def handle_list_products(args):
@@ -89,7 +264,7 @@ def handle_list_products(args):
         query = Product.query
         
         if args.low_stock:
-            query = query.filter(Product.current_quantity <= Product.reorder_level)
+            query = query.filter(Product.available_quantity <= Product.reorder_level)
             
         products = query.order_by(Product.name).all()
         
@@ -102,15 +277,16 @@ def handle_list_products(args):
         rows = []
         
         for p in products:
-            status = "Out of Stock" if p.current_quantity == 0 else \
-                     "Low Stock" if p.current_quantity <= p.reorder_level else \
+            quantity = p.get_available_quantity()
+            status = "Out of Stock" if quantity == 0 else \
+                     "Low Stock" if quantity <= p.reorder_level else \
                      "In Stock"
             
             rows.append([
                 p.id,
                 p.sku,
                 p.name,
-                p.current_quantity,
+                quantity,
                 p.reorder_level,
                 f"{p.unit_price:.2f}",
                 status
@@ -125,14 +301,12 @@ def handle_add_product(args):
         # Check if product with SKU already exists
         existing = Product.query.filter_by(sku=args.sku).first()
         if existing:
-            print(f"Error: Product with SKU '{args.sku}' already exists.")
-            return
+            raise CommandError(f"Product with SKU '{args.sku}' already exists.")
         
         # Get default store
         store = Store.query.first()
         if not store:
-            print("Error: No store found in the database.")
-            return
+            raise CommandError("No store found in the database.")
         
         # Create new product
         new_product = Product(
@@ -149,6 +323,94 @@ def handle_add_product(args):
         
         print(f"Product '{args.name}' added successfully with ID: {new_product.id}")
 
+def handle_import_products(args):
+    """Create and update a store's products from a catalog file"""
+    import catalog
+    
+    with setup_cli():
+        if not db.session.get(Store, args.store_id):
+            raise CommandError(f"Store with ID {args.store_id} not found.")
+        
+        fmt = args.format or catalog.detect_format(args.file)
+        stream = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8-sig', newline='')
+        try:
+            result = catalog.import_catalog(
+                args.store_id,
+                catalog.read_rows(stream, fmt),
+                chunk_size=args.chunk_size,
+                dry_run=args.dry_run,
+                progress=lambda count: print(f"  read {count} rows...", file=sys.stderr)
+            )
+        except catalog.CatalogError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        
+        if result.errors:
+            headers = ["Line", "SKU", "Error"]
+            print(tabulate([[line, sku or "", message] for line, sku, message in result.sorted_errors()],
+                           headers=headers, tablefmt="grid"))
+            if result.error_count > len(result.errors):
+                print(f"... and {result.error_count - len(result.errors)} more errors")
+        print(result.summary())
+
+def handle_export_products(args):
+    """Write a store's catalog in the import format"""
+    import catalog
+    
+    with setup_cli():
+        if not db.session.get(Store, args.store_id):
+            raise CommandError(f"Store with ID {args.store_id} not found.")
+        
+        output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+        try:
+            for chunk in catalog.export_lines(args.store_id, args.format):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+def handle_migrate_product_master(args):
+    """Link store products to product masters"""
+    import masters
+    
+    with setup_cli():
+        counts = masters.migrate_products(
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            progress=lambda count: print(f"  read {count} products...", file=sys.stderr)
+        )
+        verb = "Would link" if args.dry_run else "Linked"
+        print(f"{verb} {counts['linked']} of {counts['products']} products to masters "
+              f"({counts['masters']} new masters, {counts['store_only']} store-only products)")
+
+def handle_update_master(args):
+    """Change a product master's catalog values for every store"""
+    import masters
+    
+    with setup_cli():
+        master = ProductMaster.query.filter_by(sku=args.sku).first()
+        if not master:
+            raise CommandError(f"No product master with SKU {args.sku}.")
+        
+        values = {
+            'name': args.name,
+            'barcode': args.barcode,
+            'description': args.description,
+            'category': args.category,
+            'unit_price': args.price,
+            'cost_price': args.cost_price,
+            'image_url': args.image_url,
+        }
+        values = {key: value for key, value in values.items() if value is not None}
+        if not values:
+            raise CommandError("Nothing to change; give at least one of the value options.")
+        
+        affected = masters.update_master(master.id, values)
+        db.session.commit()
+        print(f"Updated master {args.sku} ({', '.join(values)}); {affected} store products affected.")
+
 def handle_show_product(args):
     """Show detailed product information"""
     with setup_cli():
@@ -159,12 +421,10 @@ def handle_show_product(args):
         elif args.sku:
             product = Product.query.filter_by(sku=args.sku).first()
         else:
-            print("Error: Either --id or --sku must be specified")
-            return
+            raise CommandError("Either --id or --sku must be specified")
             
         if not product:
-            print("Product not found.")
-            return
+            raise CommandError("Product not found.")
             
         print("\nProduct Details:")
         print("=" * 50)
@@ -173,11 +433,12 @@ def handle_show_product(args):
         print(f"SKU:            {product.sku}")
         print(f"Description:    {product.description}")
         print(f"Unit Price:     {product.unit_price:.2f}")
-        print(f"Current Qty:    {product.current_quantity}")
+        quantity = product.get_available_quantity()
+        print(f"Current Qty:    {quantity}")
         print(f"Reorder Level:  {product.reorder_level}")
         
-        status = "Out of Stock" if product.current_quantity == 0 else \
-                 "Low Stock" if product.current_quantity <= product.reorder_level else \
+        status = "Out of Stock" if quantity == 0 else \
+                 "Low Stock" if quantity <= product.reorder_level else \
                  "In Stock"
         print(f"Status:         {status}")
         print(f"Created:        {product.created_at}")
@@ -214,13 +475,18 @@ def handle_stock_in(args):
         # Check if product exists
         product = Product.query.get(args.product_id)
         if not product:
-            print(f"Error: Product with ID {args.product_id} not found.")
-            return
+            raise CommandError(f"Product with ID {args.product_id} not found.")
             
         # Get default store
         store = Store.query.first()
         if not store:
-            print("Error: No store found in the database.")
+            raise CommandError("No store found in the database.")
+            
+        # A repeated command reports the original movement
+        original = find_movement(store.id, args.idempotency_key)
+        if original:
+            print(f"Already recorded as movement #{original.id}: stock in of {original.quantity} units of '{original.product.name}'")
+            print(f"Current stock level: {original.product.get_available_quantity()}")
             return
             
         # Use product price if not specified
@@ -235,18 +501,19 @@ def handle_stock_in(args):
             unit_price=unit_price,
             reference=args.reference,
             notes=args.notes,
-            movement_date=datetime.utcnow()
+            movement_date=datetime.utcnow(),
+            idempotency_key=args.idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity += args.quantity
-        
-        # Save changes
-        db.session.add(movement)
-        db.session.commit()
+        # Save changes and update product quantity
+        movement, created = record_movement(movement, product)
+        if not created:
+            print(f"Already recorded as movement #{movement.id}")
+            print(f"Current stock level: {movement.product.get_available_quantity()}")
+            return
         
         print(f"Recorded stock in of {args.quantity} units for '{product.name}'")
-        print(f"New stock level: {product.current_quantity}")
+        print(f"New stock level: {product.get_available_quantity()}")
 
 def handle_sale(args):
     """Record a sale transaction"""
@@ -254,20 +521,25 @@ def handle_sale(args):
         # Check if product exists
         product = Product.query.get(args.product_id)
         if not product:
-            print(f"Error: Product with ID {args.product_id} not found.")
-            return
-            
-        # Check if sufficient stock
-        if product.current_quantity < args.quantity:
-            print(f"Error: Insufficient stock. Available: {product.current_quantity}, Requested: {args.quantity}")
-            return
+            raise CommandError(f"Product with ID {args.product_id} not found.")
             
         # Get default store
         store = Store.query.first()
         if not store:
-            print("Error: No store found in the database.")
+            raise CommandError("No store found in the database.")
+            
+        # A repeated command reports the original movement
+        original = find_movement(store.id, args.idempotency_key)
+        if original:
+            print(f"Already recorded as movement #{original.id}: sale of {original.quantity} units of '{original.product.name}'")
+            print(f"Current stock level: {original.product.get_available_quantity()}")
             return
             
+        # Check if sufficient stock
+        available = product.get_available_quantity()
+        if available < args.quantity:
+            raise CommandError(f"Insufficient stock. Available: {available}, Requested: {args.quantity}")
+            
         # Use product price if not specified
         unit_price = args.price if args.price is not None else product.unit_price
             
@@ -280,20 +552,21 @@ def handle_sale(args):
             unit_price=unit_price,
             reference=args.reference,
             notes=args.notes,
-            movement_date=datetime.utcnow()
+            movement_date=datetime.utcnow(),
+            idempotency_key=args.idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity -= args.quantity
-        
-        # Save changes
-        db.session.add(movement)
-        db.session.commit()
+        # Save changes and update product quantity
+        movement, created = record_movement(movement, product)
+        if not created:
+            print(f"Already recorded as movement #{movement.id}")
+            print(f"Current stock level: {movement.product.get_available_quantity()}")
+            return
         
         print(f"Recorded sale of {args.quantity} units of '{product.name}'")
-        print(f"New stock level: {product.current_quantity}")
+        print(f"New stock level: {product.get_available_quantity()}")
         
-        if product.current_quantity <= product.reorder_level:
+        if product.is_low_stock():
             print(f"WARNING: Product is now at or below reorder level ({product.reorder_level})")
 
 def handle_removal(args):
@@ -302,20 +575,25 @@ def handle_removal(args):
         # Check if product exists
         product = Product.query.get(args.product_id)
         if not product:
-            print(f"Error: Product with ID {args.product_id} not found.")
-            return
-            
-        # Check if sufficient stock
-        if product.current_quantity < args.quantity:
-            print(f"Error: Insufficient stock. Available: {product.current_quantity}, Requested: {args.quantity}")
-            return
+            raise CommandError(f"Product with ID {args.product_id} not found.")
             
         # Get default store
         store = Store.query.first()
         if not store:
-            print("Error: No store found in the database.")
+            raise CommandError("No store found in the database.")
+            
+        # A repeated command reports the original movement
+        original = find_movement(store.id, args.idempotency_key)
+        if original:
+            print(f"Already recorded as movement #{original.id}: removal of {original.quantity} units of '{original.product.name}'")
+            print(f"Current stock level: {original.product.get_available_quantity()}")
             return
             
+        # Check if sufficient stock
+        available = product.get_available_quantity()
+        if available < args.quantity:
+            raise CommandError(f"Insufficient stock. Available: {available}, Requested: {args.quantity}")
+            
         # Combine reason and notes
         notes = f"Reason: {args.reason}"
         if args.notes:
@@ -329,179 +607,621 @@ def handle_removal(args):
             quantity=args.quantity,
             unit_price=product.unit_price,  # Use current product price
             notes=notes,
-            movement_date=datetime.utcnow()
+            movement_date=datetime.utcnow(),
+            idempotency_key=args.idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity -= args.quantity
-        
-        # Save changes
-        db.session.add(movement)
-        db.session.commit()
+        # Save changes and update product quantity
+        movement, created = record_movement(movement, product)
+        if not created:
+            print(f"Already recorded as movement #{movement.id}")
+            print(f"Current stock level: {movement.product.get_available_quantity()}")
+            return
         
         print(f"Recorded removal of {args.quantity} units of '{product.name}'")
-        print(f"New stock level: {product.current_quantity}")
+        print(f"New stock level: {product.get_available_quantity()}")
+
+def handle_stock_shards(args):
+    """List, configure or fold sharded stock counters"""
+    import time
+    import shards
+
+    with setup_cli():
+        if args.product_id is not None:
+            product = db.session.get(Product, args.product_id)
+            if not product:
+                raise CommandError(f"Product with ID {args.product_id} not found.")
+            shard_count = shards.DEFAULT_SHARD_COUNT if args.shards is None else args.shards
+            if shard_count < 0:
+                raise CommandError("--shards cannot be negative.")
+            shards.set_shard_count(product, shard_count)
+            print(f"'{product.name}' now uses {shard_count} stock shards" if shard_count
+                  else f"'{product.name}' no longer uses stock shards")
+            return
+
+        if args.fold:
+            while True:
+                folded = shards.fold_shards()
+                if folded or args.interval is None:
+                    print(f"[{datetime.now():%H:%M:%S}] folded shard counters of {folded} products")
+                if args.interval is None:
+                    break
+                time.sleep(args.interval)
+            return
+
+        products = Product.query.filter(Product.shard_count > 0).order_by(Product.id).all()
+        if not products:
+            print("No products use stock shards.")
+            return
+
+        headers = ["ID", "SKU", "Name", "Shards", "Folded Qty", "Available Qty", "Reorder Level"]
+        rows = [[p.id, p.sku, p.name, p.shard_count, p.current_quantity, p.get_available_quantity(), p.reorder_level]
+                for p in products]
+        print(tabulate(rows, headers=headers, tablefmt="grid"))
 
 def handle_inventory(args):
     """Show current inventory status"""
+    from sqlalchemy import select
+    
     with setup_cli():
-        products = Product.query.order_by(Product.current_quantity.desc()).all()
+        quantity = Product.available_quantity.label('quantity')
+        query = select(
+            Product.store_id, Product.id, Product.sku, catalog_column('name'),
+            quantity, catalog_column('unit_price'), Product.reorder_level
+        ).select_from(product_catalog).order_by(quantity.desc(), Product.id)
         
-        if not products:
-            print("No products found.")
-            return
+        if args.store_id:
+            query = query.where(Product.store_id == args.store_id)
             
-        # Calculate total inventory value
-        total_value = sum(p.current_quantity * p.unit_price for p in products)
+        if args.limit:
+            query = query.limit(args.limit)
         
-        # Format the output
+        totals = {'items': 0, 'value': 0, 'low_stock': 0, 'out_of_stock': 0}
+        
+        def records():
+            # Totals are summed while the rows stream past
+            for store_id, product_id, sku, name, qty, unit_price, reorder_level in stream_rows(query):
+                status = "Out of Stock" if qty == 0 else \
+                         "Low Stock" if qty <= reorder_level else \
+                         "In Stock"
+                value = qty * unit_price
+                
+                totals['items'] += qty
+                totals['value'] += value
+                totals['low_stock'] += 1 if status == "Low Stock" else 0
+                totals['out_of_stock'] += 1 if status == "Out of Stock" else 0
+                yield store_id, product_id, sku, name, qty, unit_price, round(value, 2), status
+        
+        fields = ["store_id", "product_id", "sku", "name", "quantity", "unit_price", "value", "status"]
         headers = ["SKU", "Product Name", "Qty", "Unit Price", "Value", "Status"]
-        rows = []
         
-        for p in products:
-            status = "Out of Stock" if p.current_quantity == 0 else \
-                     "Low Stock" if p.current_quantity <= p.reorder_level else \
-                     "In Stock"
-                     
-            value = p.current_quantity * p.unit_price
-            
-            rows.append([
-                p.sku,
-                p.name,
-                p.current_quantity,
-                f"{p.unit_price:.2f}",
-                f"{value:.2f}",
-                status
-            ])
-            
+        def table_row(record):
+            _, _, sku, name, qty, unit_price, value, status = record
+            return [sku, name, qty, f"{unit_price:.2f}", f"{value:.2f}", status]
+        
+        if args.format != 'table':
+            write_rows(args.format, fields, records(), headers, table_row)
+            return
+        
         print("\nCURRENT INVENTORY")
         print("=" * 80)
-        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        if not write_rows(args.format, fields, records(), headers, table_row):
+            print("No products found.")
+            return
         print("-" * 80)
-        print(f"Total Items: {sum(p.current_quantity for p in products)}")
-        print(f"Total Value: {total_value:.2f}")
-        print(f"Low Stock Items: {sum(1 for p in products if p.current_quantity <= p.reorder_level and p.current_quantity > 0)}")
-        print(f"Out of Stock Items: {sum(1 for p in products if p.current_quantity == 0)}")
+        print(f"Total Items: {totals['items']}")
+        print(f"Total Value: {totals['value']:.2f}")
+        print(f"Low Stock Items: {totals['low_stock']}")
+        print(f"Out of Stock Items: {totals['out_of_stock']}")
 
 def handle_movements(args):
     """Show inventory movements report"""
+    from collections import defaultdict
+    from datetime import timedelta
+    from sqlalchemy import select
+    from archive import STOCK_SIGN
+    
     with setup_cli():
-        from datetime import timedelta
-        
         # Build the query
-        query = InventoryMovement.query
+        query = select(
+            InventoryMovement.movement_date, InventoryMovement.store_id, InventoryMovement.product_id,
+            Product.name, InventoryMovement.movement_type, InventoryMovement.quantity,
+            InventoryMovement.unit_price, InventoryMovement.reference
+        ).outerjoin(Product, Product.id == InventoryMovement.product_id)
         
         if args.product_id:
-            query = query.filter_by(product_id=args.product_id)
+            query = query.where(InventoryMovement.product_id == args.product_id)
             
         if args.type:
-            query = query.filter_by(movement_type=args.type)
+            query = query.where(InventoryMovement.movement_type == args.type)
+            
+        if args.store_id:
+            query = query.where(InventoryMovement.store_id == args.store_id)
             
         # Filter by date
         if args.days:
             cutoff_date = datetime.utcnow() - timedelta(days=args.days)
-            query = query.filter(InventoryMovement.movement_date >= cutoff_date)
+            query = query.where(InventoryMovement.movement_date >= cutoff_date)
             
-        # Get the movements
-        movements = query.order_by(InventoryMovement.movement_date.desc()).all()
+        query = query.order_by(InventoryMovement.movement_date.desc(), InventoryMovement.id.desc())
+        if args.limit:
+            query = query.limit(args.limit)
         
-        if not movements:
-            print("No movements found matching the criteria.")
-            return
-            
-        # Calculate totals
-        total_stock_in = sum(m.quantity for m in movements if m.movement_type == "stock_in")
-        total_sales = sum(m.quantity for m in movements if m.movement_type == "sale")
-        total_removals = sum(m.quantity for m in movements if m.movement_type == "removal")
+        totals = defaultdict(int)
         
-        # Get product lookup dictionary
-        product_ids = {m.product_id for m in movements}
-        products = {p.id: p.name for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+        def records():
+            # Totals are summed while the rows stream past
+            for movement_date, store_id, product_id, name, movement_type, qty, unit_price, reference in stream_rows(query):
+                totals[movement_type] += qty
+                yield (movement_date, store_id, product_id, name or f"Unknown ({product_id})", movement_type,
+                       qty, unit_price, round(qty * unit_price, 2), reference)
         
-        # Format the output
+        fields = ["date", "store_id", "product_id", "product", "type", "quantity", "unit_price", "total", "reference"]
         headers = ["Date", "Product", "Type", "Quantity", "Unit Price", "Total", "Reference"]
-        rows = []
+        type_names = {"stock_in": "Stock In", "sale": "Sale", "removal": "Removal",
+                      "transfer_in": "Transfer In", "transfer_out": "Transfer Out"}
         
-        for m in movements:
-            movement_type = "Stock In" if m.movement_type == "stock_in" else \
-                           "Sale" if m.movement_type == "sale" else \
-                           "Removal"
-                           
-            product_name = products.get(m.product_id, f"Unknown ({m.product_id})")
-            total = m.quantity * m.unit_price
-            
-            rows.append([
-                m.movement_date.strftime("%Y-%m-%d"),
-                product_name,
-                movement_type,
-                m.quantity,
-                f"{m.unit_price:.2f}",
-                f"{total:.2f}",
-                m.reference or ""
-            ])
+        def table_row(record):
+            movement_date, _, _, name, movement_type, qty, unit_price, total, reference = record
+            return [movement_date.strftime("%Y-%m-%d"), name, type_names.get(movement_type, movement_type),
+                    qty, f"{unit_price:.2f}", f"{total:.2f}", reference or ""]
+        
+        if args.format != 'table':
+            write_rows(args.format, fields, records(), headers, table_row)
+            return
             
         print("\nINVENTORY MOVEMENTS REPORT")
         
         # Show filter info
         print("=" * 80)
         if args.product_id:
-            product = Product.query.get(args.product_id)
+            product = db.session.get(Product, args.product_id)
             if product:
                 print(f"Product: {product.name} (ID: {product.id})")
         
+        if args.store_id:
+            print(f"Store ID: {args.store_id}")
+        
         if args.type:
             print(f"Movement Type: {args.type}")
             
         print(f"Period: Last {args.days} days")
         print("=" * 80)
         
-        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        if not write_rows(args.format, fields, records(), headers, table_row):
+            print("No movements found matching the criteria.")
+            return
         print("-" * 80)
-        print(f"Total Stock In: {total_stock_in}")
-        print(f"Total Sales: {total_sales}")
-        print(f"Total Removals: {total_removals}")
-        print(f"Net Change: {total_stock_in - total_sales - total_removals}")
+        print(f"Total Stock In: {totals['stock_in']}")
+        print(f"Total Sales: {totals['sale']}")
+        print(f"Total Removals: {totals['removal']}")
+        if totals['transfer_in'] or totals['transfer_out']:
+            print(f"Total Transfers In: {totals['transfer_in']}")
+            print(f"Total Transfers Out: {totals['transfer_out']}")
+        print(f"Net Change: {sum(STOCK_SIGN.get(t, 0) * qty for t, qty in totals.items())}")
         
-def main():
-    """Main entry point for the CLI"""
-    # Register all command groups
-    register_product_commands()
-    register_inventory_commands()
-    register_report_commands()
+def handle_report(args):
+    """Compute analytic reports per store, optionally across worker processes"""
+    import time
+    import report_executor
+
+    with setup_cli():
+        if args.all_stores:
+            stores = Store.query.filter_by(is_active=True).order_by(Store.id).all()
+        elif args.store_id:
+            stores = Store.query.filter(Store.id.in_(args.store_id)).order_by(Store.id).all()
+        else:
+            stores = Store.query.order_by(Store.id).limit(1).all()
+
+        if not stores:
+            raise CommandError("No store found in the database.")
+
+        database_url = db.engine.url.render_as_string(hide_password=False)
+        store_names = {s.id: s.name for s in stores}
+
+    started = time.perf_counter()
+    reports, totals = report_executor.run_reports(
+        list(store_names),
+        database_url,
+        days=args.days,
+        workers=args.workers,
+        top=args.top
+    )
+    elapsed = time.perf_counter() - started
+
+    headers = ["Store", "Products", "Stock Value", "Cost Value", "Low Stock", "Out of Stock", "Sold", "Sales Value"]
+    rows = []
+
+    for report in reports:
+        valuation = report['valuation']
+        sales = report['movements'].get('sale', {'quantity': 0, 'value': 0.0})
+        rows.append([
+            store_names[report['store_id']],
+            valuation['product_count'],
+            f"{valuation['retail_value']:.2f}",
+            f"{valuation['cost_value']:.2f}",
+            valuation['low_stock_count'],
+            valuation['out_of_stock_count'],
+            sales['quantity'],
+            f"{sales['value']:.2f}"
+        ])
+
+    print(f"\nSTORE REPORT - Last {args.days} days")
+    print("=" * 80)
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+
+    if len(reports) == 1 and reports[0]['top_products']:
+        print("\nTop Products:")
+        print(tabulate(
+            [[p['sku'] or "", p['name'], p['quantity'], f"{p['value']:.2f}"] for p in reports[0]['top_products']],
+            headers=["SKU", "Name", "Sold", "Value"],
+            tablefmt="simple"
+        ))
+
+    print("-" * 80)
+    print(f"Stores: {totals['store_count']}")
+    print(f"Total Stock Value: {totals['retail_value']:.2f}")
+    print(f"Low Stock Items: {totals['low_stock_count']}")
+    for movement_type, summary in sorted(totals['movements'].items()):
+        print(f"{movement_type}: {summary['quantity']} units, {summary['value']:.2f}")
+    print(f"Computed in {elapsed:.2f}s with {max(args.workers, 1)} worker(s)")
+
+def handle_export_movements(args):
+    """Export new movements since the last watermark to columnar files"""
+    import time
+    try:
+        import ledger_export
+    except ImportError as e:
+        raise CommandError(f"The ledger export needs pyarrow ({e}). Install the export extra: pip install '.[export]'")
+
+    with setup_cli():
+        started = time.perf_counter()
+        try:
+            result = ledger_export.export_movements(
+                db.engine,
+                args.output,
+                fmt=args.format,
+                chunk_size=args.chunk_size,
+                full=args.full
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        if not result['rows']:
+            print(f"No new movements since ID {result['last_id']}.")
+            return
+
+        print(f"Exported {result['rows']} movements to {result['files']} files in {elapsed:.2f}s")
+        print(f"Watermark: movement ID {result['last_id']}")
+
+def handle_archive_movements(args):
+    """Move movements older than the retention window into the archive"""
+    import time
+    import archive
+
+    with setup_cli():
+        started = time.perf_counter()
+        archived = archive.archive_movements(
+            retention_days=args.retention_days,
+            store_id=args.store_id,
+            batch_size=args.batch_size,
+            progress=lambda count: print(f"  archived {count} movements...")
+        )
+        elapsed = time.perf_counter() - started
+
+        if not archived:
+            print(f"No movements older than {args.retention_days} days.")
+            return
+
+        print(f"Archived {archived} movements in {elapsed:.2f}s")
+        print(f"Archive horizon: {archive.archive_horizon(args.store_id)}")
+
+def handle_forecast(args):
+    """Forecast demand for every product of a store and suggest reorder levels"""
+    import time
+    import forecasting
+
+    with setup_cli():
+        store = Store.query.get(args.store_id) if args.store_id else Store.query.first()
+        if not store:
+            raise CommandError("No store found in the database.")
+
+        started = time.perf_counter()
+        product_ids, demand, levels = forecasting.forecast_store(
+            store.id,
+            method=args.method,
+            days=args.days,
+            alpha=args.alpha,
+            window=args.window,
+            lead_time_days=args.lead_time,
+            service_factor=args.service_factor
+        )
+        elapsed = time.perf_counter() - started
+
+        if len(product_ids) == 0:
+            print("No products found.")
+            return
+
+        top = forecasting.summarize(product_ids, demand, levels, limit=args.top)
+        products = {p.id: p for p in Product.query.filter(Product.id.in_([t[0] for t in top])).all()}
+
+        headers = ["ID", "SKU", "Name", "Daily Demand", "Current Reorder", "Suggested Reorder"]
+        rows = []
+
+        for product_id, daily_demand, level in top:
+            p = products.get(product_id)
+            rows.append([
+                product_id,
+                p.sku if p else "",
+                p.name if p else f"Unknown ({product_id})",
+                f"{daily_demand:.2f}",
+                p.reorder_level if p else "",
+                level
+            ])
+
+        print(f"\nDEMAND FORECAST - {store.name}")
+        print("=" * 80)
+        print(f"Method: {args.method}  History: {args.days} days  Products: {len(product_ids)}")
+        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        print(f"Fitted {len(product_ids)} products in {elapsed:.2f}s")
+
+        if args.apply:
+            updated = forecasting.apply_reorder_levels(store.id, product_ids, levels)
+            print(f"Updated reorder level for {updated} products")
+
+def handle_issue_token(args):
+    """Issue a bearer token for the API"""
+    from models import User
+    from tokens import MAX_TOKEN_TTL, issue_token
+
+    if args.ttl is not None and not 0 < args.ttl <= MAX_TOKEN_TTL:
+        raise CommandError(f"--ttl must be between 1 and {MAX_TOKEN_TTL} seconds (API_TOKEN_MAX_TTL).")
+
+    with setup_cli():
+        user = User.query.filter_by(username=args.username).first()
+        if not user:
+            raise CommandError(f"User '{args.username}' not found.")
+        if not user.is_active:
+            raise CommandError(f"User '{args.username}' is disabled.")
+
+        token, expires_at = issue_token(user, ttl=args.ttl)
+        print(token)
+        print(f"Expires at {expires_at.isoformat()} UTC", file=sys.stderr)
+
+def handle_edge_sync(args):
+    """Keep the local edge store in sync with the central server"""
+    import time
+    import edge
+
+    store_id = os.environ.get("EDGE_STORE_ID")
+    if not store_id:
+        raise CommandError("EDGE_STORE_ID is not set; edge-sync only runs on edge nodes.")
+
+    with setup_cli():
+        try:
+            client = edge.upstream_client()
+        except edge.UpstreamError as e:
+            raise CommandError(str(e))
+
+        while True:
+            try:
+                result = edge.sync_once(client, int(store_id), batch_size=args.batch_size)
+                print(f"[{datetime.now():%H:%M:%S}] pushed {result['pushed']} movements "
+                      f"({result['rejected']} rejected), pulled {result['updated']} products, "
+                      f"{result['deleted']} deleted")
+            except edge.UpstreamError as e:
+                # Offline: movements stay queued locally until the next attempt
+                db.session.rollback()
+                print(f"[{datetime.now():%H:%M:%S}] upstream unavailable: {e}")
+
+            if args.once:
+                break
+            time.sleep(args.interval)
+
+def handle_outbox_relay(args):
+    """Publish outbox events to a sink, resuming from the relay's checkpoint"""
+    import time
+    import outbox
+
+    # Keep status lines out of the event stream when it goes to stdout
+    log = sys.stderr if args.sink == '-' else sys.stdout
+
+    with setup_cli():
+        try:
+            sink = outbox.open_sink(args.sink)
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+        relay = outbox.Relay(sink, name=args.name, batch_size=args.batch_size)
+        try:
+            while True:
+                try:
+                    published = relay.run_once()
+                    if published or args.once:
+                        print(f"[{datetime.now():%H:%M:%S}] published {published} events "
+                              f"(checkpoint {relay.checkpoint().last_event_id})", file=log)
+                    if args.prune:
+                        pruned = outbox.prune_events()
+                        if pruned:
+                            print(f"[{datetime.now():%H:%M:%S}] pruned {pruned} events", file=log)
+                except outbox.SinkError as e:
+                    # The checkpoint did not move; the batch is sent again next time
+                    db.session.rollback()
+                    print(f"[{datetime.now():%H:%M:%S}] sink unavailable: {e}", file=log)
+
+                if args.once:
+                    break
+                time.sleep(args.interval)
+        finally:
+            sink.close()
+
+def read_lines(source, prompt):
+    """Lines from a file, or typed at a prompt when interactive"""
+    while True:
+        if prompt:
+            try:
+                yield input(prompt)
+            except EOFError:
+                print()
+                return
+        else:
+            line = source.readline()
+            if not line:
+                return
+            yield line
+
+
+def handle_shell(args):
+    """Run commands line by line in one application context"""
+    import shlex
+    import time
     
-    # Parse arguments
-    args = parser.parse_args()
+    source = open(args.file) if args.file else sys.stdin
+    prompt = None
+    if source.isatty():
+        try:
+            import readline  # noqa: F401 (line editing and history for input())
+        except ImportError:
+            pass
+        prompt = 'kiryana> '
+        print("Kiryana shell. Type a command without 'cli.py', 'help' for the list, or 'exit'.")
     
-    # No command specified
-    if not args.command:
-        parser.print_help()
-        return
+    failures = 0
+    try:
+        with setup_cli():
+            for number, line in enumerate(read_lines(source, prompt), start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line in ('exit', 'quit'):
+                    break
+                if line == 'help':
+                    parser.print_help()
+                    continue
+                
+                command_args = None
+                try:
+                    command_args = parser.parse_args(shlex.split(line))
+                except ValueError as e:
+                    # Unbalanced quotes
+                    print(f"Error: {e}")
+                except SystemExit as e:
+                    # argparse exits after --help and on bad arguments
+                    if not e.code:
+                        continue
+                
+                if command_args is not None and command_args.command in (None, 'shell'):
+                    print("Error: expected a command, e.g. 'sale --product-id 1 --quantity 2'")
+                    command_args = None
+                
+                succeeded = False
+                if command_args is not None:
+                    started = time.perf_counter()
+                    succeeded = run_command(command_args)
+                    # A fresh session per command; its connection goes back to the pool
+                    db.session.remove()
+                    if args.timing:
+                        elapsed = (time.perf_counter() - started) * 1000
+                        print(f"[{command_args.command}: {elapsed:.1f} ms]", file=sys.stderr)
+                
+                if not succeeded:
+                    failures += 1
+                    if args.stop_on_error:
+                        print(f"Stopped at line {number}.")
+                        break
+    finally:
+        if args.file:
+            source.close()
     
-    # Handle commands
+    if failures and not prompt:
+        sys.exit(1)
+
+
+def run_command(args):
+    """Run the handler of a parsed command; returns False if it failed"""
     command_handlers = {
         'list-products': handle_list_products,
         'add-product': handle_add_product,
         'show-product': handle_show_product,
+        'import-products': handle_import_products,
+        'export-products': handle_export_products,
+        'migrate-product-master': handle_migrate_product_master,
+        'update-master': handle_update_master,
         'stock-in': handle_stock_in,
         'sale': handle_sale,
         'removal': handle_removal,
+        'stock-shards': handle_stock_shards,
         'inventory': handle_inventory,
-        'movements': handle_movements
+        'movements': handle_movements,
+        'report': handle_report,
+        'export-movements': handle_export_movements,
+        'archive-movements': handle_archive_movements,
+        'forecast': handle_forecast,
+        'issue-token': handle_issue_token,
+        'edge-sync': handle_edge_sync,
+        'outbox-relay': handle_outbox_relay,
+        'shell': handle_shell
     }
     
     handler = command_handlers.get(args.command)
-    if handler:
-        try:
-            handler(args)
-        except Exception as e:
-            print(f"Error executing command: {e}")
-    else:
+    if not handler:
         print(f"Unknown command: {args.command}")
         parser.print_help()
+        return False
+    
+    succeeded = True
+    trace = MemoryTrace() if args.trace_memory else nullcontext()
+    try:
+        with trace:
+            handler(args)
+    except BrokenPipeError:
+        raise
+    except CommandError as e:
+        print(f"Error: {e}")
+        succeeded = False
+    except Exception as e:
+        print(f"Error executing command: {e}")
+        succeeded = False
+    if args.trace_memory:
+        print(f"Memory {args.command}: peak {format_size(trace.peak)} in {trace.duration:.2f}s",
+              file=sys.stderr)
+        for site, size in trace.top_sites:
+            print(f"  {format_size(size):>10}  {site}", file=sys.stderr)
+    return succeeded
+
+
+def main():
+    """Main entry point for the CLI"""
+    # Register all command groups
+    register_product_commands()
+    register_inventory_commands()
+    register_report_commands()
+    register_forecast_commands()
+    register_access_commands()
+    register_edge_commands()
+    register_event_commands()
+    register_shell_commands()
+    
+    # Parse arguments
+    args = parser.parse_args()
+    
+    # No command specified
+    if not args.command:
+        parser.print_help()
+        return
+    
+    # Handle commands
+    if not run_command(args):
+        sys.exit(1)
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
         print("\nOperation cancelled by user.")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+    except BrokenPipeError:
+        # Output piped into a command that exited early, e.g. head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
\ No newline at end of file
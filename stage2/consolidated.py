@@ -0,0 +1,155 @@
+"""
+Kiryana Inventory System - Consolidated Reporting
+
+Chain-wide figures for all stores at once. Every report is a single grouped
+aggregate query, so the number of database round trips does not depend on
+how many stores there are, and results are cached per worker for a short
+time.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from app import db
+from archive import includes_archive, movement_ledger
+from cache import TTLCache
+from models import Store, Product, ProductMaster, catalog_column
+
+# Seconds a consolidated report may be served from cache
+CACHE_TTL = int(os.environ.get("CONSOLIDATED_REPORT_CACHE_TTL", "60"))
+
+report_cache = TTLCache(ttl=CACHE_TTL)
+
+# Report periods, matching the single-store sales report
+PERIODS = {
+    'last7': 7,
+    'last30': 30,
+    'last90': 90,
+    'lastyear': 365,
+}
+
+
+def period_range(period, end_date=None):
+    """Return (start_date, end_date) for a named period, defaulting to last30"""
+    end_date = end_date or datetime.now()
+    return end_date - timedelta(days=PERIODS.get(period, 30)), end_date
+
+
+def inventory_by_store():
+    """Product count, stock value, low stock and out of stock counts per store"""
+    low_stock = case((Product.available_quantity <= Product.reorder_level, 1), else_=0)
+    out_of_stock = case((Product.available_quantity == 0, 1), else_=0)
+    unit_price = catalog_column('unit_price')
+
+    rows = db.session.query(
+        Store.id,
+        Store.name,
+        Store.code,
+        func.count(Product.id).label('product_count'),
+        func.coalesce(func.sum(Product.available_quantity), 0).label('total_quantity'),
+        func.coalesce(func.sum(Product.available_quantity * unit_price), 0).label('total_value'),
+        func.coalesce(func.sum(low_stock), 0).label('low_stock_count'),
+        func.coalesce(func.sum(out_of_stock), 0).label('out_of_stock_count')
+    ).outerjoin(Product, Product.store_id == Store.id).outerjoin(
+        ProductMaster, ProductMaster.id == Product.master_id
+    ).filter(
+        Store.is_active == True
+    ).group_by(Store.id, Store.name, Store.code).order_by(Store.name).all()
+
+    return [{
+        'store_id': r.id,
+        'store_name': r.name,
+        'store_code': r.code,
+        'product_count': int(r.product_count),
+        'total_quantity': int(r.total_quantity),
+        'total_value': float(r.total_value),
+        'low_stock_count': int(r.low_stock_count),
+        'out_of_stock_count': int(r.out_of_stock_count)
+    } for r in rows]
+
+
+def sales_by_store_category(start_date, end_date):
+    """Sold quantity and value per store and product category"""
+    ledger = movement_ledger(includes_archive(None, start_date))
+
+    category = catalog_column('category')
+
+    rows = db.session.query(
+        ledger.c.store_id,
+        category,
+        func.sum(ledger.c.quantity).label('quantity'),
+        func.sum(ledger.c.quantity * ledger.c.unit_price).label('value')
+    ).join(Product, Product.id == ledger.c.product_id).outerjoin(
+        ProductMaster, ProductMaster.id == Product.master_id
+    ).filter(
+        ledger.c.movement_type == 'sale',
+        ledger.c.movement_date.between(start_date, end_date)
+    ).group_by(ledger.c.store_id, category).all()
+
+    return [{
+        'store_id': r.store_id,
+        'category': r.category or 'Uncategorized',
+        'quantity': int(r.quantity or 0),
+        'value': float(r.value or 0)
+    } for r in rows]
+
+
+def build_report(period='last30'):
+    """Compute the full consolidated report for a period (uncached)"""
+    start_date, end_date = period_range(period)
+
+    stores = inventory_by_store()
+    sales = sales_by_store_category(start_date, end_date)
+
+    # Roll the store/category rows up in Python; there are few of them
+    sales_by_store = {}
+    sales_by_category = {}
+    for row in sales:
+        store_totals = sales_by_store.setdefault(row['store_id'], {'quantity': 0, 'value': 0.0})
+        store_totals['quantity'] += row['quantity']
+        store_totals['value'] += row['value']
+
+        category_totals = sales_by_category.setdefault(row['category'], {'quantity': 0, 'value': 0.0})
+        category_totals['quantity'] += row['quantity']
+        category_totals['value'] += row['value']
+
+    for store in stores:
+        totals = sales_by_store.get(store['store_id'], {'quantity': 0, 'value': 0.0})
+        store['sales_quantity'] = totals['quantity']
+        store['sales_value'] = totals['value']
+
+    return {
+        'period': period,
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'generated_at': datetime.utcnow().isoformat(),
+        'stores': stores,
+        'sales_by_store_category': sales,
+        'sales_by_category': [
+            {'category': category, **totals}
+            for category, totals in sorted(sales_by_category.items(), key=lambda item: -item[1]['value'])
+        ],
+        'totals': {
+            'store_count': len(stores),
+            'product_count': sum(s['product_count'] for s in stores),
+            'total_value': sum(s['total_value'] for s in stores),
+            'low_stock_count': sum(s['low_stock_count'] for s in stores),
+            'out_of_stock_count': sum(s['out_of_stock_count'] for s in stores),
+            'sales_quantity': sum(r['quantity'] for r in sales),
+            'sales_value': sum(r['value'] for r in sales)
+        }
+    }
+
+
+def get_report(period='last30', refresh=False):
+    """Return the consolidated report for a period, served from cache when fresh"""
+    if period not in PERIODS:
+        period = 'last30'
+
+    key = ('consolidated', period)
+    if refresh:
+        report_cache.invalidate(key)
+
+    return report_cache.get_or_set(key, lambda: build_report(period))
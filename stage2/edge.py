@@ -0,0 +1,281 @@
+"""
+Kiryana Inventory System - Edge Node
+
+Runs a store's counters against a local SQLite database so that sales and
+stock-in are recorded at local disk speed and keep working when the central
+PostgreSQL server is unreachable. The app switches to edge mode when
+EDGE_STORE_ID is set; DATABASE_URL then defaults to sqlite:///kiryana_edge.db.
+
+`cli.py edge-sync` reconciles the local store with the central server:
+
+* push: local movements newer than the pushed watermark are sent upstream
+  in gzip-compressed batches. Each carries the idempotency key
+  "<node id>:<local movement id>", so a batch re-sent after a lost response
+  is recognised upstream and not applied twice.
+* pull: the catalog delta since the last pulled version is fetched from
+  /api/store/<id>/changes and applied locally. Stock levels are the
+  upstream quantity plus whatever local movements are still unpushed.
+
+The catalog is managed centrally; products are kept under their upstream
+IDs on the edge node.
+"""
+
+import gzip
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import event, func, select
+
+DEFAULT_EDGE_DATABASE_URL = "sqlite:///kiryana_edge.db"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_TIMEOUT = 30
+# Refresh the upstream token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 60
+
+# Product fields copied from the upstream change feed
+CATALOG_FIELDS = ('name', 'sku', 'barcode', 'category', 'unit_price', 'reorder_level')
+
+
+def configure_sqlite(engine):
+    """Tune a local SQLite database for many small, durable writes"""
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+class UpstreamError(Exception):
+    """The central server could not be reached or refused a request"""
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect from the API means the login page, i.e. the token was refused
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class UpstreamClient:
+    """JSON client for the central server's API using bearer tokens"""
+
+    def __init__(self, base_url, username, password, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.token = None
+        self.token_expires_at = 0
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def _authenticate(self):
+        response = self._send('POST', '/api/token', json.dumps({
+            'username': self.username,
+            'password': self.password
+        }).encode('utf-8'), {'Content-Type': 'application/json'})
+        self.token = response['access_token']
+        self.token_expires_at = datetime.fromisoformat(response['expires_at']).replace(
+            tzinfo=timezone.utc).timestamp()
+
+    def _send(self, method, path, body=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code in (301, 302, 303, 401):
+                self.token = None
+            raise UpstreamError(f"{method} {path} failed with HTTP {e.code}") from e
+        except (urllib.error.URLError, socket.timeout, ConnectionError) as e:
+            raise UpstreamError(f"{method} {path} failed: {e}") from e
+
+    def request(self, method, path, payload=None, compress=False):
+        """Send an authenticated request and return the decoded JSON response"""
+        if self.token is None or time.time() > self.token_expires_at - TOKEN_REFRESH_MARGIN:
+            self._authenticate()
+
+        headers = {'Authorization': f'Bearer {self.token}', 'Accept-Encoding': 'identity'}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+            if compress:
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+
+        return self._send(method, path, body, headers)
+
+
+def get_state(store_id):
+    """Sync state of the local store, created on first use"""
+    from app import db
+    from models import EdgeSyncState
+
+    state = db.session.get(EdgeSyncState, store_id)
+    if state is None:
+        state = EdgeSyncState(
+            store_id=store_id,
+            # Unique per local database, so a rebuilt node never reuses keys
+            node_id=os.environ.get("EDGE_NODE_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}",
+            pushed_movement_id=0,
+            catalog_version=0,
+            rejected_count=0
+        )
+        db.session.add(state)
+        db.session.commit()
+    return state
+
+
+def ensure_local_store(client, store_id):
+    """Create the local store row from the upstream store if it is missing"""
+    from app import db
+    from models import Store
+
+    if db.session.get(Store, store_id):
+        return
+
+    stores = {s['id']: s for s in client.request('GET', '/api/user/stores')}
+    if store_id not in stores:
+        raise UpstreamError(f"Store {store_id} is not accessible upstream")
+
+    upstream = stores[store_id]
+    db.session.add(Store(
+        id=store_id,
+        name=upstream['name'],
+        code=upstream['code'],
+        location=upstream['location'],
+        address=upstream['address'],
+        phone=upstream['phone'],
+        email=upstream['email']
+    ))
+    db.session.commit()
+
+
+def push_movements(client, store_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Send unpushed local movements upstream; returns (pushed, rejected)"""
+    from app import db
+    from models import InventoryMovement
+
+    state = get_state(store_id)
+    pushed = 0
+    rejected = 0
+
+    while True:
+        movements = InventoryMovement.query.filter(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.id > state.pushed_movement_id
+        ).order_by(InventoryMovement.id).limit(batch_size).all()
+
+        if not movements:
+            break
+
+        result = client.request('POST', f'/api/store/{store_id}/movements/batch', {
+            'movements': [{
+                'key': f'{state.node_id}:{m.id}',
+                'product_id': m.product_id,
+                'movement_type': m.movement_type,
+                'quantity': m.quantity,
+                'unit_price': m.unit_price,
+                'reference': m.reference,
+                'notes': m.notes,
+                'movement_date': m.movement_date.isoformat() if m.movement_date else None
+            } for m in movements]
+        }, compress=True)
+
+        # Rejected movements (e.g. for a product deleted upstream) cannot
+        # succeed on a retry, so they are counted and skipped
+        state.pushed_movement_id = movements[-1].id
+        state.rejected_count += len(result['rejected'])
+        state.last_push_at = datetime.utcnow()
+        db.session.commit()
+
+        pushed += result['accepted'] + result['duplicates']
+        rejected += len(result['rejected'])
+
+    return pushed, rejected
+
+
+def pending_deltas(store_id, after_id):
+    """Net stock change per product of local movements not pushed yet"""
+    from app import db
+    from archive import STOCK_SIGN
+    from models import InventoryMovement
+
+    rows = db.session.execute(
+        select(
+            InventoryMovement.product_id,
+            InventoryMovement.movement_type,
+            func.sum(InventoryMovement.quantity)
+        ).where(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.id > after_id
+        ).group_by(InventoryMovement.product_id, InventoryMovement.movement_type)
+    ).all()
+
+    deltas = {}
+    for product_id, movement_type, quantity in rows:
+        deltas[product_id] = deltas.get(product_id, 0) + STOCK_SIGN.get(movement_type, 0) * int(quantity or 0)
+    return deltas
+
+
+def pull_catalog(client, store_id):
+    """Apply the upstream catalog delta locally; returns (updated, deleted)"""
+    from app import db
+    from models import Product
+
+    state = get_state(store_id)
+    changes = client.request('GET', f'/api/store/{store_id}/changes?since={state.catalog_version}')
+
+    deltas = pending_deltas(store_id, state.pushed_movement_id)
+    local = {p.id: p for p in Product.query.filter(
+        Product.id.in_([row['id'] for row in changes['products']])
+    ).all()} if changes['products'] else {}
+
+    for row in changes['products']:
+        product = local.get(row['id'])
+        if product is None:
+            product = Product(id=row['id'], store_id=store_id)
+            db.session.add(product)
+        for field in CATALOG_FIELDS:
+            setattr(product, field, row[field])
+        product.current_quantity = row['current_quantity'] + deltas.get(row['id'], 0)
+
+    deleted = 0
+    if changes['deleted']:
+        for product in Product.query.filter(Product.id.in_(changes['deleted'])).all():
+            db.session.delete(product)
+            deleted += 1
+
+    state.catalog_version = changes['version']
+    state.last_pull_at = datetime.utcnow()
+    db.session.commit()
+
+    return len(changes['products']), deleted
+
+
+def upstream_client():
+    """Client for the central server configured from the environment"""
+    base_url = os.environ.get("EDGE_UPSTREAM_URL")
+    if not base_url:
+        raise UpstreamError("EDGE_UPSTREAM_URL is not set")
+    return UpstreamClient(
+        base_url,
+        os.environ.get("EDGE_USERNAME", ""),
+        os.environ.get("EDGE_PASSWORD", ""),
+        timeout=int(os.environ.get("EDGE_UPSTREAM_TIMEOUT", DEFAULT_TIMEOUT))
+    )
+
+
+def sync_once(client, store_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Push local movements, then pull the catalog delta"""
+    ensure_local_store(client, store_id)
+    pushed, rejected = push_movements(client, store_id, batch_size)
+    updated, deleted = pull_catalog(client, store_id)
+    return {'pushed': pushed, 'rejected': rejected, 'updated': updated, 'deleted': deleted}
@@ -0,0 +1,250 @@
+"""
+Kiryana Inventory System - Demand Forecasting
+
+Builds a dense day x product sales matrix per store straight from the
+InventoryMovement ledger and fits simple demand models for every SKU at once
+with NumPy, so suggested reorder levels can be written back in bulk.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Default forecasting parameters
+DEFAULT_HISTORY_DAYS = 365
+DEFAULT_ALPHA = 0.3
+DEFAULT_WINDOW = 28
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_SERVICE_FACTOR = 1.65  # ~95% service level
+
+# Rows per bulk UPDATE statement when writing reorder levels back
+UPDATE_CHUNK_SIZE = 5000
+
+
+class SalesMatrix:
+    """Dense day x product sales quantities for one store"""
+
+    def __init__(self, store_id, product_ids, start_date, quantities):
+        self.store_id = store_id
+        self.product_ids = product_ids      # int64[products], sorted
+        self.start_date = start_date        # date of row 0
+        self.quantities = quantities        # float32[days, products]
+
+    @property
+    def days(self):
+        return self.quantities.shape[0]
+
+    @property
+    def product_count(self):
+        return self.quantities.shape[1]
+
+
+def build_sales_matrix(store_id, days=DEFAULT_HISTORY_DAYS, end_date=None):
+    """Aggregate sale movements of a store into a day x product matrix"""
+    from sqlalchemy import func, select
+
+    from app import db
+    from models import InventoryMovement, Product
+
+    end_date = (end_date or datetime.utcnow()).date()
+    start_date = end_date - timedelta(days=days - 1)
+
+    # Every product of the store gets a column, even if it never sold
+    product_ids = np.fromiter(
+        db.session.execute(
+            select(Product.id).where(Product.store_id == store_id).order_by(Product.id)
+        ).scalars(),
+        dtype=np.int64
+    )
+    quantities = np.zeros((days, len(product_ids)), dtype=np.float32)
+
+    if len(product_ids) == 0:
+        return SalesMatrix(store_id, product_ids, start_date, quantities)
+
+    # Let the database collapse the ledger to one row per product per day
+    sale_day = func.date(InventoryMovement.movement_date)
+    rows = db.session.execute(
+        select(
+            InventoryMovement.product_id,
+            sale_day,
+            func.sum(InventoryMovement.quantity)
+        ).where(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.movement_type == 'sale',
+            InventoryMovement.movement_date >= datetime.combine(start_date, datetime.min.time()),
+            InventoryMovement.movement_date < datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+        ).group_by(InventoryMovement.product_id, sale_day)
+    ).all()
+
+    if not rows:
+        return SalesMatrix(store_id, product_ids, start_date, quantities)
+
+    row_products, row_days, row_quantities = zip(*rows)
+
+    # Only a few hundred distinct days exist, so convert those once and
+    # broadcast the offsets back to the rows
+    unique_days, day_inverse = np.unique(np.array(row_days, dtype=object).astype(str), return_inverse=True)
+    day_offsets = np.array(
+        [(datetime.strptime(d[:10], '%Y-%m-%d').date() - start_date).days for d in unique_days],
+        dtype=np.int64
+    )[day_inverse]
+
+    product_index = np.searchsorted(product_ids, np.array(row_products, dtype=np.int64))
+    in_range = (day_offsets >= 0) & (day_offsets < days)
+
+    np.add.at(
+        quantities,
+        (day_offsets[in_range], product_index[in_range]),
+        np.array(row_quantities, dtype=np.float32)[in_range]
+    )
+
+    return SalesMatrix(store_id, product_ids, start_date, quantities)
+
+
+def moving_average(quantities, window=DEFAULT_WINDOW):
+    """Mean daily demand and its deviation over the trailing window, per column"""
+    window = max(1, min(window, quantities.shape[0]))
+    recent = quantities[-window:]
+    return recent.mean(axis=0), recent.std(axis=0)
+
+
+def exponential_smoothing(quantities, alpha=DEFAULT_ALPHA):
+    """Simple exponential smoothing of every column at once
+
+    Returns the final smoothed level (the one-step-ahead daily forecast) and
+    the root mean squared one-step-ahead forecast error per column.
+    """
+    if not 0 < alpha <= 1:
+        raise ValueError("alpha must be in (0, 1]")
+
+    days = quantities.shape[0]
+    level = quantities[0].astype(np.float64)
+    squared_error = np.zeros_like(level)
+
+    # The recursion is sequential in time but vectorised across products
+    for t in range(1, days):
+        observed = quantities[t]
+        error = observed - level
+        squared_error += error * error
+        level += alpha * error
+
+    rmse = np.sqrt(squared_error / max(days - 1, 1))
+    return level, rmse
+
+
+def suggest_reorder_levels(daily_demand, demand_deviation,
+                           lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+                           service_factor=DEFAULT_SERVICE_FACTOR):
+    """Lead-time demand plus safety stock, rounded up to whole units"""
+    lead_time_days = np.asarray(lead_time_days, dtype=np.float64)
+    safety_stock = service_factor * demand_deviation * np.sqrt(lead_time_days)
+    levels = np.ceil(daily_demand * lead_time_days + safety_stock)
+    return np.maximum(levels, 0).astype(np.int64)
+
+
+def load_lead_times(store_id, product_ids, default=DEFAULT_LEAD_TIME_DAYS):
+    """Lead time per product from its preferred supplier, falling back to a default"""
+    from sqlalchemy import select
+
+    from app import db
+    from models import Product, SupplierProduct
+
+    lead_times = np.full(len(product_ids), default, dtype=np.float64)
+    if len(product_ids) == 0:
+        return lead_times
+
+    rows = db.session.execute(
+        select(SupplierProduct.product_id, SupplierProduct.lead_time_days).join(Product).where(
+            Product.store_id == store_id,
+            SupplierProduct.is_preferred == True,
+            SupplierProduct.lead_time_days != None
+        )
+    ).all()
+
+    if rows:
+        ids, days = zip(*rows)
+        index = np.searchsorted(product_ids, np.array(ids, dtype=np.int64))
+        lead_times[index] = np.array(days, dtype=np.float64)
+
+    return lead_times
+
+
+def forecast_store(store_id, method='ses', days=DEFAULT_HISTORY_DAYS,
+                   alpha=DEFAULT_ALPHA, window=DEFAULT_WINDOW,
+                   lead_time_days=None, service_factor=DEFAULT_SERVICE_FACTOR):
+    """Fit the chosen model for every product of a store
+
+    Returns (product_ids, daily_demand, suggested_reorder_levels) as arrays.
+    """
+    matrix = build_sales_matrix(store_id, days=days)
+
+    if method == 'ses':
+        demand, deviation = exponential_smoothing(matrix.quantities, alpha=alpha)
+    elif method == 'ma':
+        demand, deviation = moving_average(matrix.quantities, window=window)
+    else:
+        raise ValueError(f"Unknown forecasting method: {method}")
+
+    if lead_time_days is None:
+        lead_time_days = load_lead_times(store_id, matrix.product_ids)
+
+    levels = suggest_reorder_levels(demand, deviation,
+                                    lead_time_days=lead_time_days,
+                                    service_factor=service_factor)
+
+    return matrix.product_ids, demand, levels
+
+
+def apply_reorder_levels(store_id, product_ids, levels):
+    """Write suggested reorder levels back with bulk UPDATE statements
+
+    Only products whose level actually changes are touched. Returns the
+    number of updated products.
+    """
+    from sqlalchemy import select, update
+
+    from app import db
+    from models import Product
+    from outbox import add_events
+    from revisions import bump_revision
+
+    if len(product_ids) == 0:
+        return 0
+
+    # Fetch the current levels in one go to skip unchanged rows
+    current = dict(db.session.execute(
+        select(Product.id, Product.reorder_level).where(Product.store_id == store_id)
+    ).all())
+
+    changes = [
+        {'id': int(pid), 'reorder_level': int(level)}
+        for pid, level in zip(product_ids, levels)
+        if current.get(int(pid)) != int(level)
+    ]
+    if not changes:
+        return 0
+
+    # Bulk updates bypass the ORM flush hooks that version store writes and
+    # record outbox events
+    revision = bump_revision(store_id)
+    for change in changes:
+        change['updated_version'] = revision
+
+    for start in range(0, len(changes), UPDATE_CHUNK_SIZE):
+        db.session.execute(update(Product), changes[start:start + UPDATE_CHUNK_SIZE])
+
+    add_events([{
+        'store_id': store_id,
+        'event_type': 'product.reorder_level_changed',
+        'aggregate_id': change['id'],
+        'data': dict(change, store_id=store_id)
+    } for change in changes])
+
+    db.session.commit()
+    return len(changes)
+
+
+def summarize(product_ids, demand, levels, limit=20):
+    """Top products by forecast demand, for display"""
+    order = np.argsort(-demand)[:limit]
+    return [(int(product_ids[i]), float(demand[i]), int(levels[i])) for i in order]
@@ -0,0 +1,202 @@
+"""
+Kiryana Inventory System - Group Commit for Sales
+
+At peak every sale is its own transaction and waits for its own fsync. With
+SALE_BATCH_WINDOW_MS set, the sales view hands its movement to a per-process
+writer thread instead. The writer collects sales for up to that many
+milliseconds (or SALE_BATCH_SIZE sales, whichever comes first) and records
+them in one transaction, so one commit and one fsync are shared by the
+whole batch. Each request waits until the commit of its batch has returned,
+so a sale is only confirmed once it is durable.
+
+Stock is checked again inside the batch, in submission order, so two sales
+of the last unit in one batch cannot both succeed. A batch that fails to
+commit is retried one sale at a time, so a bad sale only fails itself.
+"""
+
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from archive import STOCK_SIGN
+from models import Product, InventoryMovement
+
+DEFAULT_BATCH_SIZE = 100
+# How long a request waits for its batch before giving up
+SUBMIT_TIMEOUT = 30
+
+
+class SaleRejected(Exception):
+    """A sale could not be recorded; the message is shown to the user"""
+
+
+class _Pending:
+    def __init__(self, fields):
+        self.fields = fields
+        self.done = threading.Event()
+        self.movement_id = None
+        self.created = False
+        self.error = None
+
+
+class SaleBatcher:
+    """Writer thread that commits queued movements in groups"""
+
+    def __init__(self, app, window_ms, batch_size=DEFAULT_BATCH_SIZE):
+        self.app = app
+        self.window = window_ms / 1000
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='sale-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, movement):
+        """Queue a movement and wait until its batch is committed
+
+        Returns (movement_id, created) like record_movement(); created is
+        False for a known idempotency key. Raises SaleRejected.
+        """
+        columns = InventoryMovement.__table__.columns
+        pending = _Pending({c.key: getattr(movement, c.key) for c in columns if c.key != 'id'})
+        self.queue.put(pending)
+        if not pending.done.wait(SUBMIT_TIMEOUT):
+            raise SaleRejected('The sale could not be confirmed in time. Check recent movements before retrying.')
+        if pending.error:
+            raise SaleRejected(pending.error)
+        return pending.movement_id, pending.created
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._collect()
+                try:
+                    self._commit(batch)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Group commit of %d sales failed; retrying one by one", len(batch))
+                    for pending in batch:
+                        pending.error = None
+                        try:
+                            self._commit([pending])
+                        except Exception as e:
+                            db.session.rollback()
+                            pending.error = f'The sale could not be recorded: {e.__class__.__name__}'
+                finally:
+                    db.session.close()
+                for pending in batch:
+                    pending.done.set()
+
+    def _commit(self, batch):
+        """Record a batch of movements in one transaction"""
+        from shards import insert_sharded_movement
+
+        keys = {p.fields['idempotency_key'] for p in batch if p.fields['idempotency_key']}
+        existing = {
+            (store_id, key): movement_id for store_id, key, movement_id in db.session.execute(
+                db.select(InventoryMovement.store_id, InventoryMovement.idempotency_key, InventoryMovement.id)
+                .where(InventoryMovement.idempotency_key.in_(keys))
+            )
+        } if keys else {}
+
+        product_ids = {p.fields['product_id'] for p in batch}
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+
+        deltas = {}
+        staged = []
+        repeated = []
+        seen = {}
+        for pending in batch:
+            fields = pending.fields
+            key = (fields['store_id'], fields['idempotency_key'])
+            if key in existing:
+                pending.movement_id = existing[key]
+                continue
+            if fields['idempotency_key'] and key in seen:
+                repeated.append((pending, seen[key]))
+                continue
+
+            product = products.get(fields['product_id'])
+            if product is None or product.store_id != fields['store_id']:
+                pending.error = 'Invalid product selected.'
+                continue
+            change = STOCK_SIGN[fields['movement_type']] * fields['quantity']
+            available = product.get_available_quantity() + deltas.get(product.id, 0)
+            if available + change < 0:
+                pending.error = f'Not enough inventory for {product.name}. Only {available} available.'
+                continue
+
+            movement = InventoryMovement(**fields)
+            if product.shard_count:
+                insert_sharded_movement(movement, product)
+            else:
+                db.session.add(movement)
+            deltas[product.id] = deltas.get(product.id, 0) + change
+            staged.append((pending, movement))
+            if fields['idempotency_key']:
+                seen[key] = pending
+
+        # One relative update per product covers all of its sales in the batch
+        for product_id, change in deltas.items():
+            product = products[product_id]
+            if not product.shard_count:
+                product.current_quantity = Product.current_quantity + change
+
+        try:
+            # IDs are read before the commit expires the movements
+            db.session.flush()
+            ids = [movement.id for _, movement in staged]
+            db.session.commit()
+        except IntegrityError:
+            if len(batch) > 1:
+                raise
+            # A concurrent writer recorded the same key first
+            db.session.rollback()
+            pending = batch[0]
+            pending.movement_id = db.session.execute(
+                db.select(InventoryMovement.id).filter_by(
+                    store_id=pending.fields['store_id'],
+                    idempotency_key=pending.fields['idempotency_key']
+                )
+            ).scalar()
+            if pending.movement_id is None:
+                raise
+            return
+
+        for (pending, movement), movement_id in zip(staged, ids):
+            pending.movement_id = movement_id
+            pending.created = True
+        for pending, first in repeated:
+            pending.movement_id = first.movement_id
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def sale_batcher(app):
+    """The process's batcher, started on first use (after any fork)"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = SaleBatcher(
+                app,
+                window_ms=app.config['SALE_BATCH_WINDOW_MS'],
+                batch_size=app.config['SALE_BATCH_SIZE']
+            )
+        return _batcher
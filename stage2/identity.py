@@ -0,0 +1,144 @@
+"""
+Kiryana Inventory System - Request Identity
+
+Flask-Login's user loader runs on every request. Instead of loading the User
+row and then lazily its role and store permissions (three queries before a
+view starts), each worker keeps a short-lived cache of detached snapshots of
+the fields requests actually need. Views that modify the user load the row
+explicitly and call invalidate_user() afterwards.
+
+Invalidation only reaches the worker that made the change; other workers
+pick the change up when their entry expires after USER_CACHE_TTL seconds.
+"""
+
+import os
+
+from flask_login import UserMixin
+
+from cache import TTLCache
+
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+# Minimum seconds between last_login writes for the same user
+LAST_SEEN_INTERVAL = int(os.environ.get("LAST_SEEN_INTERVAL", "300"))
+
+user_cache = TTLCache(ttl=USER_CACHE_TTL, max_entries=4096)
+
+
+class RoleSnapshot:
+    def __init__(self, name):
+        self.name = name
+
+
+class PermissionSnapshot:
+    def __init__(self, store_id, permission_level):
+        self.store_id = store_id
+        self.permission_level = permission_level
+
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only copy of a user for the current request
+
+    Offers the parts of models.User the views and templates rely on:
+    identity and name fields, role.name, store_permissions and the store
+    access checks.
+    """
+
+    is_token = False
+
+    def __init__(self, id, username, email=None, first_name=None, last_name=None,
+                 role=None, permissions=None, is_active=True, last_login=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.role = RoleSnapshot(role)
+        self.store_permissions = [
+            PermissionSnapshot(store_id, level) for store_id, level in (permissions or {}).items()
+        ]
+        self._is_active = is_active
+        self.last_login = last_login
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            role=user.role.name,
+            permissions={perm.store_id: perm.permission_level for perm in user.store_permissions},
+            is_active=user.is_active,
+            last_login=user.last_login
+        )
+
+    @property
+    def is_active(self):
+        return self._is_active
+
+    @property
+    def full_name(self):
+        """Return user's full name"""
+        if self.first_name and self.last_name:
+            return f"{self.first_name} {self.last_name}"
+        elif self.first_name:
+            return self.first_name
+        elif self.last_name:
+            return self.last_name
+        return self.username
+
+    def has_store_access(self, store_id):
+        """Check if user has access to a specific store"""
+        if self.role.name == 'admin':
+            return True
+        return any(perm.store_id == store_id for perm in self.store_permissions)
+
+    def has_store_write_access(self, store_id):
+        """Check if user has write access to a specific store"""
+        if self.role.name == 'admin':
+            return True
+        for perm in self.store_permissions:
+            if perm.store_id == store_id and (self.role.name == 'manager' or perm.permission_level == 'write'):
+                return True
+        return False
+
+
+def _load_snapshot(user_id):
+    from sqlalchemy.orm import joinedload, selectinload
+    from models import User
+
+    user = User.query.options(
+        joinedload(User.role),
+        selectinload(User.store_permissions)
+    ).filter_by(id=user_id).first()
+    return UserSnapshot.from_user(user) if user else None
+
+
+def load_user_snapshot(user_id):
+    """Return the cached snapshot of a user, loading it on a miss"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        snapshot = _load_snapshot(user_id)
+        if snapshot is not None:
+            user_cache.set(user_id, snapshot)
+    return snapshot
+
+
+def invalidate_user(user_id):
+    """Drop a user's snapshot after their row, role or permissions change"""
+    user_cache.invalidate(int(user_id))
+
+
+def touch_last_login(user, now):
+    """Record that a user was seen, at most once per LAST_SEEN_INTERVAL"""
+    from sqlalchemy import update
+    from app import db
+    from models import User
+
+    if user.last_login and (now - user.last_login).total_seconds() < LAST_SEEN_INTERVAL:
+        return
+
+    db.session.execute(update(User).where(User.id == user.id).values(last_login=now))
+    db.session.commit()
+    user.last_login = now
@@ -0,0 +1,232 @@
+"""
+Kiryana Inventory System - Movement Ledger Export
+
+Writes InventoryMovement rows to columnar files for analytics, partitioned
+Hive-style by store and month:
+
+    <output>/store_id=3/month=2025-04/part-<run>-<n>.parquet
+
+Rows are read in chunks through a server-side cursor, so memory stays bounded
+by the chunk size no matter how large the ledger is. A watermark file records
+the highest movement id exported; later runs only read and append rows above
+it, so the cost of a re-export is proportional to the new data.
+
+Ids are handed out when a transaction inserts, not when it commits, so a
+movement can become visible after a higher id was exported. The watermark
+therefore also lists the unseen ids in the last GAP_WINDOW ids below it,
+at most the MAX_GAPS newest of them, and the next run reads those again
+and exports any that have appeared since. Both the hot ledger and the archive are read, so movements that
+archive.py moved away before a run are still exported.
+
+Requires pyarrow, from the project's export extra (pip install '.[export]').
+"""
+
+import json
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy import func, or_, select, union_all
+
+WATERMARK_FILE = '_watermark.json'
+# Ids below the watermark still watched for late commits
+GAP_WINDOW = 10000
+# Most gaps kept, newest first; each is a bind parameter on both sides of the union
+MAX_GAPS = 500
+DEFAULT_CHUNK_SIZE = 50000
+# Partition files kept open at once; least recently used ones are closed
+MAX_OPEN_WRITERS = 64
+
+FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('product_id', pa.int64()),
+    ('store_id', pa.int64()),
+    ('movement_type', pa.string()),
+    ('quantity', pa.int64()),
+    ('unit_price', pa.float64()),
+    ('reference', pa.string()),
+    ('notes', pa.string()),
+    ('created_by', pa.int64()),
+    ('movement_date', pa.timestamp('us')),
+    ('created_at', pa.timestamp('us')),
+])
+
+# store_id is carried by the partition directory, as Hive-style readers
+# (pyarrow.dataset, DuckDB, Spark) expect, so it is not repeated in the files
+FILE_SCHEMA = SCHEMA.remove(SCHEMA.get_field_index('store_id'))
+
+
+def read_watermark(output_dir):
+    """Return the export state of a directory, or None if nothing was exported yet"""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_watermark(output_dir, state):
+    """Atomically replace the watermark file"""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class PartitionWriters:
+    """Open file writers per (store, month) partition, capped by an LRU"""
+
+    def __init__(self, output_dir, fmt, run_id):
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.run_id = run_id
+        self.writers = OrderedDict()
+        self.written = []      # (tmp_path, final_path) of every file of this run
+        self.sequence = 0
+
+    def write(self, store_id, month, table):
+        key = (store_id, month)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self._open(store_id, month)
+            self.writers[key] = writer
+            if len(self.writers) > MAX_OPEN_WRITERS:
+                _, oldest = self.writers.popitem(last=False)
+                oldest.close()
+        else:
+            self.writers.move_to_end(key)
+
+        if self.fmt == 'parquet':
+            writer.write_table(table)
+        else:
+            writer.write(table)
+
+    def _open(self, store_id, month):
+        directory = os.path.join(self.output_dir, f'store_id={store_id}', f'month={month}')
+        os.makedirs(directory, exist_ok=True)
+
+        self.sequence += 1
+        final_path = os.path.join(directory, f'part-{self.run_id}-{self.sequence:05d}{FORMATS[self.fmt]}')
+        tmp_path = final_path + '.tmp'
+        self.written.append((tmp_path, final_path))
+
+        if self.fmt == 'parquet':
+            return pq.ParquetWriter(tmp_path, FILE_SCHEMA, compression='zstd')
+        return ipc.new_file(tmp_path, FILE_SCHEMA)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+    def commit(self):
+        """Make the files of this run visible under their final names"""
+        for tmp_path, final_path in self.written:
+            os.replace(tmp_path, final_path)
+
+    def discard(self):
+        for tmp_path, _ in self.written:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _chunk_to_partitions(rows):
+    """Split a chunk of rows into Arrow tables per (store_id, month)"""
+    groups = {}
+    for row in rows:
+        month = row.movement_date.strftime('%Y-%m') if row.movement_date else 'unknown'
+        groups.setdefault((row.store_id, month), []).append(row)
+
+    for (store_id, month), group in groups.items():
+        columns = dict(zip(SCHEMA.names, zip(*group)))
+        table = pa.Table.from_arrays(
+            [pa.array(columns[field.name], type=field.type) for field in FILE_SCHEMA],
+            schema=FILE_SCHEMA
+        )
+        yield store_id, month, table
+
+
+def export_movements(engine, output_dir, fmt='parquet', chunk_size=DEFAULT_CHUNK_SIZE, full=False):
+    """Export movements newer than the watermark (or all of them with full=True)
+
+    Returns a dict with the number of rows and files written and the new
+    watermark.
+    """
+    from models import InventoryMovement, InventoryMovementArchive
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    state = read_watermark(output_dir)
+
+    if state and full:
+        raise ValueError(f"{output_dir} already holds an export; use a new directory for a full export")
+    if state and state.get('format', fmt) != fmt:
+        raise ValueError(f"{output_dir} holds a {state['format']} export")
+
+    tables = (InventoryMovement.__table__, InventoryMovementArchive.__table__)
+    low_id = state['last_id'] if state else 0
+    gaps = state.get('gaps', []) if state else []
+    started = datetime.utcnow()
+
+    with engine.connect() as conn:
+        # Fix the upper bound first so rows committed during the export are
+        # left for the next run instead of being half-read
+        high_id = max(conn.execute(select(func.max(table.c.id))).scalar() or 0 for table in tables)
+
+        if high_id <= low_id and not gaps:
+            return {'rows': 0, 'files': 0, 'last_id': low_id}
+
+        def new_rows(table):
+            return select(*[table.c[name] for name in SCHEMA.names]).where(
+                or_(table.c.id > low_id, table.c.id.in_(gaps)) if gaps else table.c.id > low_id,
+                table.c.id <= high_id
+            )
+
+        ledger = union_all(*[new_rows(table) for table in tables]).subquery()
+        query = select(ledger).order_by(ledger.c.store_id, ledger.c.id)
+
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+
+        writers = PartitionWriters(output_dir, fmt, uuid.uuid4().hex[:12])
+        rows_written = 0
+        watched_from = max(high_id - GAP_WINDOW, 0)
+        seen = set()
+        try:
+            for chunk in result.partitions():
+                for store_id, month, table in _chunk_to_partitions(chunk):
+                    writers.write(store_id, month, table)
+                rows_written += len(chunk)
+                seen.update(row.id for row in chunk if row.id > watched_from)
+            writers.close()
+        except BaseException:
+            writers.close()
+            writers.discard()
+            raise
+
+    # Ids still unseen near the top: not committed yet, or rolled back
+    watched = set(range(max(low_id, watched_from) + 1, high_id + 1))
+    watched.update(gap for gap in gaps if gap > watched_from)
+
+    writers.commit()
+    write_watermark(output_dir, {
+        'format': fmt,
+        'last_id': max(high_id, low_id),
+        'gaps': sorted(watched - seen)[-MAX_GAPS:],
+        'rows': (state['rows'] if state else 0) + rows_written,
+        'runs': (state['runs'] if state else 0) + 1,
+        'exported_at': started.isoformat()
+    })
+
+    return {'rows': rows_written, 'files': len(writers.written), 'last_id': max(high_id, low_id)}
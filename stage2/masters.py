@@ -0,0 +1,198 @@
+"""
+Kiryana Inventory System - Product Masters
+
+An item sold in many stores has one ProductMaster row with its chain-wide
+catalog data (name, barcode, category, description, image and list price)
+and one Product row per store with that store's stock, reorder level and
+location, plus any values the store overrides (see INHERITED_COLUMNS in
+models.py). A chain-wide change is a single write to the master.
+
+Databases from before masters existed have a full copy of the catalog in
+every store's products. migrate_products() links them to masters in one
+streaming pass over the product table, in id-ordered batches: products
+are matched to a master by SKU, or by barcode when the SKU is unknown, and
+a product that matches none becomes the master of its item. Values equal
+to the master's are then cleared from the store row; values that differ
+stay as overrides. The effective catalog does not change, so the pass
+needs no revision bumps or outbox events and can run while the app is up.
+Products with neither SKU nor barcode stay store-only.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, or_, select, update
+
+from app import db
+from models import INHERITED_COLUMNS, Product, ProductMaster, product_catalog, catalog_column
+from outbox import PRODUCT_FIELDS, add_events
+from revisions import bump_revision
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+class MasterIndex:
+    """Masters by SKU and barcode, with their catalog values"""
+
+    def __init__(self):
+        self.by_sku = {}
+        self.by_barcode = {}
+        self.values = {}  # master ID -> {column: value}
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        table = ProductMaster.__table__
+        rows = db.session.execute(
+            select(table.c.id, table.c.sku, *[table.c[key] for key in INHERITED_COLUMNS])
+            .order_by(table.c.id)
+        )
+        for row in rows:
+            index.add(row.id, row.sku, {key: getattr(row, key) for key in INHERITED_COLUMNS})
+        return index
+
+    def add(self, master_id, sku, values):
+        if sku:
+            self.by_sku.setdefault(sku, master_id)
+        if values['barcode']:
+            self.by_barcode.setdefault(values['barcode'], master_id)
+        self.values[master_id] = values
+
+    def match(self, sku, barcode):
+        """ID of the master of a product, or None"""
+        if sku and sku in self.by_sku:
+            return self.by_sku[sku]
+        if barcode and barcode in self.by_barcode:
+            return self.by_barcode[barcode]
+        return None
+
+
+def overrides(values, master_values):
+    """A linked product's own column values: None where they equal the master's"""
+    return {key: None if values[key] == master_values[key] else values[key] for key in INHERITED_COLUMNS}
+
+
+def _master_values(row):
+    values = {key: row[key] for key in INHERITED_COLUMNS}
+    values['unit_price'] = values['unit_price'] or 0
+    return values
+
+
+def _create_masters(rows):
+    """Insert a master for each product in rows; returns their IDs in order"""
+    table = ProductMaster.__table__
+    now = datetime.utcnow()
+    return db.session.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True),
+        [{'sku': row['sku'], **_master_values(row), 'created_at': now, 'updated_at': now} for row in rows]
+    ).scalars().all()
+
+
+def migrate_products(batch_size=DEFAULT_BATCH_SIZE, dry_run=False, progress=None):
+    """Link store-only products to masters, creating masters as needed
+
+    Returns counts of products read, products linked, masters created and
+    products left store-only. With dry_run nothing is written. progress,
+    if given, is called with the number of products read after each batch.
+    """
+    table = Product.__table__
+    masters = MasterIndex.load()
+    counts = {'products': 0, 'linked': 0, 'masters': 0, 'store_only': 0}
+    link = (
+        update(table).where(table.c.id == bindparam('b_id'))
+        .values(master_id=bindparam('b_master_id'),
+                **{key: bindparam(f'b_{key}') for key in INHERITED_COLUMNS})
+    )
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.sku, *[table.c[key] for key in INHERITED_COLUMNS])
+            .where(table.c.master_id.is_(None), table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        counts['products'] += len(rows)
+
+        keyed = [row for row in rows if row['sku'] or row['barcode']]
+        counts['store_only'] += len(rows) - len(keyed)
+        counts['linked'] += len(keyed)
+
+        # The first product of each new item becomes its master
+        new_items = MasterIndex()
+        for row in keyed:
+            if masters.match(row['sku'], row['barcode']) is None and \
+                    new_items.match(row['sku'], row['barcode']) is None:
+                new_items.add(len(new_items.values), row['sku'], row)
+        new_rows = list(new_items.values.values())
+        if dry_run:
+            # Stand-in IDs, so later batches match these items too
+            ids = range(-counts['masters'] - 1, -counts['masters'] - 1 - len(new_rows), -1)
+        else:
+            ids = _create_masters(new_rows) if new_rows else []
+        for row, master_id in zip(new_rows, ids):
+            masters.add(master_id, row['sku'], _master_values(row))
+        counts['masters'] += len(new_rows)
+
+        if not dry_run:
+            params = []
+            for row in keyed:
+                master_id = masters.match(row['sku'], row['barcode'])
+                params.append({
+                    'b_id': row['id'],
+                    'b_master_id': master_id,
+                    **{f'b_{key}': value for key, value in overrides(row, masters.values[master_id]).items()}
+                })
+            db.session.execute(link, params)
+            db.session.commit()
+        if progress:
+            progress(counts['products'])
+
+    return counts
+
+
+def update_master(master_id, values):
+    """Change catalog values of a master for every store; returns the store products affected
+
+    Store products that inherit a changed column are stamped with their
+    store's next revision and get product.updated events, as if each had
+    been written, so the API change feed and downstream services pick the
+    change up. The caller commits.
+    """
+    master_table = ProductMaster.__table__
+    table = Product.__table__
+    db.session.execute(
+        update(master_table).where(master_table.c.id == master_id)
+        .values(**values, updated_at=datetime.utcnow())
+    )
+
+    inheriting = [table.c[key].is_(None) for key in values if key in INHERITED_COLUMNS]
+    if not inheriting:
+        return 0
+    affected = db.session.execute(
+        select(table.c.id, table.c.store_id).where(table.c.master_id == master_id, or_(*inheriting))
+    ).all()
+
+    by_store = defaultdict(list)
+    for product_id, store_id in affected:
+        by_store[store_id].append(product_id)
+    for store_id, product_ids in sorted(by_store.items()):
+        revision = bump_revision(store_id)
+        db.session.execute(update(table).where(table.c.id.in_(product_ids)).values(updated_version=revision))
+
+    if affected:
+        rows = db.session.execute(
+            select(*[catalog_column(field) for field in PRODUCT_FIELDS])
+            .select_from(product_catalog)
+            .where(table.c.id.in_([product_id for product_id, _ in affected]))
+        )
+        add_events([{
+            'store_id': row.store_id,
+            'event_type': 'product.updated',
+            'aggregate_id': row.id,
+            'data': dict(row._mapping)
+        } for row in rows])
+    return len(affected)
@@ -0,0 +1,166 @@
+"""
+Kiryana Inventory System - Memory Tracking
+
+Opt-in tracemalloc instrumentation for requests and CLI commands. With
+MEMORY_SAMPLE_RATE set (0.01 traces one request in a hundred), a sampled
+request runs with tracemalloc on; its peak allocation and the code that
+held the most memory are logged next to its duration, and returned in the
+X-Memory-Peak header so benchmarks can record them with their timings.
+`cli.py --trace-memory <command>` does the same for one CLI command.
+
+tracemalloc slows the traced code down several times over, so timings of
+traced requests are not representative. It is started and stopped around
+each traced request, and only one request per process is traced at a
+time; allocations by other threads running meanwhile count towards it.
+
+The allocation sites are read from snapshots taken while memory grows
+(whenever usage is a quarter above the last snapshot), so they describe
+the moment of the peak rather than what is left once the view returns.
+Each allocation is attributed to the innermost frame in this application,
+e.g. views/report.py:120 for rows loaded by SQLAlchemy on behalf of a view.
+"""
+
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import g, request
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_FRAMES = 12
+TOP_SITES = 10
+# A new snapshot is taken when usage grows by this factor
+SNAPSHOT_GROWTH = 1.25
+MIN_SNAPSHOT_SIZE = 1024 * 1024
+POLL_INTERVAL = 0.01
+
+_trace_lock = threading.Lock()
+
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MiB" if size >= 1024 * 1024 else f"{size / 1024:.0f} KiB"
+
+
+def allocation_site(traceback):
+    """Innermost frame of the traceback in application code"""
+    for frame in reversed(traceback):
+        if frame.filename.startswith(APP_DIR) and frame.filename != __file__:
+            return f"{os.path.relpath(frame.filename, APP_DIR)}:{frame.lineno}"
+    frame = traceback[-1]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class MemoryTrace:
+    """Peak allocation and top allocation sites of the code run inside it
+
+        with MemoryTrace() as trace:
+            ...
+        if trace.active:
+            print(trace.summary())
+
+    trace.active is False if another trace was already running.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.peak = 0
+        self.duration = 0
+        self.top_sites = []
+        self._snapshot = None
+        self._snapshot_size = 0
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def __enter__(self):
+        if not _trace_lock.acquire(blocking=False):
+            return self
+        self.active = True
+        self._was_tracing = tracemalloc.is_tracing()
+        if self._was_tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start(TRACE_FRAMES)
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self._watcher = threading.Thread(target=self._watch, name='memory-trace', daemon=True)
+        self._watcher.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    def finish(self):
+        """Stop tracing; safe to call more than once"""
+        if not self.active or self._watcher is None:
+            return
+        self.duration = time.perf_counter() - self._started
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
+        self._take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1] - self._baseline
+        if not self._was_tracing:
+            tracemalloc.stop()
+        _trace_lock.release()
+        self.top_sites = self._sites()
+
+    def _take_snapshot(self, current=None):
+        current = current if current is not None else tracemalloc.get_traced_memory()[0]
+        if current <= self._snapshot_size:
+            return
+        self._snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        self._snapshot_size = current
+
+    def _watch(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            current = tracemalloc.get_traced_memory()[0]
+            if current >= MIN_SNAPSHOT_SIZE and current > self._snapshot_size * SNAPSHOT_GROWTH:
+                self._take_snapshot(current)
+
+    def _sites(self):
+        if self._snapshot is None:
+            return []
+        sizes = Counter()
+        for trace in self._snapshot.traces:
+            sizes[allocation_site(trace.traceback)] += trace.size
+        return sizes.most_common(TOP_SITES)
+
+    def summary(self):
+        top = ', '.join(f"{site} {format_size(size)}" for site, size in self.top_sites[:5])
+        return f"peak {format_size(self.peak)} in {self.duration * 1000:.0f} ms; top: {top or 'none'}"
+
+
+def init_memory_tracking(app):
+    """Trace a sample of requests when MEMORY_SAMPLE_RATE is set"""
+    rate = app.config.get('MEMORY_SAMPLE_RATE', 0)
+    if not rate:
+        return
+
+    @app.before_request
+    def start_memory_trace():
+        if random.random() < rate:
+            trace = MemoryTrace().__enter__()
+            if trace.active:
+                g.memory_trace = trace
+
+    @app.after_request
+    def finish_memory_trace(response):
+        # Before teardown, while the session still holds the loaded objects
+        trace = g.pop('memory_trace', None)
+        if trace is not None:
+            trace.finish()
+            app.logger.info(f"Memory {request.method} {request.endpoint}: {trace.summary()}")
+            response.headers['X-Memory-Peak'] = str(trace.peak)
+        return response
+
+    @app.teardown_request
+    def abandon_memory_trace(exc):
+        trace = g.pop('memory_trace', None)
+        if trace is not None:
+            trace.finish()
@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app import db
@@ -104,6 +105,15 @@ class StorePermission(db.Model):
     )
 
 
+class RevokedToken(db.Model):
+    """Revoked API bearer token, or all of a user's tokens when jti is empty"""
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), index=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # entry can be purged after this
+
+
 # Store Models
 class Store(db.Model):
     """Store location model"""
@@ -124,36 +134,179 @@ class Store(db.Model):
     permissions = db.relationship('StorePermission', backref='store', cascade='all, delete-orphan')
 
 
+class DocumentSequence(db.Model):
+    """Next unreserved number of a store's sales orders, purchase orders or transfers"""
+    __tablename__ = 'document_sequence'
+    
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), primary_key=True)
+    doc_type = db.Column(db.String(30), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
+
+
+class StoreRevision(db.Model):
+    """Monotonic revision of a store's catalog and stock, bumped on every write"""
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), primary_key=True)
+    revision = db.Column(db.BigInteger, nullable=False, default=0)
+
+
 # Product Models
-class Product(db.Model):
-    """Product model"""
+class ProductMaster(db.Model):
+    """Chain-wide catalog entry of an item, shared by its products in every store"""
+    __tablename__ = 'product_master'
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    sku = db.Column(db.String(50))
-    barcode = db.Column(db.String(50))
+    sku = db.Column(db.String(50), index=True)
+    barcode = db.Column(db.String(50), index=True)
     description = db.Column(db.Text)
     category = db.Column(db.String(50))
     unit_price = db.Column(db.Float, nullable=False, default=0)
     cost_price = db.Column(db.Float)
+    image_url = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Product(db.Model):
+    """Product model"""
+    id = db.Column(db.Integer, primary_key=True)
+    # Columns in INHERITED_COLUMNS are read and written through the
+    # attributes of the same name defined below the class
+    _name = db.Column('name', db.String(100))
+    sku = db.Column(db.String(50))
+    _barcode = db.Column('barcode', db.String(50))
+    _description = db.Column('description', db.Text)
+    _category = db.Column('category', db.String(50))
+    _unit_price = db.Column('unit_price', db.Float, default=0)
+    _cost_price = db.Column('cost_price', db.Float)
     current_quantity = db.Column(db.Integer, default=0)
     reorder_level = db.Column(db.Integer, default=10)
     location_in_store = db.Column(db.String(100))
-    image_url = db.Column(db.String(255))
+    _image_url = db.Column('image_url', db.String(255))
     store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    master_id = db.Column(db.Integer, db.ForeignKey('product_master.id'))  # NULL for store-only products
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # store revision of the last write
+    shard_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # >0: stock changes go to shard rows
     
     # Relationships
     inventory_movements = db.relationship('InventoryMovement', backref='product', cascade='all, delete-orphan')
     supplier_products = db.relationship('SupplierProduct', backref='product', cascade='all, delete-orphan')
+    stock_shards = db.relationship('ProductStockShard', cascade='all, delete-orphan')
+    master = db.relationship('ProductMaster', lazy='joined')
+    
+    def get_available_quantity(self):
+        """Stock on hand, including shard counter changes not yet folded in"""
+        return self.available_quantity if self.shard_count else self.current_quantity
     
     def is_low_stock(self):
         """Check if product is at or below reorder level"""
-        return self.current_quantity <= self.reorder_level
+        return self.get_available_quantity() <= self.reorder_level
     
     def get_stock_value(self):
         """Calculate current stock value"""
-        return self.current_quantity * self.unit_price
+        return self.get_available_quantity() * self.unit_price
+    
+    # Change feed lookups by store and revision; store products of a master
+    __table_args__ = (
+        db.Index('ix_product_store_version', 'store_id', 'updated_version'),
+        db.Index('ix_product_master', 'master_id'),
+    )
+
+
+class ProductTombstone(db.Model):
+    """Marker left by a deleted product for the change feed"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)  # store revision of the deletion
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_product_tombstone_store_version', 'store_id', 'version'),
+    )
+
+
+class ProductStockShard(db.Model):
+    """One of a hot product's stock counters; its quantity is a change not yet folded into the product"""
+    __tablename__ = 'product_stock_shard'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.BigInteger, nullable=False, default=0)  # Incremented on every write, for ETags
+
+
+# Stock on hand of a product: the folded quantity plus its shard counters.
+# Deferred, so it is only selected where asked for; unsharded products skip
+# the subquery.
+Product.available_quantity = db.column_property(
+    db.case(
+        (Product.shard_count > 0, Product.current_quantity + db.func.coalesce(
+            db.select(db.func.sum(ProductStockShard.quantity))
+            .where(ProductStockShard.product_id == Product.id)
+            .correlate_except(ProductStockShard)
+            .scalar_subquery(), 0)),
+        else_=Product.current_quantity
+    ),
+    deferred=True
+)
+
+
+# Catalog columns a store product shares with its master. On a linked
+# product (master_id set) the product's own column holds a store override
+# and NULL means the master's value applies; store-only products keep all
+# their values. The attributes read the effective value, and writing the
+# master's value clears the override.
+INHERITED_COLUMNS = ('name', 'barcode', 'description', 'category', 'unit_price', 'cost_price', 'image_url')
+
+
+def _inherited_attribute(key):
+    column = getattr(Product, '_' + key)
+    master_column = getattr(ProductMaster, key)
+    
+    def get(self):
+        value = getattr(self, '_' + key)
+        if value is None and self.master is not None:
+            return getattr(self.master, key)
+        return value
+    
+    def set(self, value):
+        if self.master is not None and value == getattr(self.master, key):
+            value = None
+        setattr(self, '_' + key, value)
+    
+    # Usable in any query; unlinked products skip the master lookup. Reads
+    # of several columns over many rows should select from product_catalog.
+    def expression(cls):
+        return db.case(
+            (cls.master_id.is_(None), column),
+            else_=db.func.coalesce(column, db.select(master_column)
+                                   .where(ProductMaster.id == cls.master_id)
+                                   .scalar_subquery())
+        ).label(key)
+    
+    return hybrid_property(get, set, expr=expression)
+
+
+for _key in INHERITED_COLUMNS:
+    setattr(Product, _key, _inherited_attribute(_key))
+
+# Store products joined to their masters, and the effective value of an
+# inherited column in a select from it
+product_catalog = Product.__table__.outerjoin(
+    ProductMaster.__table__, ProductMaster.__table__.c.id == Product.__table__.c.master_id
+)
+
+
+def catalog_column(key):
+    """Effective value of a product column, for selects from product_catalog"""
+    column = Product.__table__.c[key]
+    if key not in INHERITED_COLUMNS:
+        return column
+    return db.func.coalesce(column, ProductMaster.__table__.c[key]).label(key)
 
 
 # Inventory Models
@@ -170,6 +323,7 @@ class InventoryMovement(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     movement_date = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(100))  # client-supplied, makes retried submissions safe
     
     # Creator relationship
     creator = db.relationship('User', backref='inventory_movements')
@@ -177,6 +331,126 @@ class InventoryMovement(db.Model):
     def get_total_value(self):
         """Calculate total value of movement"""
         return self.quantity * self.unit_price
+    
+    # A key is recorded once per store; rows without a key are not constrained.
+    # Ids are never reused on SQLite: archived rows and export watermarks keep them
+    __table_args__ = (
+        db.Index('ux_movement_idempotency_key', 'store_id', 'idempotency_key', unique=True),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class InventoryMovementArchive(db.Model):
+    """Inventory movements moved out of the hot ledger by archive.py"""
+    __tablename__ = 'inventory_movement_archive'
+    
+    # Same columns and ids as InventoryMovement; no foreign keys so that
+    # archived history never blocks deleting products or users
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    store_id = db.Column(db.Integer, nullable=False)
+    movement_type = db.Column(db.String(20), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+    reference = db.Column(db.String(50))
+    notes = db.Column(db.Text)
+    created_by = db.Column(db.Integer)
+    movement_date = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    idempotency_key = db.Column(db.String(100))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Read-only relationships so archived rows render like live ones
+    product = db.relationship('Product', primaryjoin='foreign(InventoryMovementArchive.product_id) == Product.id', viewonly=True)
+    creator = db.relationship('User', primaryjoin='foreign(InventoryMovementArchive.created_by) == User.id', viewonly=True)
+    
+    __table_args__ = (
+        db.Index('ix_movement_archive_store_date', 'store_id', 'movement_date'),
+    )
+    
+    def get_total_value(self):
+        """Calculate total value of movement"""
+        return self.quantity * self.unit_price
+
+
+class InventoryOpeningBalance(db.Model):
+    """Rolled-up totals of a product's archived movements"""
+    __tablename__ = 'inventory_opening_balance'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)  # Movements before this date are archived
+    quantity = db.Column(db.Integer, default=0)  # Net stock change of all archived movements
+    stock_in_quantity = db.Column(db.Integer, default=0)
+    sale_quantity = db.Column(db.Integer, default=0)
+    removal_quantity = db.Column(db.Integer, default=0)
+    sale_value = db.Column(db.Float, default=0)
+    movement_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'product_id', name='unique_store_product_opening_balance'),
+    )
+
+
+class EdgeSyncState(db.Model):
+    """Sync progress of an edge node's local store against the central server"""
+    __tablename__ = 'edge_sync_state'
+    
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), primary_key=True)
+    node_id = db.Column(db.String(64), nullable=False)
+    pushed_movement_id = db.Column(db.Integer, default=0)  # Local movements up to this ID are upstream
+    catalog_version = db.Column(db.BigInteger, default=0)  # Upstream revision of the last catalog pull
+    last_push_at = db.Column(db.DateTime)
+    last_pull_at = db.Column(db.DateTime)
+    rejected_count = db.Column(db.Integer, default=0)
+
+
+class OutboxEvent(db.Model):
+    """Inventory event written in the same transaction as the change it describes"""
+    __tablename__ = 'outbox_event'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Relays read events in ID order
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    event_type = db.Column(db.String(40), nullable=False)  # 'movement.recorded', 'product.updated', ...
+    aggregate_id = db.Column(db.Integer, nullable=False)  # ID of the product or movement
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class OutboxCheckpoint(db.Model):
+    """Last outbox event a relay has delivered to its sink"""
+    __tablename__ = 'outbox_checkpoint'
+    
+    relay = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    # JSON list of [first id, last id, skipped at] gaps still watched for late commits
+    skipped_ids = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RequestProfile(db.Model):
+    """Profile of one request an administrator asked to profile (see profiler.py)"""
+    __tablename__ = 'request_profile'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    endpoint = db.Column(db.String(100))
+    status_code = db.Column(db.Integer)
+    mode = db.Column(db.String(10), nullable=False)  # 'sample' or 'cprofile'
+    duration_ms = db.Column(db.Float, nullable=False)
+    query_count = db.Column(db.Integer, nullable=False, default=0)
+    query_ms = db.Column(db.Float, nullable=False, default=0)
+    stacks = db.Column(db.Text)  # Folded stacks ("a;b;c 12" per line) in sample mode
+    stats = db.Column(db.Text)  # pstats listing in cprofile mode
+    timeline = db.Column(db.Text)  # JSON list of SQL statements with start and duration
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # Relationships
+    user = db.relationship('User')
 
 
 # Supplier Models
@@ -239,6 +513,11 @@ class PurchaseOrder(db.Model):
     def get_total_value(self):
         """Calculate total value of purchase order"""
         return sum(item.quantity_ordered * item.unit_price for item in self.items)
+    
+    # Numbers are unique per store (see numbering.py)
+    __table_args__ = (
+        db.Index('ux_purchase_order_number', 'store_id', 'order_number', unique=True),
+    )
 
 
 class PurchaseOrderItem(db.Model):
@@ -295,6 +574,11 @@ class SalesOrder(db.Model):
     def get_total(self):
         """Calculate total value (after discounts)"""
         return self.get_subtotal() - self.get_total_discount()
+    
+    # Numbers are unique per store (see numbering.py)
+    __table_args__ = (
+        db.Index('ux_sales_order_number', 'store_id', 'order_number', unique=True),
+    )
 
 
 class SalesOrderItem(db.Model):
@@ -341,6 +625,11 @@ class InventoryTransfer(db.Model):
     destination_store = db.relationship('Store', foreign_keys=[destination_store_id])
     creator = db.relationship('User', backref='inventory_transfers')
     items = db.relationship('InventoryTransferItem', backref='inventory_transfer', cascade='all, delete-orphan')
+    
+    # Numbers are unique per source store (see numbering.py)
+    __table_args__ = (
+        db.Index('ux_inventory_transfer_number', 'source_store_id', 'transfer_number', unique=True),
+    )
 
 
 class InventoryTransferItem(db.Model):
@@ -0,0 +1,160 @@
+"""
+Kiryana Inventory System - Movement Ingestion
+
+Applies inventory movements to the central database, either one at a time
+from the counter forms and the CLI or in batches recorded elsewhere (such
+as an offline edge node). A movement may carry an idempotency key that is
+stored with it under a unique (store_id, idempotency_key) index, so a
+submission that is re-sent after a timeout or a crash is recognised and its
+quantity is not applied twice.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from archive import STOCK_SIGN
+from models import Product, InventoryMovement
+
+
+# Idempotency keys are stored in a String(100) column
+MAX_KEY_LENGTH = 100
+
+
+def find_movement(store_id, key):
+    """Movement already recorded in a store under an idempotency key, or None"""
+    if not key:
+        return None
+    return InventoryMovement.query.filter_by(store_id=store_id, idempotency_key=key).first()
+
+
+def record_movement(movement, product):
+    """Add a movement, apply its stock change and commit
+
+    Returns (movement, created). When another request recorded the same
+    idempotency key first, the transaction is rolled back and the original
+    movement is returned with created=False.
+    """
+    try:
+        if product.shard_count:
+            # Hot products keep their stock on shard rows (see shards.py).
+            # The movement is inserted at once, so a duplicate key fails here
+            from shards import insert_sharded_movement
+            insert_sharded_movement(movement, product)
+        else:
+            # Relative to the stored value, so concurrent writers are not lost
+            product.current_quantity = Product.current_quantity + STOCK_SIGN[movement.movement_type] * movement.quantity
+            db.session.add(movement)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        original = find_movement(movement.store_id, movement.idempotency_key)
+        if original is None:
+            raise
+        return original, False
+    return movement, True
+
+
+def _validate(movement, products):
+    """Return an error message for an invalid movement, or None"""
+    if movement.get('movement_type') not in STOCK_SIGN:
+        return f"Unknown movement type: {movement.get('movement_type')}"
+    if movement.get('product_id') not in products:
+        return f"Product {movement.get('product_id')} not found in this store"
+    quantity = movement.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+        return "Quantity must be a positive integer"
+    try:
+        float(movement.get('unit_price'))
+        if movement.get('movement_date'):
+            datetime.fromisoformat(movement['movement_date'])
+    except (TypeError, ValueError):
+        return "Invalid unit price or movement date"
+    return None
+
+
+def _apply(store_id, movements, user_id):
+    keys = [m.get('key') for m in movements if m.get('key')]
+    existing = set(db.session.execute(
+        select(InventoryMovement.idempotency_key).where(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.idempotency_key.in_(keys)
+        )
+    ).scalars()) if keys else set()
+
+    product_ids = {m.get('product_id') for m in movements}
+    products = {
+        p.id: p for p in Product.query.filter(
+            Product.store_id == store_id,
+            Product.id.in_([pid for pid in product_ids if isinstance(pid, int)])
+        ).all()
+    }
+
+    accepted = 0
+    duplicates = 0
+    rejected = []
+    deltas = defaultdict(int)  # product ID -> stock change of unsharded products
+
+    for movement in movements:
+        key = movement.get('key')
+        if not key:
+            rejected.append({'key': None, 'error': "Missing idempotency key"})
+            continue
+        if key in existing:
+            duplicates += 1
+            continue
+
+        error = _validate(movement, products)
+        if error:
+            rejected.append({'key': key, 'error': error})
+            continue
+
+        product = products[movement['product_id']]
+        record = InventoryMovement(
+            product_id=product.id,
+            store_id=store_id,
+            movement_type=movement['movement_type'],
+            quantity=movement['quantity'],
+            unit_price=float(movement['unit_price']),
+            reference=movement.get('reference'),
+            notes=movement.get('notes'),
+            created_by=user_id,
+            movement_date=datetime.fromisoformat(movement['movement_date']) if movement.get('movement_date') else datetime.utcnow(),
+            idempotency_key=key
+        )
+        if product.shard_count:
+            # Hot products keep their stock on shard rows (see shards.py)
+            from shards import insert_sharded_movement
+            insert_sharded_movement(record, product)
+        else:
+            deltas[product.id] += STOCK_SIGN[record.movement_type] * record.quantity
+            db.session.add(record)
+        existing.add(key)
+        accepted += 1
+
+    # Relative to the stored value, so concurrent writers are not lost
+    for product_id, delta in deltas.items():
+        products[product_id].current_quantity = Product.current_quantity + delta
+
+    db.session.commit()
+    return {'accepted': accepted, 'duplicates': duplicates, 'rejected': rejected}
+
+
+def apply_movement_batch(store_id, movements, user_id=None):
+    """Apply a batch of movements in one transaction, skipping known keys
+
+    Each movement is a dict with key, product_id, movement_type, quantity,
+    unit_price and optionally reference, notes and movement_date (ISO 8601).
+    Returns counts of accepted and duplicate movements and the rejected ones
+    with their errors.
+    """
+    try:
+        return _apply(store_id, movements, user_id)
+    except IntegrityError:
+        # A concurrent request inserted some of the same keys first; retry
+        # once, now seeing them as duplicates
+        db.session.rollback()
+        return _apply(store_id, movements, user_id)
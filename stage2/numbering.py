@@ -0,0 +1,167 @@
+"""
+Kiryana Inventory System - Document Numbers
+
+Sales orders, purchase orders and inventory transfers get their number from
+a per-store, per-document-type sequence (SO-3-000042 is store 3's 42nd sales
+order). Computing max()+1 at insert time would make every checkout in a
+store wait on the previous one, so each worker process instead reserves a
+block of numbers at once (DOCUMENT_NUMBER_BLOCK, default 50) by advancing
+the document_sequence row, and hands them out from memory. Only the first
+number of each block costs a database round trip.
+
+On SQLite the block is reserved in the transaction of the session that
+needs it, and other sessions only draw from it once that has committed.
+
+Numbers are unique because blocks never overlap; they are not gapless,
+since a worker that exits leaves the rest of its block unused. A document
+created without a number is numbered when it is flushed; one that already
+has a number keeps it.
+"""
+
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import event, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import DocumentSequence, SalesOrder, PurchaseOrder, InventoryTransfer
+
+DEFAULT_BLOCK_SIZE = 50
+
+# Model -> (document type, number attribute, store attribute, prefix)
+DOCUMENT_TYPES = {
+    SalesOrder: ('sales_order', 'order_number', 'store_id', 'SO'),
+    PurchaseOrder: ('purchase_order', 'order_number', 'store_id', 'PO'),
+    InventoryTransfer: ('inventory_transfer', 'transfer_number', 'source_store_id', 'TR'),
+}
+PREFIXES = {doc_type: prefix for doc_type, _, _, prefix in DOCUMENT_TYPES.values()}
+
+
+def reserve_block(conn, store_id, doc_type, size):
+    """Advance a sequence by size and return the first number of the block"""
+    table = DocumentSequence.__table__
+    row = conn.execute(
+        update(table).where(table.c.store_id == store_id, table.c.doc_type == doc_type)
+        .values(next_value=table.c.next_value + size)
+        .returning(table.c.next_value)
+    ).first()
+    if row is not None:
+        return row.next_value - size
+
+    # First document of this type in the store. A concurrent worker may
+    # have created the sequence meanwhile, in which case the update works.
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(table).values(store_id=store_id, doc_type=doc_type, next_value=1 + size))
+        return 1
+    except IntegrityError:
+        return reserve_block(conn, store_id, doc_type, size)
+
+
+class NumberAllocator:
+    """Hands out document numbers from blocks reserved by this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}  # (store_id, doc_type) -> [next, end)
+        self.pid = os.getpid()
+
+    def _block_size(self):
+        return current_app.config.get('DOCUMENT_NUMBER_BLOCK', DEFAULT_BLOCK_SIZE)
+
+    def _check_fork(self):
+        # A forked worker must not reuse the blocks of its parent
+        if self.pid != os.getpid():
+            self.blocks = {}
+            self.pid = os.getpid()
+
+    def _open_block(self, session, key):
+        """Block to draw from: the session's uncommitted one first, then the process's"""
+        for block in (session.info.get('pending_blocks', {}).get(key), self.blocks.get(key)):
+            if block is not None and block[0] < block[1]:
+                return block
+        return None
+
+    def _reserve(self, session, key, size):
+        store_id, doc_type = key
+        if session.get_bind().dialect.name == 'sqlite':
+            # SQLite has a single writer, so a second connection would wait
+            # for this session's own lock. The block is reserved in the
+            # session's transaction instead, and only this session draws
+            # from it until that commits (see publish()); if it rolls back,
+            # the sequence and the numbers taken from it go back together.
+            start = reserve_block(session.connection(), store_id, doc_type, size)
+            session.info.setdefault('pending_blocks', {})[key] = [start, start + size]
+            return
+        # Committed at once, so the sequence row is only locked briefly
+        with db.engine.begin() as conn:
+            start = reserve_block(conn, store_id, doc_type, size)
+        with self.lock:
+            self._check_fork()
+            self.blocks[key] = [start, start + size]
+
+    def allocate(self, store_id, doc_type, count=1, session=None):
+        """Return count numbers of a store's document type"""
+        session = session or db.session
+        key = (store_id, doc_type)
+        numbers = []
+
+        while len(numbers) < count:
+            with self.lock:
+                self._check_fork()
+                block = self._open_block(session, key)
+                if block is not None:
+                    taken = min(count - len(numbers), block[1] - block[0])
+                    numbers.extend(range(block[0], block[0] + taken))
+                    block[0] += taken
+                    continue
+            # Outside the lock: on SQLite this may wait for the write lock
+            self._reserve(session, key, max(self._block_size(), count - len(numbers)))
+
+        return numbers
+
+    def publish(self, blocks):
+        """Share the unused part of blocks whose reservation has committed"""
+        with self.lock:
+            self._check_fork()
+            for key, block in blocks.items():
+                current = self.blocks.get(key)
+                if block[0] < block[1] and (current is None or current[0] >= current[1]):
+                    self.blocks[key] = block
+
+
+allocator = NumberAllocator()
+
+
+def format_number(doc_type, store_id, number):
+    """Display form of a document number, e.g. SO-3-000042"""
+    return f"{PREFIXES[doc_type]}-{store_id}-{number:06d}"
+
+
+def next_numbers(store_id, doc_type, count=1, session=None):
+    """Formatted numbers for count new documents of a store"""
+    return [format_number(doc_type, store_id, n) for n in allocator.allocate(store_id, doc_type, count, session)]
+
+
+@event.listens_for(db.session, 'before_flush')
+def _number_documents(session, flush_context, instances):
+    for obj in session.new:
+        spec = DOCUMENT_TYPES.get(type(obj))
+        if spec is None:
+            continue
+        doc_type, number_attr, store_attr, _ = spec
+        store_id = getattr(obj, store_attr)
+        if not getattr(obj, number_attr) and store_id is not None:
+            setattr(obj, number_attr, next_numbers(store_id, doc_type, session=session)[0])
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_blocks(session):
+    allocator.publish(session.info.pop('pending_blocks', {}))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_blocks(session):
+    session.info.pop('pending_blocks', None)
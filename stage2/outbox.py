@@ -0,0 +1,332 @@
+"""
+Kiryana Inventory System - Transactional Outbox
+
+Downstream services (the stage3 inventory, reporting and dashboard
+services) keep their own stores and need to hear about stock changes
+without polling and diffing whole tables. Every ORM write of a product or
+inventory movement therefore appends an event to the outbox_event table in
+the same transaction, so an event exists if and only if its change was
+committed.
+
+A relay (`cli.py outbox-relay`) reads events after its checkpoint in ID
+order, publishes them in batches to a sink and then advances the
+checkpoint. Delivery is at-least-once: a relay that stops between
+publishing and checkpointing sends the last batch again, so consumers
+should skip event IDs they have already seen.
+
+Event IDs are assigned when a transaction writes its events, not when it
+commits, so a long transaction (an import chunk, an archive batch) can
+commit events below the checkpoint. Gaps the relay has moved past are
+saved with the checkpoint and looked up again on every run, so such events
+are still delivered, after events with higher IDs. Consumers therefore
+must not treat the highest ID they have seen as a watermark.
+
+Sinks are chosen by URL:
+
+* file:///path/events.jsonl (or a plain path) appends JSON lines to a file
+* tcp://host:port sends JSON lines over a TCP connection
+* - writes JSON lines to stdout
+
+Further sinks can be added to SINK_SCHEMES. Bulk UPDATE/INSERT statements
+bypass the ORM and must call add_events() themselves.
+"""
+
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, or_, select
+
+from app import db
+from models import Product, InventoryMovement, OutboxEvent, OutboxCheckpoint
+from serializers import dumps
+
+DEFAULT_RELAY = 'default'
+DEFAULT_BATCH_SIZE = 500
+# A relay can see event N+1 before N commits. It waits this many seconds
+# for a gap before moving past it, and then keeps looking for the missing
+# events for GAP_RETENTION seconds (a rolled back write never shows up).
+GAP_TIMEOUT = float(os.environ.get("OUTBOX_GAP_TIMEOUT", "10"))
+GAP_RETENTION = int(os.environ.get("OUTBOX_GAP_RETENTION", "86400"))
+
+# Fields carried by product and movement events
+PRODUCT_FIELDS = ('id', 'store_id', 'name', 'sku', 'barcode', 'category', 'unit_price',
+                  'current_quantity', 'reorder_level', 'updated_version')
+MOVEMENT_FIELDS = ('id', 'store_id', 'product_id', 'movement_type', 'quantity', 'unit_price',
+                   'reference', 'movement_date', 'created_by')
+
+
+def object_event(obj, event_type, fields):
+    """Event for a product or movement, as taken by add_events()"""
+    return {
+        'store_id': obj.store_id,
+        'event_type': event_type,
+        'aggregate_id': obj.id,
+        'data': {field: getattr(obj, field) for field in fields}
+    }
+
+
+def _insert(connection, events):
+    now = datetime.utcnow()
+    connection.execute(insert(OutboxEvent.__table__), [{
+        'store_id': e['store_id'],
+        'event_type': e['event_type'],
+        'aggregate_id': e['aggregate_id'],
+        'payload': dumps(e['data']).decode('utf-8'),
+        'created_at': now
+    } for e in events])
+
+
+def add_events(events, session=None):
+    """Insert outbox events in the current transaction
+
+    Each event is a dict with store_id, event_type, aggregate_id and data.
+    """
+    if events:
+        _insert((session or db.session).connection(), events)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_events(session, flush_context):
+    # IDs of new rows are known after the flush; the pending lists still
+    # describe what was flushed
+    events = []
+    for obj in session.new:
+        if isinstance(obj, InventoryMovement):
+            events.append(object_event(obj, 'movement.recorded', MOVEMENT_FIELDS))
+        elif isinstance(obj, Product):
+            events.append(object_event(obj, 'product.created', PRODUCT_FIELDS))
+    for obj in session.dirty:
+        if isinstance(obj, Product) and session.is_modified(obj, include_collections=False):
+            events.append(object_event(obj, 'product.updated', PRODUCT_FIELDS))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            events.append(object_event(obj, 'product.deleted', ('id', 'store_id')))
+
+    if events:
+        _insert(session.connection(), events)
+
+
+class SinkError(Exception):
+    """A sink could not accept a batch of events"""
+
+
+class StreamSink:
+    """Writes events as JSON lines to an open text stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def publish(self, lines):
+        self.stream.write(''.join(line + '\n' for line in lines))
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink(StreamSink):
+    """Appends events as JSON lines to a file, synced before the checkpoint moves"""
+
+    def __init__(self, path):
+        super().__init__(open(path, 'a', encoding='utf-8'))
+
+    def publish(self, lines):
+        try:
+            super().publish(lines)
+            os.fsync(self.stream.fileno())
+        except OSError as e:
+            raise SinkError(f"Could not write events: {e}") from e
+
+    def close(self):
+        self.stream.close()
+
+
+class SocketSink:
+    """Sends events as JSON lines over a TCP connection, reconnecting as needed"""
+
+    def __init__(self, host, port, timeout=10):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+
+    def publish(self, lines):
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.sock.sendall(data)
+        except OSError as e:
+            self.close()
+            raise SinkError(f"Could not send events to {self.address[0]}:{self.address[1]}: {e}") from e
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def _file_sink(url):
+    return FileSink(url.path)
+
+
+def _tcp_sink(url):
+    return SocketSink(url.hostname, url.port)
+
+
+# URL scheme -> factory taking the parsed URL
+SINK_SCHEMES = {
+    'file': _file_sink,
+    'tcp': _tcp_sink,
+}
+
+
+def open_sink(url):
+    """Create the sink for a sink URL"""
+    if url == '-':
+        return StreamSink(sys.stdout)
+    parsed = urlparse(url)
+    if not parsed.scheme:
+        return FileSink(url)
+    if parsed.scheme not in SINK_SCHEMES:
+        raise ValueError(f"Unsupported sink: {url}")
+    return SINK_SCHEMES[parsed.scheme](parsed)
+
+
+class Relay:
+    """Publishes outbox events after its checkpoint to a sink"""
+
+    def __init__(self, sink, name=DEFAULT_RELAY, batch_size=DEFAULT_BATCH_SIZE):
+        self.sink = sink
+        self.name = name
+        self.batch_size = batch_size
+        # First time each missing event ID was seen
+        self.gaps = {}
+
+    def checkpoint(self):
+        checkpoint = db.session.get(OutboxCheckpoint, self.name)
+        if checkpoint is None:
+            # A new relay starts from the oldest event not yet pruned
+            oldest = db.session.execute(select(func.min(OutboxEvent.id))).scalar()
+            checkpoint = OutboxCheckpoint(relay=self.name, last_event_id=oldest - 1 if oldest else 0)
+            db.session.add(checkpoint)
+            db.session.commit()
+        return checkpoint
+
+    def _ready(self, events, after_id, skipped):
+        """Leading events with no recent gap in their IDs
+
+        Gaps that have timed out are added to skipped.
+        """
+        now = time.monotonic()
+        expected = after_id + 1
+        for i, e in enumerate(events):
+            if e.id != expected:
+                first_seen = self.gaps.setdefault(expected, now)
+                if now - first_seen < GAP_TIMEOUT:
+                    return events[:i]
+                current_app.logger.warning(f"Outbox relay {self.name}: events {expected}-{e.id - 1} missing "
+                                           f"for {GAP_TIMEOUT:g}s, watching for late commits")
+                skipped.append([expected, e.id - 1, time.time()])
+            expected = e.id + 1
+        return events
+
+    def _skipped(self, checkpoint):
+        """Gaps saved with the checkpoint, as [first id, last id, skipped at]"""
+        cutoff = time.time() - GAP_RETENTION
+        skipped = []
+        for first, last, skipped_at in json.loads(checkpoint.skipped_ids or '[]'):
+            if skipped_at >= cutoff:
+                skipped.append([first, last, skipped_at])
+            else:
+                current_app.logger.info(f"Outbox relay {self.name}: stopped watching for events {first}-{last}")
+        return skipped
+
+    def _publish(self, events):
+        self.sink.publish([json.dumps({
+            'id': e.id,
+            'type': e.event_type,
+            'store_id': e.store_id,
+            'aggregate_id': e.aggregate_id,
+            'created_at': e.created_at.isoformat() if e.created_at else None,
+            'data': json.loads(e.payload)
+        }, separators=(',', ':')) for e in events])
+
+    def _publish_late(self, skipped):
+        """Publish events that have since committed inside skipped gaps
+
+        Returns the gaps left over and the number of events published.
+        """
+        if not skipped:
+            return skipped, 0
+        late = db.session.execute(
+            select(OutboxEvent).where(or_(*[OutboxEvent.id.between(first, last) for first, last, _ in skipped]))
+            .order_by(OutboxEvent.id)
+        ).scalars().all()
+        for start in range(0, len(late), self.batch_size):
+            self._publish(late[start:start + self.batch_size])
+
+        # Split each gap around the IDs just published
+        remaining = []
+        for first, last, skipped_at in skipped:
+            for e in late:
+                if first <= e.id <= last:
+                    if e.id > first:
+                        remaining.append([first, e.id - 1, skipped_at])
+                    first = e.id + 1
+            if first <= last:
+                remaining.append([first, last, skipped_at])
+        return remaining, len(late)
+
+    def _save(self, checkpoint, skipped, last_event_id=None):
+        if last_event_id is not None:
+            checkpoint.last_event_id = last_event_id
+        checkpoint.skipped_ids = json.dumps(skipped) if skipped else None
+        db.session.commit()
+
+    def run_once(self):
+        """Publish every ready event; returns the number published"""
+        checkpoint = self.checkpoint()
+        skipped, published = self._publish_late(self._skipped(checkpoint))
+        self._save(checkpoint, skipped)
+
+        while True:
+            events = db.session.execute(
+                select(OutboxEvent).where(OutboxEvent.id > checkpoint.last_event_id)
+                .order_by(OutboxEvent.id).limit(self.batch_size)
+            ).scalars().all()
+            events = self._ready(events, checkpoint.last_event_id, skipped)
+            if not events:
+                break
+
+            self._publish(events)
+            self._save(checkpoint, skipped, events[-1].id)
+            published += len(events)
+            self.gaps = {k: v for k, v in self.gaps.items() if k > checkpoint.last_event_id}
+
+            if len(events) < self.batch_size:
+                break
+
+        return published
+
+
+def prune_events():
+    """Delete events every relay has published; returns the number deleted"""
+    low_water = db.session.execute(select(func.min(OutboxCheckpoint.last_event_id))).scalar()
+    if not low_water:
+        return 0
+    # Gaps a relay still watches may yet fill with late commits
+    for skipped_ids in db.session.execute(
+        select(OutboxCheckpoint.skipped_ids).where(OutboxCheckpoint.skipped_ids.isnot(None))
+    ).scalars():
+        low_water = min([low_water] + [first for first, _, _ in json.loads(skipped_ids)])
+    # The newest published event is kept: SQLite hands out IDs after the
+    # largest one left in the table, and an emptied table would restart at 1
+    result = db.session.execute(delete(OutboxEvent).where(OutboxEvent.id < low_water))
+    db.session.commit()
+    return result.rowcount
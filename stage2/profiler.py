@@ -0,0 +1,225 @@
+"""
+Kiryana Inventory System - On-demand Request Profiler
+
+An administrator can profile a single request by sending an X-Profile
+header or adding ?_profile=1 to the URL. That request runs under a profiler
+and every SQL statement it executes is timed; the result is saved as a
+RequestProfile and can be browsed at /admin/profiles.
+
+    X-Profile: sample     (or ?_profile=1) samples the request thread's stack
+                          every millisecond; the stacks are stored in folded
+                          form, which flamegraph.pl and speedscope read
+    X-Profile: cprofile   (or ?_profile=cprofile) runs cProfile and stores
+                          the pstats listing sorted by cumulative time
+
+Other requests only pay for the header check: the sampler thread and the
+SQL listeners exist only while a profiled request is running.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+from flask_login import current_user
+from sqlalchemy import delete, event, insert, select, func
+
+from app import db
+from models import RequestProfile
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+MODES = ('sample', 'cprofile')
+SAMPLE_INTERVAL = 0.001
+# Older profiles are deleted when a new one is saved
+KEEP_PROFILES = 200
+
+_local = threading.local()
+_listeners_lock = threading.Lock()
+_listening = {}  # engine -> number of profiled requests using it
+
+
+def requested_mode():
+    """Profiling mode asked for by the current request, or None"""
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if not value:
+        return None
+    return value if value in MODES else 'sample'
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from a background thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.counts.most_common())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profile', None) is not None:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    starts = conn.info.get('profile_query_start')
+    if profile is None or not starts:
+        return
+    started = starts.pop()
+    profile.queries.append({
+        'start_ms': round((started - profile.started) * 1000, 3),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        'rows': cursor.rowcount,
+        'statement': statement,
+    })
+
+
+def _listen(engine):
+    with _listeners_lock:
+        if not _listening.get(engine):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening[engine] = _listening.get(engine, 0) + 1
+
+
+def _unlisten(engine):
+    with _listeners_lock:
+        _listening[engine] -= 1
+        if not _listening[engine]:
+            event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', _after_cursor_execute)
+            del _listening[engine]
+
+
+class ActiveProfile:
+    """Profiler state of the request running on this thread"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.engine = db.engine
+        self.queries = []
+        self.sampler = None
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.duration_ms = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            try:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            except ValueError:
+                # Another request on this process is already under cProfile
+                self.mode, self.profiler = 'sample', None
+        if self.mode == 'sample':
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+        _local.profile = self
+        _listen(self.engine)
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        _local.profile = None
+        _unlisten(self.engine)
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+
+    def stats(self):
+        if not self.profiler:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(60)
+        return stream.getvalue()
+
+    def save(self, status_code):
+        """Store the profile outside the request's session; returns its ID"""
+        table = RequestProfile.__table__
+        with self.engine.begin() as conn:
+            profile_id = conn.execute(insert(table).values(
+                user_id=current_user.id,
+                method=request.method,
+                path=request.full_path.rstrip('?')[:500],
+                endpoint=request.endpoint,
+                status_code=status_code,
+                mode=self.mode,
+                duration_ms=self.duration_ms,
+                query_count=len(self.queries),
+                query_ms=sum(q['duration_ms'] for q in self.queries),
+                stacks=self.sampler.folded() if self.sampler else None,
+                stats=self.stats(),
+                timeline=json.dumps(self.queries),
+            )).inserted_primary_key[0]
+            newest = conn.execute(select(func.max(table.c.id))).scalar()
+            conn.execute(delete(table).where(table.c.id <= newest - KEEP_PROFILES))
+        return profile_id
+
+
+def init_profiler(app):
+    """Register the request hooks that start and save profiles"""
+
+    @app.before_request
+    def start_profile():
+        mode = requested_mode()
+        if mode is None:
+            return
+        if not current_user.is_authenticated or current_user.role.name != 'admin':
+            return
+        g.profile = ActiveProfile(mode)
+        g.profile.start()
+
+    def finish_profile(status_code):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None
+        profile.stop()
+        try:
+            return profile.save(status_code)
+        except Exception:
+            app.logger.exception("Could not save the profile of %s", request.path)
+            return None
+
+    @app.after_request
+    def save_profile(response):
+        profile_id = finish_profile(response.status_code)
+        if profile_id:
+            response.headers['X-Profile-Id'] = str(profile_id)
+        return response
+
+    @app.teardown_request
+    def save_failed_profile(exc):
+        # Requests that raised never reach after_request
+        if 'profile' in g:
+            finish_profile(500)
@@ -0,0 +1,205 @@
+"""
+Kiryana Inventory System - Parallel Report Executor
+
+Per-store analytic reports (sales by product, movement summaries, stock
+valuation) do not depend on each other, so they can be computed in separate
+processes. Each worker opens its own database engine once and runs plain
+SQLAlchemy Core queries; the parent merges the per-store results into
+chain-wide totals.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, create_engine, func, select
+
+# Engine owned by the current worker process (set by _init_worker)
+_engine = None
+
+
+def _init_worker(database_url):
+    """Process pool initializer: give each worker its own connection pool"""
+    global _engine
+    options = {'pool_pre_ping': True}
+    if not database_url.startswith('sqlite'):
+        # One connection is enough: a worker runs one store at a time
+        options.update(pool_size=1, max_overflow=0)
+    _engine = create_engine(database_url, **options)
+
+
+def _tables():
+    """Model tables, imported lazily so workers only pay for it once"""
+    from models import InventoryMovement, Product
+    return Product.__table__, InventoryMovement.__table__
+
+
+def _catalog():
+    """Products joined to their masters, and the effective-value column factory"""
+    from models import catalog_column, product_catalog
+    return product_catalog, catalog_column
+
+
+def _available_quantity():
+    """Stock on hand of a product row, including unfolded shard counters"""
+    from models import Product
+    return Product.available_quantity.expression
+
+
+def sales_by_product(conn, store_id, start_date, end_date, limit=None):
+    """Units and value sold per product in a store"""
+    product, movement = _tables()
+    catalog, catalog_column = _catalog()
+    name = catalog_column('name')
+
+    query = select(
+        product.c.id,
+        product.c.sku,
+        name,
+        func.sum(movement.c.quantity).label('quantity'),
+        func.sum(movement.c.quantity * movement.c.unit_price).label('value')
+    ).select_from(catalog).join(movement, movement.c.product_id == product.c.id).where(
+        movement.c.store_id == store_id,
+        movement.c.movement_type == 'sale',
+        movement.c.movement_date.between(start_date, end_date)
+    ).group_by(product.c.id, product.c.sku, name).order_by(
+        func.sum(movement.c.quantity * movement.c.unit_price).desc()
+    )
+
+    if limit:
+        query = query.limit(limit)
+
+    return [{
+        'product_id': r.id,
+        'sku': r.sku,
+        'name': r.name,
+        'quantity': int(r.quantity or 0),
+        'value': float(r.value or 0)
+    } for r in conn.execute(query)]
+
+
+def movement_summary(conn, store_id, start_date, end_date):
+    """Units and value per movement type in a store"""
+    _, movement = _tables()
+
+    rows = conn.execute(
+        select(
+            movement.c.movement_type,
+            func.count().label('count'),
+            func.sum(movement.c.quantity).label('quantity'),
+            func.sum(movement.c.quantity * movement.c.unit_price).label('value')
+        ).where(
+            movement.c.store_id == store_id,
+            movement.c.movement_date.between(start_date, end_date)
+        ).group_by(movement.c.movement_type)
+    )
+
+    return {
+        r.movement_type: {
+            'count': int(r.count),
+            'quantity': int(r.quantity or 0),
+            'value': float(r.value or 0)
+        } for r in rows
+    }
+
+
+def valuation(conn, store_id):
+    """Stock value at selling and cost price, with low/out of stock counts"""
+    product, _ = _tables()
+    catalog, catalog_column = _catalog()
+    unit_price = catalog_column('unit_price')
+    cost_price = catalog_column('cost_price')
+    quantity = _available_quantity()
+
+    r = conn.execute(
+        select(
+            func.count(product.c.id).label('product_count'),
+            func.coalesce(func.sum(quantity), 0).label('quantity'),
+            func.coalesce(func.sum(quantity * unit_price), 0).label('retail_value'),
+            func.coalesce(func.sum(quantity * func.coalesce(cost_price, 0)), 0).label('cost_value'),
+            func.coalesce(func.sum(case((quantity <= product.c.reorder_level, 1), else_=0)), 0).label('low_stock'),
+            func.coalesce(func.sum(case((quantity == 0, 1), else_=0)), 0).label('out_of_stock')
+        ).select_from(catalog).where(product.c.store_id == store_id)
+    ).one()
+
+    return {
+        'product_count': int(r.product_count),
+        'quantity': int(r.quantity),
+        'retail_value': float(r.retail_value),
+        'cost_value': float(r.cost_value),
+        'low_stock_count': int(r.low_stock),
+        'out_of_stock_count': int(r.out_of_stock)
+    }
+
+
+def compute_store_report(store_id, start_date, end_date, top=10):
+    """Every analytic report for one store (runs inside a worker)"""
+    started = time.perf_counter()
+
+    with _engine.connect() as conn:
+        report = {
+            'store_id': store_id,
+            'valuation': valuation(conn, store_id),
+            'movements': movement_summary(conn, store_id, start_date, end_date),
+            'top_products': sales_by_product(conn, store_id, start_date, end_date, limit=top)
+        }
+
+    report['seconds'] = time.perf_counter() - started
+    report['pid'] = os.getpid()
+    return report
+
+
+def _compute_store_report_args(args):
+    return compute_store_report(*args)
+
+
+def merge_reports(reports):
+    """Combine per-store reports into chain-wide totals"""
+    totals = {
+        'store_count': len(reports),
+        'product_count': 0,
+        'quantity': 0,
+        'retail_value': 0.0,
+        'cost_value': 0.0,
+        'low_stock_count': 0,
+        'out_of_stock_count': 0,
+        'movements': {}
+    }
+
+    for report in reports:
+        for key in ('product_count', 'quantity', 'retail_value', 'cost_value',
+                    'low_stock_count', 'out_of_stock_count'):
+            totals[key] += report['valuation'][key]
+
+        for movement_type, summary in report['movements'].items():
+            merged = totals['movements'].setdefault(movement_type, {'count': 0, 'quantity': 0, 'value': 0.0})
+            for key in ('count', 'quantity', 'value'):
+                merged[key] += summary[key]
+
+    return totals
+
+
+def run_reports(store_ids, database_url, days=30, workers=1, top=10, end_date=None):
+    """Compute reports for the given stores, in parallel when workers > 1
+
+    Returns (per_store_reports, chain_totals), with per-store reports in the
+    order of store_ids.
+    """
+    end_date = end_date or datetime.now()
+    start_date = end_date - timedelta(days=days)
+    tasks = [(store_id, start_date, end_date, top) for store_id in store_ids]
+
+    if workers <= 1:
+        _init_worker(database_url)
+        reports = [_compute_store_report_args(task) for task in tasks]
+        _engine.dispose()
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(database_url,)) as executor:
+            # Hand out several stores per task to amortise pickling overhead
+            chunksize = max(1, len(tasks) // (workers * 4))
+            reports = list(executor.map(_compute_store_report_args, tasks, chunksize=chunksize))
+
+    return reports, merge_reports(reports)
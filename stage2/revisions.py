@@ -0,0 +1,108 @@
+"""
+Kiryana Inventory System - Store Revisions
+
+Every store has a revision number that increases whenever one of its
+products or inventory movements is written. API clients that poll a store's
+catalog get the revision as an ETag and can revalidate with If-None-Match,
+which costs a single primary-key lookup instead of the product query.
+
+ORM writes are picked up automatically by a before_flush hook, so the views
+and CLI commands bump the revision in the same transaction as their change.
+The hook also stamps each written product with the new revision
+(Product.updated_version) and records deleted products as tombstones, which
+is what the /changes feed reads. Bulk UPDATE/INSERT statements bypass the
+ORM and must call bump_revision() and set updated_version themselves.
+
+Each store's revision starts at 1 when the store is created (or, for stores
+from before revisions existed, at startup), so a never-written store still
+hands out a real watermark without its readers having to write one.
+"""
+
+from sqlalchemy import event, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Product, InventoryMovement, ProductTombstone, Store, StoreRevision
+
+# Objects whose writes change what a store's API consumers see
+TRACKED_MODELS = (Product, InventoryMovement)
+
+
+def current_revision(store_id):
+    """Current revision of a store (0 if it was never written)"""
+    revision = db.session.execute(
+        select(StoreRevision.revision).where(StoreRevision.store_id == store_id)
+    ).scalar()
+    return revision or 0
+
+
+def bump_revision(store_id, session=None):
+    """Increment a store's revision within the current transaction and return it"""
+    session = session or db.session
+    table = StoreRevision.__table__
+
+    result = session.execute(
+        update(table).where(table.c.store_id == store_id)
+        .values(revision=table.c.revision + 1)
+        .returning(table.c.revision)
+    ).first()
+    if result is not None:
+        return result.revision
+
+    # First write to this store: create its counter. A concurrent writer may
+    # have created it meanwhile, in which case the update goes through.
+    try:
+        with session.begin_nested():
+            session.execute(insert(table).values(store_id=store_id, revision=1))
+        return 1
+    except IntegrityError:
+        return bump_revision(store_id, session)
+
+
+def init_store_revisions():
+    """Start the revision of every store that has none; returns how many were started"""
+    table = StoreRevision.__table__
+    store = Store.__table__
+    result = db.session.execute(insert(table).from_select(
+        ['store_id', 'revision'],
+        select(store.c.id, literal(1)).where(~select(table.c.store_id).where(table.c.store_id == store.c.id).exists())
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+@event.listens_for(Store, 'after_insert')
+def _start_revision(mapper, connection, target):
+    connection.execute(insert(StoreRevision.__table__).values(store_id=target.id, revision=1))
+
+
+def _changed_objects(session):
+    """Pending new, modified and deleted tracked objects, by store"""
+    changes = {}
+    for obj in session.new:
+        if isinstance(obj, TRACKED_MODELS):
+            changes.setdefault(obj.store_id, []).append((obj, 'new'))
+    for obj in session.deleted:
+        if isinstance(obj, TRACKED_MODELS):
+            changes.setdefault(obj.store_id, []).append((obj, 'deleted'))
+    for obj in session.dirty:
+        if isinstance(obj, TRACKED_MODELS) and session.is_modified(obj, include_collections=False):
+            changes.setdefault(obj.store_id, []).append((obj, 'dirty'))
+    changes.pop(None, None)
+    return changes
+
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_on_flush(session, flush_context, instances):
+    for store_id, objects in sorted(_changed_objects(session).items()):
+        revision = bump_revision(store_id, session)
+
+        # Stamp products with the revision for the change feed, and leave
+        # a tombstone for deleted ones
+        for obj, state in objects:
+            if not isinstance(obj, Product):
+                continue
+            if state == 'deleted':
+                session.add(ProductTombstone(product_id=obj.id, store_id=store_id, version=revision))
+            else:
+                obj.updated_version = revision
@@ -0,0 +1,186 @@
+"""
+Kiryana Inventory System - Schema Upgrades
+
+db.create_all() creates missing tables but never changes existing ones.
+Columns added to a model after its table shipped are listed in
+ADDED_COLUMNS; upgrade_schema() adds any that are missing with ALTER TABLE,
+along with the indexes that cover them, when the app starts. New columns
+need a server default (or must be nullable) so existing rows stay valid.
+Indexes added to existing columns are listed in ADDED_INDEXES and created
+by create_added_indexes(). Columns that have since become nullable are
+listed in RELAXED_COLUMNS and relaxed by relax_columns(). SQLite tables
+that have since been declared AUTOINCREMENT are listed in
+AUTOINCREMENT_TABLES and rebuilt by add_sqlite_autoincrement().
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import DatabaseError
+
+# (table, column) pairs added to existing tables, oldest first
+ADDED_COLUMNS = [
+    ('product', 'updated_version'),
+    ('inventory_movement', 'idempotency_key'),
+    ('product', 'shard_count'),
+    ('product', 'master_id'),
+    ('inventory_movement_archive', 'idempotency_key'),
+    ('outbox_checkpoint', 'skipped_ids'),
+]
+
+# (table, index) pairs added over existing columns, oldest first
+ADDED_INDEXES = [
+    ('sales_order', 'ux_sales_order_number'),
+    ('purchase_order', 'ux_purchase_order_number'),
+    ('inventory_transfer', 'ux_inventory_transfer_number'),
+]
+
+# (table, column) pairs whose NOT NULL constraint was dropped, oldest first
+RELAXED_COLUMNS = [
+    ('product', 'name'),
+    ('product', 'unit_price'),
+]
+
+# Tables declared sqlite_autoincrement since, with the tables that keep rows
+# under the same ids
+AUTOINCREMENT_TABLES = {
+    'inventory_movement': ['inventory_movement_archive'],
+}
+
+
+def upgrade_schema(db):
+    """Add missing columns and their indexes; returns the columns added"""
+    engine = db.engine
+    inspector = inspect(engine)
+    ddl_compiler = engine.dialect.ddl_compiler(engine.dialect, None)
+    preparer = engine.dialect.identifier_preparer
+
+    added = []
+    with engine.begin() as conn:
+        for table_name, column_name in ADDED_COLUMNS:
+            existing = {column['name'] for column in inspector.get_columns(table_name)}
+            if column_name in existing:
+                continue
+
+            table = db.metadata.tables[table_name]
+            column = table.c[column_name]
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {ddl_compiler.get_column_specification(column)}"
+            ))
+            added.append((table_name, column_name))
+
+            for index in table.indexes:
+                if column_name in index.columns:
+                    index.create(conn, checkfirst=True)
+
+    return added
+
+
+def create_added_indexes(db):
+    """Create missing ADDED_INDEXES; returns (created, failed) index names
+
+    A unique index fails to build when existing rows already break it; it
+    is skipped (and retried at the next start) so the app still starts.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+
+    created = []
+    failed = []
+    for table_name, index_name in ADDED_INDEXES:
+        if index_name in {index['name'] for index in inspector.get_indexes(table_name)}:
+            continue
+
+        index = next(i for i in db.metadata.tables[table_name].indexes if i.name == index_name)
+        try:
+            with engine.begin() as conn:
+                index.create(conn)
+            created.append(index_name)
+        except DatabaseError:
+            failed.append(index_name)
+
+    return created, failed
+
+
+def relax_columns(db):
+    """Drop NOT NULL from RELAXED_COLUMNS where the database still has it; returns the columns relaxed
+
+    SQLite cannot alter a column, so a table is rebuilt from its model
+    instead: created under a new name, filled, and renamed over the old one.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    relaxed = []
+    for table_name in dict.fromkeys(table for table, _ in RELAXED_COLUMNS):
+        table = db.metadata.tables[table_name]
+        existing = {column['name']: column for column in inspector.get_columns(table_name)}
+        columns = [column for table, column in RELAXED_COLUMNS
+                   if table == table_name and existing[column]['nullable'] is False]
+        if not columns:
+            continue
+
+        with engine.begin() as conn:
+            if engine.dialect.name == 'sqlite':
+                _rebuild_sqlite_table(conn, table, [name for name in existing if name in table.c])
+            else:
+                for column in columns:
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ALTER COLUMN {preparer.quote(column)} DROP NOT NULL"
+                    ))
+        relaxed.extend((table_name, column) for column in columns)
+
+    return relaxed
+
+
+def add_sqlite_autoincrement(db):
+    """Rebuild AUTOINCREMENT_TABLES still without AUTOINCREMENT on SQLite; returns the tables rebuilt
+
+    Without it SQLite hands out the largest ids again once their rows are
+    deleted. The id counter is started past the largest id in the table
+    and in the tables sharing its ids.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return []
+    inspector = inspect(engine)
+
+    rebuilt = []
+    for table_name, shared in AUTOINCREMENT_TABLES.items():
+        with engine.begin() as conn:
+            sql = conn.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': table_name}).scalar()
+            if 'AUTOINCREMENT' in sql.upper():
+                continue
+
+            table = db.metadata.tables[table_name]
+            existing = [column['name'] for column in inspector.get_columns(table_name)]
+            _rebuild_sqlite_table(conn, table, [name for name in existing if name in table.c])
+
+            top = max(conn.execute(text(f'SELECT MAX(id) FROM "{name}"')).scalar() or 0
+                      for name in [table_name] + shared)
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {'name': table_name})
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                         {'name': table_name, 'seq': top})
+        rebuilt.append(table_name)
+
+    return rebuilt
+
+
+def _rebuild_sqlite_table(conn, table, column_names):
+    # Foreign keys are not enforced (SQLite's default), so dropping the old
+    # table leaves rows that reference it alone
+    rebuilt = table.to_metadata(table.metadata, name=f"{table.name}__rebuild")
+    try:
+        conn.execute(CreateTable(rebuilt))
+    finally:
+        table.metadata.remove(rebuilt)
+    columns = ', '.join(f'"{name}"' for name in column_names)
+    conn.execute(text(f'INSERT INTO "{rebuilt.name}" ({columns}) SELECT {columns} FROM "{table.name}"'))
+    conn.execute(text(f'DROP TABLE "{table.name}"'))
+    conn.execute(text(f'ALTER TABLE "{rebuilt.name}" RENAME TO "{table.name}"'))
+    for index in table.indexes:
+        index.create(conn)
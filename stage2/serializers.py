@@ -0,0 +1,167 @@
+"""
+Kiryana Inventory System - API Serialization
+
+Declarative row schemas for the JSON API. A schema names its output fields
+and the SQL expression behind each one, so endpoints select exactly those
+columns as plain Core rows (no ORM instances, no per-row method calls) and
+computed fields such as is_low_stock are evaluated by the database.
+
+Responses are encoded with orjson when it is installed (pip install orjson),
+which also formats datetimes natively, and with the standard json module
+otherwise.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response
+from sqlalchemy import select
+
+from models import Store, Product, InventoryMovement, Supplier, catalog_column, product_catalog
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def _default(value):
+    """Fallback conversions for the standard json encoder"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """Encode data as JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200):
+    """Flask response carrying data encoded with dumps()"""
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+class Schema:
+    """Ordered mapping of output field names to SQL expressions"""
+
+    def __init__(self, from_=None, **fields):
+        self.from_ = from_
+        self.fields = fields
+        self.names = tuple(fields)
+
+    def select(self):
+        """SELECT of every field, labelled with its output name"""
+        query = select(*[expression.label(name) for name, expression in self.fields.items()])
+        return query.select_from(self.from_) if self.from_ is not None else query
+
+    def row(self, row):
+        """One result row as a dict"""
+        return dict(zip(self.names, row))
+
+    def rows(self, rows):
+        """Result rows as a list of dicts"""
+        names = self.names
+        return [dict(zip(names, row)) for row in rows]
+
+    def dump(self, rows):
+        """Result rows encoded as a JSON array"""
+        return dumps(self.rows(rows))
+
+
+# Product schemas select from products joined to their masters, which
+# supply the catalog values stores do not override
+PRODUCT = Schema(
+    from_=product_catalog,
+    id=Product.id,
+    name=catalog_column('name'),
+    sku=Product.sku,
+    barcode=catalog_column('barcode'),
+    category=catalog_column('category'),
+    unit_price=catalog_column('unit_price'),
+    current_quantity=Product.available_quantity,
+    reorder_level=Product.reorder_level,
+    is_low_stock=Product.available_quantity <= Product.reorder_level
+)
+
+# Product list entry plus the revision it was last written at, for delta sync
+PRODUCT_CHANGE = Schema(
+    from_=PRODUCT.from_,
+    **PRODUCT.fields,
+    updated_version=Product.updated_version
+)
+
+PRODUCT_DETAIL = Schema(
+    from_=product_catalog,
+    id=Product.id,
+    name=catalog_column('name'),
+    sku=Product.sku,
+    barcode=catalog_column('barcode'),
+    description=catalog_column('description'),
+    category=catalog_column('category'),
+    unit_price=catalog_column('unit_price'),
+    cost_price=catalog_column('cost_price'),
+    current_quantity=Product.available_quantity,
+    reorder_level=Product.reorder_level,
+    location_in_store=Product.location_in_store,
+    is_low_stock=Product.available_quantity <= Product.reorder_level,
+    store_id=Product.store_id
+)
+
+LOW_STOCK_PRODUCT = Schema(
+    from_=product_catalog,
+    id=Product.id,
+    name=catalog_column('name'),
+    sku=Product.sku,
+    category=catalog_column('category'),
+    current_quantity=Product.available_quantity,
+    reorder_level=Product.reorder_level,
+    unit_price=catalog_column('unit_price')
+)
+
+MOVEMENT = Schema(
+    id=InventoryMovement.id,
+    movement_type=InventoryMovement.movement_type,
+    quantity=InventoryMovement.quantity,
+    unit_price=InventoryMovement.unit_price,
+    total_value=InventoryMovement.quantity * InventoryMovement.unit_price,
+    reference=InventoryMovement.reference,
+    notes=InventoryMovement.notes,
+    movement_date=InventoryMovement.movement_date,
+    created_at=InventoryMovement.created_at
+)
+
+RECENT_MOVEMENT = Schema(
+    id=InventoryMovement.id,
+    product_id=InventoryMovement.product_id,
+    product_name=Product.name,
+    movement_type=InventoryMovement.movement_type,
+    quantity=InventoryMovement.quantity,
+    unit_price=InventoryMovement.unit_price,
+    total_value=InventoryMovement.quantity * InventoryMovement.unit_price,
+    reference=InventoryMovement.reference,
+    movement_date=InventoryMovement.movement_date
+)
+
+SUPPLIER = Schema(
+    id=Supplier.id,
+    name=Supplier.name,
+    contact_name=Supplier.contact_name,
+    email=Supplier.email,
+    phone=Supplier.phone
+)
+
+STORE = Schema(
+    id=Store.id,
+    name=Store.name,
+    code=Store.code,
+    location=Store.location,
+    address=Store.address,
+    phone=Store.phone,
+    email=Store.email
+)
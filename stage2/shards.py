@@ -0,0 +1,135 @@
+"""
+Kiryana Inventory System - Sharded Stock Counters
+
+Fast movers (milk, bread, sugar) are sold from many terminals at once, and
+every sale updating the same product row makes checkouts queue on its row
+lock. A product can be given N stock shards instead: each movement then
+adds its change to one of N product_stock_shard rows picked at random, so
+concurrent sales rarely touch the same row. The movement itself is inserted
+directly and does not bump the store revision, which would be just as hot.
+
+Stock on hand is Product.current_quantity plus the shard quantities
+(Product.available_quantity in queries, get_available_quantity() on an
+instance), so stock and low-stock checks stay exact. fold_shards(), run
+periodically by `cli.py stock-shards --fold`, moves shard quantities into
+current_quantity; that is when the product's revision, change feed entry
+and outbox event are written. Listings that read current_quantity directly
+lag by at most one fold interval.
+"""
+
+import random
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+
+from app import db
+from archive import STOCK_SIGN
+from models import Product, ProductStockShard, InventoryMovement
+from outbox import MOVEMENT_FIELDS, add_events, object_event
+from revisions import bump_revision
+
+# Shards per product when none is given
+DEFAULT_SHARD_COUNT = 8
+
+
+def insert_sharded_movement(movement, product):
+    """Record a movement of a sharded product on one of its shard rows
+
+    Runs in the current transaction; the caller commits. Sets movement.id.
+    """
+    now = datetime.utcnow()
+    movement.movement_date = movement.movement_date or now
+    movement.created_at = now
+
+    shards = ProductStockShard.__table__
+    delta = STOCK_SIGN[movement.movement_type] * movement.quantity
+    result = db.session.execute(
+        update(shards).where(
+            shards.c.product_id == product.id,
+            shards.c.shard == random.randrange(product.shard_count)
+        ).values(
+            quantity=shards.c.quantity + delta,
+            version=shards.c.version + 1
+        )
+    )
+    if result.rowcount == 0:
+        # The shard rows are being reconfigured; fall back to the product row
+        db.session.execute(
+            update(Product).where(Product.id == product.id)
+            .values(current_quantity=Product.current_quantity + delta)
+        )
+
+    table = InventoryMovement.__table__
+    values = {column.key: getattr(movement, column.key) for column in table.columns if column.key != 'id'}
+    result = db.session.execute(insert(table).values(**values))
+    movement.id = result.inserted_primary_key[0]
+
+    add_events([object_event(movement, 'movement.recorded', MOVEMENT_FIELDS)])
+
+
+def fold_shards(product_ids=None):
+    """Move shard quantities into Product.current_quantity
+
+    Returns the number of products folded. Each shard is reduced by the
+    amount read from it rather than reset, so sales recorded concurrently
+    are kept.
+    """
+    query = select(ProductStockShard.product_id, ProductStockShard.shard, ProductStockShard.quantity).where(
+        ProductStockShard.quantity != 0
+    )
+    if product_ids is not None:
+        query = query.where(ProductStockShard.product_id.in_(product_ids))
+
+    pending = {}
+    for product_id, shard, quantity in db.session.execute(query).all():
+        pending.setdefault(product_id, []).append((shard, quantity))
+
+    shards = ProductStockShard.__table__
+    for product_id, rows in sorted(pending.items()):
+        product = db.session.get(Product, product_id, with_for_update=True, populate_existing=True)
+        if product is None:
+            continue
+        for shard, quantity in rows:
+            db.session.execute(
+                update(shards).where(shards.c.product_id == product_id, shards.c.shard == shard)
+                .values(quantity=shards.c.quantity - quantity)
+            )
+        product.current_quantity += sum(quantity for _, quantity in rows)
+
+    db.session.commit()
+    return len(pending)
+
+
+def set_shard_count(product, shard_count):
+    """Shard a product's stock counter N ways, or stop sharding it with 0"""
+    existing = set(db.session.execute(
+        select(ProductStockShard.shard).where(ProductStockShard.product_id == product.id)
+    ).scalars())
+    missing = [shard for shard in range(shard_count) if shard not in existing]
+    if missing:
+        db.session.execute(insert(ProductStockShard), [
+            {'product_id': product.id, 'shard': shard, 'store_id': product.store_id, 'quantity': 0, 'version': 0}
+            for shard in missing
+        ])
+    product.shard_count = shard_count
+    db.session.commit()
+
+    # Shards beyond the new count receive no more writes once they are folded;
+    # one that a concurrent sale wrote to meanwhile stays until the next fold
+    fold_shards([product.id])
+    # Removing rows lowers shard_stamp(), so the revision moves on instead
+    bump_revision(product.store_id)
+    db.session.execute(delete(ProductStockShard).where(
+        ProductStockShard.product_id == product.id,
+        ProductStockShard.shard >= shard_count,
+        ProductStockShard.quantity == 0
+    ))
+    db.session.commit()
+
+
+def shard_stamp(store_id):
+    """Total write count of a store's shard rows; changes with every sharded movement"""
+    return db.session.execute(
+        select(func.coalesce(func.sum(ProductStockShard.version), 0))
+        .where(ProductStockShard.store_id == store_id)
+    ).scalar()
@@ -0,0 +1,54 @@
+"""
+Shared fixtures: the app runs against a throwaway SQLite database
+
+app.py creates the application at import time from DATABASE_URL, so the
+variable is set before anything imports it.
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix='kiryana-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['FLASK_DEBUG'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+from models import Product, Store, User  # noqa: E402
+
+_codes = itertools.count(1)
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def admin(app):
+    return User.query.filter_by(username='admin').one()
+
+
+@pytest.fixture
+def store(app):
+    """A new store, so tests do not see each other's rows"""
+    number = next(_codes)
+    store = Store(name=f"Test Store {number}", code=f"T{number}")
+    db.session.add(store)
+    db.session.commit()
+    return store
+
+
+@pytest.fixture
+def product(store):
+    product = Product(store_id=store.id, name="Sugar 1kg", sku=f"SUGAR-{store.id}",
+                      unit_price=1.5, current_quantity=100)
+    db.session.add(product)
+    db.session.commit()
+    return product
@@ -0,0 +1,41 @@
+"""API authentication rules (views/api.py)"""
+
+import json
+
+import pytest
+
+from tokens import issue_token
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def _batch(product, key='edge-1:1'):
+    return {'movements': [{'product_id': product.id, 'movement_type': 'sale', 'quantity': 1,
+                           'idempotency_key': key}]}
+
+
+def test_movement_batch_needs_bearer_token(client, admin, product):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+
+    response = client.post(f'/api/store/{product.store_id}/movements/batch', json=_batch(product))
+    assert response.status_code == 401
+
+
+def test_movement_batch_needs_json_content_type(client, admin, product):
+    token, _ = issue_token(admin)
+    response = client.post(f'/api/store/{product.store_id}/movements/batch',
+                           data=json.dumps(_batch(product)), content_type='text/plain',
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 400
+
+
+def test_movement_batch_with_token(client, admin, product):
+    token, _ = issue_token(admin)
+    response = client.post(f'/api/store/{product.store_id}/movements/batch', json=_batch(product),
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
@@ -0,0 +1,33 @@
+"""Movement archival (archive.py)"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import db
+from archive import archive_movements
+from models import InventoryMovement, InventoryMovementArchive
+
+
+def _movement(product, **fields):
+    movement = InventoryMovement(product_id=product.id, store_id=product.store_id, movement_type='stock_in',
+                                 quantity=1, unit_price=product.unit_price, **fields)
+    db.session.add(movement)
+    db.session.commit()
+    return movement
+
+
+def test_archived_ids_are_not_reused(product):
+    old = datetime.utcnow() - timedelta(days=800)
+    for _ in range(3):
+        _movement(product, movement_date=old)
+
+    assert archive_movements(store_id=product.store_id) == 3
+    archived_max = db.session.execute(
+        select(func.max(InventoryMovementArchive.id)).where(InventoryMovementArchive.store_id == product.store_id)
+    ).scalar()
+
+    # The archived rows had the largest ids; a new movement must not take one of them
+    movement = _movement(product)
+    assert movement.id > archived_max
+    assert db.session.get(InventoryMovementArchive, movement.id) is None
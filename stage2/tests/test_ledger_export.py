@@ -0,0 +1,73 @@
+"""Incremental ledger export (ledger_export.py)"""
+
+import os
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import delete, insert, select
+
+import ledger_export
+from app import db
+from archive import archive_movements
+from ledger_export import export_movements, read_watermark
+from models import InventoryMovement
+
+
+def _movement(product, days_ago=0):
+    movement = InventoryMovement(product_id=product.id, store_id=product.store_id, movement_type='stock_in',
+                                 quantity=1, unit_price=product.unit_price,
+                                 movement_date=datetime.utcnow() - timedelta(days=days_ago))
+    db.session.add(movement)
+    db.session.commit()
+    return movement.id
+
+
+def _exported_ids(output_dir, store_id):
+    path = os.path.join(output_dir, f'store_id={store_id}')
+    return sorted(pq.read_table(path).column('id').to_pylist()) if os.path.exists(path) else []
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    return str(tmp_path / 'ledger')
+
+
+def test_export_keeps_ids_across_archive_and_late_commits(product, output_dir):
+    table = InventoryMovement.__table__
+    first, late, third = (_movement(product, days_ago=800) for _ in range(3))
+
+    # The middle movement has not committed when the first export runs
+    row = db.session.execute(select(table).where(table.c.id == late)).mappings().one()
+    db.session.execute(delete(table).where(table.c.id == late))
+    db.session.commit()
+
+    export_movements(db.engine, output_dir)
+    assert _exported_ids(output_dir, product.store_id) == [first, third]
+    assert late in read_watermark(output_dir)['gaps']
+
+    # Archiving moves exported rows away; the late row then commits
+    archive_movements(store_id=product.store_id)
+    db.session.execute(insert(table), [dict(row, movement_date=datetime.utcnow())])
+    db.session.commit()
+    newest = _movement(product)
+
+    export_movements(db.engine, output_dir)
+    assert _exported_ids(output_dir, product.store_id) == [first, late, third, newest]
+
+    # Rows archived before they were exported are read from the archive
+    archived = _movement(product, days_ago=800)
+    archive_movements(store_id=product.store_id)
+    export_movements(db.engine, output_dir)
+    assert _exported_ids(output_dir, product.store_id) == [first, late, third, newest, archived]
+    assert late not in read_watermark(output_dir)['gaps']
+
+
+def test_gap_list_is_bounded(product, output_dir, monkeypatch):
+    monkeypatch.setattr(ledger_export, 'MAX_GAPS', 2)
+    ids = [_movement(product) for _ in range(6)]
+    db.session.execute(delete(InventoryMovement.__table__).where(InventoryMovement.id.in_(ids[:5])))
+    db.session.commit()
+
+    export_movements(db.engine, output_dir)
+    assert read_watermark(output_dir)['gaps'] == ids[3:5]
@@ -0,0 +1,40 @@
+"""Idempotent movement recording (movements.py)"""
+
+from app import db
+from models import InventoryMovement
+from movements import record_movement
+from shards import set_shard_count
+
+
+def _sale(product, key, quantity=2):
+    return InventoryMovement(product_id=product.id, store_id=product.store_id, movement_type='sale',
+                             quantity=quantity, unit_price=product.unit_price, idempotency_key=key)
+
+
+def _count(product, key):
+    return InventoryMovement.query.filter_by(store_id=product.store_id, idempotency_key=key).count()
+
+
+def test_duplicate_key_returns_original(product):
+    first, created = record_movement(_sale(product, 'k1'), product)
+    assert created
+
+    again, created = record_movement(_sale(product, 'k1'), product)
+    assert not created
+    assert again.id == first.id
+    assert _count(product, 'k1') == 1
+    assert product.get_available_quantity() == 98
+
+
+def test_duplicate_key_on_sharded_product_returns_original(product):
+    set_shard_count(product, 4)
+    db.session.commit()
+
+    first, created = record_movement(_sale(product, 'k1'), product)
+    assert created
+
+    again, created = record_movement(_sale(product, 'k1'), product)
+    assert not created
+    assert again.id == first.id
+    assert _count(product, 'k1') == 1
+    assert product.get_available_quantity() == 98
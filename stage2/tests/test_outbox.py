@@ -0,0 +1,54 @@
+"""Outbox relay delivery (outbox.py)"""
+
+import json
+
+from sqlalchemy import delete, insert, select
+
+import outbox
+from app import db
+from models import OutboxEvent
+
+
+class ListSink:
+    def __init__(self):
+        self.ids = []
+
+    def publish(self, lines):
+        self.ids.extend(json.loads(line)['id'] for line in lines)
+
+
+def _events(store, count):
+    outbox.add_events([{'store_id': store.id, 'event_type': 'test.event', 'aggregate_id': n, 'data': {}}
+                       for n in range(count)])
+    db.session.commit()
+    return db.session.execute(select(OutboxEvent.id).order_by(OutboxEvent.id.desc()).limit(count)).scalars().all()[::-1]
+
+
+def test_late_commit_is_delivered(store, monkeypatch):
+    monkeypatch.setattr(outbox, 'GAP_TIMEOUT', 0)
+    ids = _events(store, 5)
+
+    # Take out the middle event, as if its transaction had not committed yet
+    late = db.session.execute(select(OutboxEvent.__table__).where(OutboxEvent.id == ids[2])).mappings().one()
+    db.session.execute(delete(OutboxEvent).where(OutboxEvent.id == ids[2]))
+    db.session.commit()
+
+    sink = ListSink()
+    relay = outbox.Relay(sink, name=f'test-{store.id}')
+    relay.run_once()
+    assert ids[2] not in sink.ids
+    assert sink.ids[-2:] == [ids[3], ids[4]]
+
+    # Events below the gap are kept for it when pruning
+    outbox.prune_events()
+    db.session.execute(insert(OutboxEvent.__table__), [dict(late)])
+    db.session.commit()
+
+    # A new relay process picks the gap up from the checkpoint
+    relay = outbox.Relay(sink, name=f'test-{store.id}')
+    assert relay.run_once() == 1
+    assert sink.ids[-1] == ids[2]
+    assert relay.checkpoint().skipped_ids is None
+
+    assert relay.run_once() == 0
+    assert sink.ids.count(ids[2]) == 1
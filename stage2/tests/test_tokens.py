@@ -0,0 +1,42 @@
+"""Bearer token revocation (tokens.py)"""
+
+from datetime import datetime, timedelta
+
+import tokens
+from tokens import (DEFAULT_TOKEN_TTL, MAX_TOKEN_TTL, _secret, decode_token, issue_token,
+                    revocation_list, revoke_token, revoke_user_tokens)
+
+
+def _later(monkeypatch, seconds):
+    """Move tokens.py's clock forward, as if the purge ran later"""
+    moved = datetime.utcnow() + timedelta(seconds=seconds)
+
+    class _Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return moved
+
+    monkeypatch.setattr(tokens, 'datetime', _Clock)
+
+
+def _revoked(token):
+    revocation_list.invalidate()
+    return revocation_list.is_revoked(decode_token(token, _secret()))
+
+
+def test_ttl_is_capped(admin):
+    token, _ = issue_token(admin, ttl=MAX_TOKEN_TTL * 10)
+    claims = decode_token(token, _secret())
+    assert claims['exp'] - claims['iat'] == MAX_TOKEN_TTL
+
+
+def test_user_revocation_outlives_long_tokens(admin, monkeypatch):
+    token, _ = issue_token(admin, ttl=MAX_TOKEN_TTL)
+    revoke_user_tokens(admin.id)
+    assert _revoked(token)
+
+    # Another revocation purges expired rows; a long-lived token must stay revoked
+    _later(monkeypatch, DEFAULT_TOKEN_TTL + 3600)
+    revoke_token({'jti': 'unrelated', 'id': admin.id, 'exp': int(datetime.utcnow().timestamp())})
+    monkeypatch.undo()
+    assert _revoked(token)
@@ -0,0 +1,246 @@
+"""
+Kiryana Inventory System - API Bearer Tokens
+
+Stateless HS256 JSON Web Tokens for POS devices and scripts calling the api
+blueprint. Tokens follow the stage3 auth service's scheme (same JWT_SECRET,
+HS256, `id`/`username`/`email`/`role` claims) and additionally carry the
+user's store permission map, so a request can be authorised without loading
+the user from the database. They are marked with their own audience and
+type claims, and only tokens with those and a token id are accepted: a
+stage3 token signed with the same secret is not a stage2 API token.
+
+Revocation is handled by a short list of revoked token ids and per-user
+cutoffs kept in the revoked_token table. Each worker holds an in-memory copy
+that is refreshed every REVOCATION_REFRESH_SECONDS, so verifying a token
+costs no database query in the common case.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from identity import UserSnapshot
+
+DEFAULT_TOKEN_TTL = int(os.environ.get("API_TOKEN_TTL", "900"))  # 15 minutes, as in stage3
+# Longest lifetime any token gets; revoke_user_tokens() must outlive it
+MAX_TOKEN_TTL = max(int(os.environ.get("API_TOKEN_MAX_TTL", "86400")), DEFAULT_TOKEN_TTL)
+REVOCATION_REFRESH_SECONDS = int(os.environ.get("API_TOKEN_REVOCATION_REFRESH", "30"))
+CLOCK_LEEWAY_SECONDS = 30
+TOKEN_AUDIENCE = 'kiryana-stage2-api'
+TOKEN_TYPE = 'access'
+
+
+class TokenError(Exception):
+    """Raised when a token is malformed, forged, expired or revoked"""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _secret():
+    return current_app.config['JWT_SECRET'].encode('utf-8')
+
+
+def encode_token(payload, secret):
+    """Sign a payload as an HS256 JWT"""
+    header = {'alg': 'HS256', 'typ': 'JWT'}
+    signing_input = '.'.join([
+        _b64encode(json.dumps(header, separators=(',', ':')).encode('utf-8')),
+        _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    ])
+    signature = hmac.new(secret, signing_input.encode('ascii'), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64encode(signature)}"
+
+
+def decode_token(token, secret, leeway=CLOCK_LEEWAY_SECONDS):
+    """Verify an HS256 JWT and return its payload"""
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64decode(header_segment))
+        signature = _b64decode(signature_segment)
+    except (ValueError, TypeError):
+        raise TokenError("Malformed token")
+
+    if header.get('alg') != 'HS256':
+        raise TokenError("Unsupported token algorithm")
+
+    expected = hmac.new(secret, f"{header_segment}.{payload_segment}".encode('ascii'), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise TokenError("Invalid token signature")
+
+    try:
+        payload = json.loads(_b64decode(payload_segment))
+    except ValueError:
+        raise TokenError("Malformed token")
+
+    now = time.time()
+    if 'exp' in payload and now > payload['exp'] + leeway:
+        raise TokenError("Token expired")
+    if 'nbf' in payload and now < payload['nbf'] - leeway:
+        raise TokenError("Token not yet valid")
+
+    return payload
+
+
+def issue_token(user, ttl=None):
+    """Create a signed access token for a user
+
+    Returns (token, expires_at). Lifetimes are capped at MAX_TOKEN_TTL.
+    """
+    ttl = min(ttl or DEFAULT_TOKEN_TTL, MAX_TOKEN_TTL)
+    now = int(time.time())
+    payload = {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'role': user.role.name,
+        'stores': {str(perm.store_id): perm.permission_level for perm in user.store_permissions},
+        'aud': TOKEN_AUDIENCE,
+        'typ': TOKEN_TYPE,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + ttl
+    }
+    return encode_token(payload, _secret()), datetime.utcfromtimestamp(payload['exp'])
+
+
+class TokenUser(UserSnapshot):
+    """Authenticated identity built from token claims, without a database row"""
+
+    is_token = True
+
+    def __init__(self, claims):
+        super().__init__(
+            id=int(claims['id']),
+            username=claims.get('username'),
+            email=claims.get('email'),
+            role=claims.get('role'),
+            permissions={int(store_id): level for store_id, level in claims.get('stores', {}).items()}
+        )
+        self.token_id = claims.get('jti')
+        self.token_expires_at = claims.get('exp')
+
+
+class RevocationList:
+    """Per-worker copy of the revoked_token table, refreshed periodically"""
+
+    def __init__(self, refresh_seconds=REVOCATION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._token_ids = set()
+        self._user_cutoffs = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        from models import RevokedToken
+
+        now = datetime.utcnow()
+        token_ids = set()
+        user_cutoffs = {}
+        for entry in RevokedToken.query.filter(RevokedToken.expires_at > now).all():
+            if entry.jti:
+                token_ids.add(entry.jti)
+            else:
+                # revoked_at is naive UTC; timestamp() would read it as local time
+                cutoff = entry.revoked_at.replace(tzinfo=timezone.utc).timestamp()
+                user_cutoffs[entry.user_id] = max(cutoff, user_cutoffs.get(entry.user_id, 0))
+
+        self._token_ids = token_ids
+        self._user_cutoffs = user_cutoffs
+        self._loaded_at = time.monotonic()
+
+    def is_revoked(self, claims):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                self._refresh()
+            if claims.get('jti') in self._token_ids:
+                return True
+            cutoff = self._user_cutoffs.get(claims.get('id'))
+            return cutoff is not None and claims.get('iat', 0) <= cutoff
+
+    def invalidate(self):
+        """Force a reload on the next check"""
+        with self._lock:
+            self._loaded_at = None
+
+
+revocation_list = RevocationList()
+
+
+def revoke_token(claims):
+    """Revoke a single token until it would have expired anyway"""
+    from app import db
+    from models import RevokedToken
+
+    _purge_expired()
+    db.session.add(RevokedToken(
+        jti=claims['jti'],
+        user_id=claims['id'],
+        expires_at=datetime.utcfromtimestamp(claims['exp'])
+    ))
+    db.session.commit()
+    revocation_list.invalidate()
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to a user so far
+
+    Called when a user's role, status or store permissions change, since
+    tokens carry a snapshot of those.
+    """
+    from app import db
+    from models import RevokedToken
+
+    _purge_expired()
+    now = datetime.utcnow()
+    # Kept until the longest-lived token issued before now has expired
+    db.session.add(RevokedToken(
+        user_id=user_id,
+        revoked_at=now,
+        expires_at=now + timedelta(seconds=MAX_TOKEN_TTL + CLOCK_LEEWAY_SECONDS)
+    ))
+    db.session.commit()
+    revocation_list.invalidate()
+
+
+def _purge_expired():
+    from models import RevokedToken
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete()
+
+
+def load_user_from_request(request):
+    """Flask-Login request loader: authenticate api calls by bearer token"""
+    if request.blueprint != 'api':
+        return None
+
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+
+    try:
+        claims = decode_token(auth_header[7:].strip(), _secret())
+    except TokenError as e:
+        current_app.logger.info(f"Rejected API token: {e}")
+        return None
+
+    if claims.get('aud') != TOKEN_AUDIENCE or claims.get('typ') != TOKEN_TYPE or not claims.get('jti'):
+        current_app.logger.info("Rejected API token: not a stage2 API token")
+        return None
+
+    if 'id' not in claims or revocation_list.is_revoked(claims):
+        return None
+
+    return TokenUser(claims)
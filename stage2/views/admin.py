@@ -0,0 +1,72 @@
+import json
+from collections import Counter
+
+from flask import Blueprint, Response, flash, redirect, render_template, url_for
+from flask_login import current_user, login_required
+
+from models import RequestProfile
+
+# Create blueprint
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+def admin_only():
+    """Redirect response for non-admins, or None"""
+    if current_user.role.name != 'admin':
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('store.select_store'))
+    return None
+
+
+@bp.route('/profiles')
+@login_required
+def list_profiles():
+    """Recently profiled requests (admin only)"""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    profiles = RequestProfile.query.order_by(RequestProfile.id.desc()).limit(200).all()
+    return render_template('admin/profiles.html', profiles=profiles)
+
+
+@bp.route('/profiles/<int:profile_id>')
+@login_required
+def view_profile(profile_id):
+    """SQL timeline and hottest functions of one profiled request"""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    profile = RequestProfile.query.get_or_404(profile_id)
+    timeline = json.loads(profile.timeline or '[]')
+
+    # Functions the sampled stacks most often ended in (self time)
+    hot_frames = Counter()
+    total_samples = 0
+    for line in (profile.stacks or '').splitlines():
+        stack, count = line.rsplit(' ', 1)
+        hot_frames[stack.rsplit(';', 1)[-1]] += int(count)
+        total_samples += int(count)
+
+    return render_template('admin/profile.html',
+                          profile=profile,
+                          timeline=timeline,
+                          hot_frames=hot_frames.most_common(25),
+                          total_samples=total_samples)
+
+
+@bp.route('/profiles/<int:profile_id>/stacks.folded')
+@login_required
+def download_stacks(profile_id):
+    """Folded stacks for flamegraph.pl or speedscope"""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    profile = RequestProfile.query.get_or_404(profile_id)
+    return Response(
+        (profile.stacks or '') + '\n',
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=profile-{profile.id}.folded'}
+    )
@@ -1,13 +1,90 @@
-from flask import Blueprint, jsonify, request
+import gzip
+import json
+
+from flask import Blueprint, Response, abort, jsonify, request
 from flask_login import current_user, login_required
+from sqlalchemy import func, select
 
-from app import db
-from models import Store, Product, InventoryMovement, Supplier
+from app import csrf, db
+from movements import apply_movement_batch
+from models import (Store, StoreRevision, Product, ProductStockShard, ProductTombstone, InventoryMovement,
+                    Supplier, User)
+from revisions import current_revision
+from serializers import (PRODUCT, PRODUCT_CHANGE, PRODUCT_DETAIL, LOW_STOCK_PRODUCT, MOVEMENT,
+                         RECENT_MOVEMENT, SUPPLIER, STORE, json_response)
+from tokens import issue_token, revoke_token
 
 # Create blueprint
 bp = Blueprint('api', __name__, url_prefix='/api')
 
 
+def store_etag(store_id):
+    """ETag for data that only changes when the store's revision or stock shards do"""
+    revision, stamp = db.session.execute(select(
+        select(StoreRevision.revision).where(StoreRevision.store_id == store_id).scalar_subquery(),
+        # Sales of sharded products are written to shard rows only
+        select(func.sum(ProductStockShard.version)).where(ProductStockShard.store_id == store_id).scalar_subquery()
+    )).one()
+    etag = f"store-{store_id}-rev-{revision or 0}"
+    return f"{etag}-{stamp}" if stamp else etag
+
+
+def not_modified(etag):
+    """Empty 304 response for a client that already has this revision"""
+    return with_etag(Response(status=304), etag)
+
+
+def with_etag(response, etag):
+    """Tag a response and ask clients to revalidate before reuse"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@bp.route('/token', methods=['POST'])
+@csrf.exempt
+def create_token():
+    """Exchange a username and password for a bearer token"""
+    data = request.get_json(silent=True) or request.form
+    username = data.get('username')
+    password = data.get('password')
+    
+    if not username or not password:
+        return jsonify({"error": "Username and password are required"}), 400
+    
+    user = User.query.filter_by(username=username).first()
+    if not user or not user.check_password(password):
+        return jsonify({"error": "Invalid username or password"}), 401
+    
+    if not user.is_active:
+        return jsonify({"error": "This account has been disabled"}), 403
+    
+    token, expires_at = issue_token(user)
+    
+    return jsonify({
+        'access_token': token,
+        'token_type': 'Bearer',
+        'expires_at': expires_at.isoformat()
+    })
+
+
+@bp.route('/token/revoke', methods=['POST'])
+@csrf.exempt
+@login_required
+def revoke_current_token():
+    """Revoke the bearer token used for this request"""
+    if not current_user.is_token:
+        return jsonify({"error": "Not authenticated with a bearer token"}), 400
+    
+    revoke_token({
+        'jti': current_user.token_id,
+        'id': current_user.id,
+        'exp': current_user.token_expires_at
+    })
+    
+    return jsonify({"revoked": True})
+
+
 @bp.route('/store/<int:store_id>/products')
 @login_required
 def get_products(store_id):
@@ -16,23 +93,63 @@ def get_products(store_id):
     if not current_user.has_store_access(store_id):
         return jsonify({"error": "Access denied"}), 403
     
+    # Answer unchanged catalogs from the revision alone
+    etag = store_etag(store_id)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    
     # Get products
-    products = Product.query.filter_by(store_id=store_id).all()
+    rows = db.session.execute(
+        PRODUCT.select().where(Product.store_id == store_id)
+    )
+    
+    return with_etag(json_response(PRODUCT.rows(rows)), etag)
+
+
+@bp.route('/store/<int:store_id>/changes')
+@login_required
+def get_changes(store_id):
+    """Get products changed or deleted since a client's version"""
+    # Verify user has access to this store
+    if not current_user.has_store_access(store_id):
+        return jsonify({"error": "Access denied"}), 403
+    
+    since = request.args.get('since', 0, type=int)
+    
+    # Read the new watermark first: rows written after this point may be
+    # included now and will be sent again next time, which is harmless.
+    # Revisions start at 1 (see revisions.py); a store added outside the
+    # app has none until the next startup and gets a full sync each time.
+    version = current_revision(store_id)
     
-    # Convert to JSON
-    products_json = [{
-        'id': p.id,
-        'name': p.name,
-        'sku': p.sku,
-        'barcode': p.barcode,
-        'category': p.category,
-        'unit_price': p.unit_price,
-        'current_quantity': p.current_quantity,
-        'reorder_level': p.reorder_level,
-        'is_low_stock': p.is_low_stock()
-    } for p in products]
+    # A watermark from the future means the client synced elsewhere; resync
+    if since > version:
+        since = 0
     
-    return jsonify(products_json)
+    products = []
+    deleted = []
+    if since == 0 or since < version:
+        query = PRODUCT_CHANGE.select().where(Product.store_id == store_id)
+        if since:
+            query = query.where(Product.updated_version > since)
+        products = PRODUCT_CHANGE.rows(db.session.execute(query.order_by(Product.updated_version, Product.id)))
+        
+        if since:
+            deleted = db.session.execute(
+                select(ProductTombstone.product_id).where(
+                    ProductTombstone.store_id == store_id,
+                    ProductTombstone.version > since
+                )
+            ).scalars().all()
+    
+    return json_response({
+        'store_id': store_id,
+        'since': since,
+        'version': version,
+        'full': since == 0,
+        'products': products,
+        'deleted': deleted
+    })
 
 
 @bp.route('/store/<int:store_id>/product/<int:product_id>')
@@ -44,30 +161,17 @@ def get_product(store_id, product_id):
         return jsonify({"error": "Access denied"}), 403
     
     # Get product
-    product = Product.query.get_or_404(product_id)
+    row = db.session.execute(
+        PRODUCT_DETAIL.select().where(Product.id == product_id)
+    ).first()
+    if row is None:
+        abort(404)
     
     # Verify product belongs to this store
-    if product.store_id != store_id:
+    if row.store_id != store_id:
         return jsonify({"error": "Product not found in this store"}), 404
     
-    # Convert to JSON
-    product_json = {
-        'id': product.id,
-        'name': product.name,
-        'sku': product.sku,
-        'barcode': product.barcode,
-        'description': product.description,
-        'category': product.category,
-        'unit_price': product.unit_price,
-        'cost_price': product.cost_price,
-        'current_quantity': product.current_quantity,
-        'reorder_level': product.reorder_level,
-        'location_in_store': product.location_in_store,
-        'is_low_stock': product.is_low_stock(),
-        'store_id': product.store_id
-    }
-    
-    return jsonify(product_json)
+    return json_response(PRODUCT_DETAIL.row(row))
 
 
 @bp.route('/store/<int:store_id>/product/<int:product_id>/movements')
@@ -79,32 +183,56 @@ def get_product_movements(store_id, product_id):
         return jsonify({"error": "Access denied"}), 403
     
     # Get product
-    product = Product.query.get_or_404(product_id)
+    product_store_id = db.session.execute(
+        select(Product.store_id).where(Product.id == product_id)
+    ).scalar()
+    if product_store_id is None:
+        abort(404)
     
     # Verify product belongs to this store
-    if product.store_id != store_id:
+    if product_store_id != store_id:
         return jsonify({"error": "Product not found in this store"}), 404
     
     # Get movements
-    movements = InventoryMovement.query.filter_by(
-        product_id=product_id,
-        store_id=store_id
-    ).order_by(InventoryMovement.movement_date.desc()).all()
-    
-    # Convert to JSON
-    movements_json = [{
-        'id': m.id,
-        'movement_type': m.movement_type,
-        'quantity': m.quantity,
-        'unit_price': m.unit_price,
-        'total_value': m.get_total_value(),
-        'reference': m.reference,
-        'notes': m.notes,
-        'movement_date': m.movement_date.isoformat(),
-        'created_at': m.created_at.isoformat()
-    } for m in movements]
-    
-    return jsonify(movements_json)
+    rows = db.session.execute(
+        MOVEMENT.select().where(
+            InventoryMovement.product_id == product_id,
+            InventoryMovement.store_id == store_id
+        ).order_by(InventoryMovement.movement_date.desc())
+    )
+    
+    return json_response(MOVEMENT.rows(rows))
+
+
+@bp.route('/store/<int:store_id>/movements/batch', methods=['POST'])
+@csrf.exempt
+@login_required
+def post_movement_batch(store_id):
+    """Apply a batch of movements recorded elsewhere, e.g. on an edge node"""
+    # Exempt from CSRF, so a browser session must not be enough
+    if not current_user.is_token:
+        return jsonify({"error": "Not authenticated with a bearer token"}), 401
+    if request.mimetype != 'application/json':
+        return jsonify({"error": "Expected Content-Type: application/json"}), 400
+    
+    # Verify user has write access to this store
+    if not current_user.has_store_write_access(store_id):
+        return jsonify({"error": "Access denied"}), 403
+    
+    # Batches are usually gzip-compressed
+    body = request.get_data()
+    try:
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        movements = json.loads(body)['movements']
+        if not isinstance(movements, list) or not all(isinstance(m, dict) for m in movements):
+            raise ValueError
+    except (OSError, ValueError, KeyError, TypeError):
+        return jsonify({"error": "Expected a JSON object with a movements list"}), 400
+    
+    result = apply_movement_batch(store_id, movements, user_id=current_user.id)
+    
+    return json_response(result)
 
 
 @bp.route('/store/<int:store_id>/low-stock')
@@ -115,24 +243,20 @@ def get_low_stock(store_id):
     if not current_user.has_store_access(store_id):
         return jsonify({"error": "Access denied"}), 403
     
-    # Get low stock products
-    products = Product.query.filter(
-        Product.store_id == store_id,
-        Product.current_quantity <= Product.reorder_level
-    ).all()
+    # Answer unchanged stock levels from the revision alone
+    etag = store_etag(store_id)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
     
-    # Convert to JSON
-    products_json = [{
-        'id': p.id,
-        'name': p.name,
-        'sku': p.sku,
-        'category': p.category,
-        'current_quantity': p.current_quantity,
-        'reorder_level': p.reorder_level,
-        'unit_price': p.unit_price
-    } for p in products]
+    # Get low stock products
+    rows = db.session.execute(
+        LOW_STOCK_PRODUCT.select().where(
+            Product.store_id == store_id,
+            Product.available_quantity <= Product.reorder_level
+        )
+    )
     
-    return jsonify(products_json)
+    return with_etag(json_response(LOW_STOCK_PRODUCT.rows(rows)), etag)
 
 
 @bp.route('/store/<int:store_id>/suppliers')
@@ -144,18 +268,11 @@ def get_suppliers(store_id):
         return jsonify({"error": "Access denied"}), 403
     
     # Get suppliers
-    suppliers = Supplier.query.filter_by(is_active=True).all()
+    rows = db.session.execute(
+        SUPPLIER.select().where(Supplier.is_active == True)
+    )
     
-    # Convert to JSON
-    suppliers_json = [{
-        'id': s.id,
-        'name': s.name,
-        'contact_name': s.contact_name,
-        'email': s.email,
-        'phone': s.phone
-    } for s in suppliers]
-    
-    return jsonify(suppliers_json)
+    return json_response(SUPPLIER.rows(rows))
 
 
 @bp.route('/store/<int:store_id>/recent-movements')
@@ -169,51 +286,29 @@ def get_recent_movements(store_id):
     # Get limit parameter
     limit = request.args.get('limit', 10, type=int)
     
-    # Get recent movements
-    movements = InventoryMovement.query.filter_by(
-        store_id=store_id
-    ).order_by(InventoryMovement.movement_date.desc()).limit(limit).all()
-    
-    # Convert to JSON with product info
-    movements_json = [{
-        'id': m.id,
-        'product_id': m.product_id,
-        'product_name': m.product.name,
-        'movement_type': m.movement_type,
-        'quantity': m.quantity,
-        'unit_price': m.unit_price,
-        'total_value': m.get_total_value(),
-        'reference': m.reference,
-        'movement_date': m.movement_date.isoformat()
-    } for m in movements]
+    # Get recent movements with product names
+    rows = db.session.execute(
+        RECENT_MOVEMENT.select().join(
+            Product, Product.id == InventoryMovement.product_id
+        ).where(
+            InventoryMovement.store_id == store_id
+        ).order_by(InventoryMovement.movement_date.desc()).limit(limit)
+    )
     
-    return jsonify(movements_json)
+    return json_response(RECENT_MOVEMENT.rows(rows))
 
 
 @bp.route('/user/stores')
 @login_required
 def get_user_stores():
     """Get stores accessible to the current user"""
-    if current_user.role.name == 'admin':
-        # Admin can see all stores
-        stores = Store.query.filter_by(is_active=True).all()
-    else:
+    query = STORE.select().where(Store.is_active == True)
+    
+    if current_user.role.name != 'admin':
         # Other users can only see stores they have access to
         store_ids = [perm.store_id for perm in current_user.store_permissions]
-        stores = Store.query.filter(
-            Store.id.in_(store_ids),
-            Store.is_active == True
-        ).all()
-    
-    # Convert to JSON
-    stores_json = [{
-        'id': s.id,
-        'name': s.name,
-        'code': s.code,
-        'location': s.location,
-        'address': s.address,
-        'phone': s.phone,
-        'email': s.email
-    } for s in stores]
-    
-    return jsonify(stores_json)
\ No newline at end of file
+        query = query.where(Store.id.in_(store_ids))
+    
+    rows = db.session.execute(query)
+    
+    return json_response(STORE.rows(rows))
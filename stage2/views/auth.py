@@ -3,7 +3,9 @@ from flask_login import current_user, login_required, login_user, logout_user
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db
+from identity import invalidate_user
 from models import Role, User
+from tokens import revoke_user_tokens
 
 # Create blueprint
 bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -65,13 +67,17 @@ def logout():
 @login_required
 def profile():
     """View user profile"""
-    return render_template('auth/profile.html')
+    user = User.query.get_or_404(current_user.id)
+    return render_template('auth/profile.html', user=user)
 
 
 @bp.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     """Edit user profile"""
+    # current_user is a cached snapshot; changes go through the User row
+    user = User.query.get_or_404(current_user.id)
+    
     if request.method == 'POST':
         first_name = request.form.get('first_name')
         last_name = request.form.get('last_name')
@@ -81,25 +87,25 @@ def edit_profile():
         confirm_password = request.form.get('confirm_password')
         
         # Validate email
-        if email and email != current_user.email:
+        if email and email != user.email:
             # Check if email is already taken
             existing_user = User.query.filter_by(email=email).first()
-            if existing_user and existing_user.id != current_user.id:
+            if existing_user and existing_user.id != user.id:
                 flash('Email is already in use by another account.', 'danger')
                 return redirect(url_for('auth.edit_profile'))
             
-            current_user.email = email
+            user.email = email
         
         # Update names
         if first_name:
-            current_user.first_name = first_name
+            user.first_name = first_name
         if last_name:
-            current_user.last_name = last_name
+            user.last_name = last_name
         
         # Change password if requested
         if current_password and new_password:
             # Check if current password is correct
-            if not current_user.check_password(current_password):
+            if not user.check_password(current_password):
                 flash('Current password is incorrect.', 'danger')
                 return redirect(url_for('auth.edit_profile'))
             
@@ -113,15 +119,16 @@ def edit_profile():
                 return redirect(url_for('auth.edit_profile'))
             
             # Set new password
-            current_user.set_password(new_password)
+            user.set_password(new_password)
             flash('Password updated successfully.', 'success')
         
         # Save changes
         db.session.commit()
+        invalidate_user(user.id)
         flash('Profile updated successfully.', 'success')
         return redirect(url_for('auth.profile'))
     
-    return render_template('auth/edit_profile.html')
+    return render_template('auth/edit_profile.html', user=user)
 
 
 @bp.route('/users')
@@ -246,6 +253,10 @@ def edit_user(user_id):
         
         db.session.commit()
         
+        # Cached snapshots and API tokens carry the user's role and status
+        invalidate_user(user.id)
+        revoke_user_tokens(user.id)
+        
         flash(f'User {username} has been updated successfully.', 'success')
         return redirect(url_for('auth.list_users'))
     
@@ -1,14 +1,27 @@
+import uuid
 from datetime import datetime
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 
 from app import db
+from group_commit import SaleRejected, sale_batcher
 from models import Product, Store, InventoryMovement
+from movements import MAX_KEY_LENGTH, find_movement, record_movement
 
 # Create blueprint
 bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
 
+def get_idempotency_key():
+    """Idempotency key of a movement form post or POS request, if any
+
+    Forms carry a key generated when they were rendered, so a double submit
+    or a browser retry repeats it; POS clients send an Idempotency-Key header.
+    """
+    key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    return key.strip()[:MAX_KEY_LENGTH] if key else None
+
+
 @bp.route('/store/<int:store_id>/stock-in', methods=['GET', 'POST'])
 @login_required
 def stock_in(store_id):
@@ -24,6 +37,14 @@ def stock_in(store_id):
     products = Product.query.filter_by(store_id=store_id).order_by(Product.name).all()
     
     if request.method == 'POST':
+        # A repeated submission returns the original result without
+        # applying the quantity again
+        idempotency_key = get_idempotency_key()
+        original = find_movement(store_id, idempotency_key)
+        if original:
+            flash(f'Added {original.quantity} units of {original.product.name} to inventory (already recorded).', 'info')
+            return redirect(url_for('inventory.stock_in', store_id=store_id))
+        
         product_id = request.form.get('product_id')
         quantity = request.form.get('quantity')
         unit_price = request.form.get('unit_price')
@@ -75,23 +96,25 @@ def stock_in(store_id):
             reference=reference,
             notes=notes,
             created_by=current_user.id,
-            movement_date=movement_date
+            movement_date=movement_date,
+            idempotency_key=idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity += quantity
-        
         # If no unit price is set for the product, update it
         if not product.unit_price and unit_price:
             product.unit_price = unit_price
         
-        db.session.add(movement)
-        db.session.commit()
+        # Save movement and update product quantity
+        movement, created = record_movement(movement, product)
+        if not created:
+            flash(f'Added {movement.quantity} units of {movement.product.name} to inventory (already recorded).', 'info')
+            return redirect(url_for('inventory.stock_in', store_id=store_id))
         
         flash(f'Added {quantity} units of {product.name} to inventory.', 'success')
         return redirect(url_for('inventory.stock_in', store_id=store_id))
     
-    return render_template('inventory/stock_in.html', store=store, products=products)
+    return render_template('inventory/stock_in.html', store=store, products=products,
+                           idempotency_key=uuid.uuid4().hex)
 
 
 @bp.route('/store/<int:store_id>/sales', methods=['GET', 'POST'])
@@ -109,6 +132,14 @@ def sales(store_id):
     products = Product.query.filter_by(store_id=store_id).order_by(Product.name).all()
     
     if request.method == 'POST':
+        # A repeated submission returns the original result without
+        # applying the quantity again
+        idempotency_key = get_idempotency_key()
+        original = find_movement(store_id, idempotency_key)
+        if original:
+            flash(f'Recorded sale of {original.quantity} units of {original.product.name} (already recorded).', 'info')
+            return redirect(url_for('inventory.sales', store_id=store_id))
+        
         product_id = request.form.get('product_id')
         quantity = request.form.get('quantity')
         unit_price = request.form.get('unit_price')
@@ -151,8 +182,9 @@ def sales(store_id):
             return redirect(url_for('inventory.sales', store_id=store_id))
         
         # Check if there's enough inventory
-        if product.current_quantity < quantity:
-            flash(f'Not enough inventory for {product.name}. Only {product.current_quantity} available.', 'danger')
+        available = product.get_available_quantity()
+        if available < quantity:
+            flash(f'Not enough inventory for {product.name}. Only {available} available.', 'danger')
             return redirect(url_for('inventory.sales', store_id=store_id))
         
         # Create inventory movement
@@ -165,19 +197,31 @@ def sales(store_id):
             reference=reference,
             notes=notes,
             created_by=current_user.id,
-            movement_date=movement_date
+            movement_date=movement_date,
+            idempotency_key=idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity -= quantity
-        
-        db.session.add(movement)
-        db.session.commit()
+        # Save movement and update product quantity, sharing a commit with
+        # concurrent sales when group commit is enabled
+        if current_app.config['SALE_BATCH_WINDOW_MS']:
+            try:
+                movement_id, created = sale_batcher(current_app._get_current_object()).submit(movement)
+            except SaleRejected as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('inventory.sales', store_id=store_id))
+            if not created:
+                movement = db.session.get(InventoryMovement, movement_id)
+        else:
+            movement, created = record_movement(movement, product)
+        if not created:
+            flash(f'Recorded sale of {movement.quantity} units of {movement.product.name} (already recorded).', 'info')
+            return redirect(url_for('inventory.sales', store_id=store_id))
         
         flash(f'Recorded sale of {quantity} units of {product.name}.', 'success')
         return redirect(url_for('inventory.sales', store_id=store_id))
     
-    return render_template('inventory/sales.html', store=store, products=products)
+    return render_template('inventory/sales.html', store=store, products=products,
+                           idempotency_key=uuid.uuid4().hex)
 
 
 @bp.route('/store/<int:store_id>/removals', methods=['GET', 'POST'])
@@ -195,6 +239,14 @@ def removals(store_id):
     products = Product.query.filter_by(store_id=store_id).order_by(Product.name).all()
     
     if request.method == 'POST':
+        # A repeated submission returns the original result without
+        # applying the quantity again
+        idempotency_key = get_idempotency_key()
+        original = find_movement(store_id, idempotency_key)
+        if original:
+            flash(f'Recorded removal of {original.quantity} units of {original.product.name} (already recorded).', 'info')
+            return redirect(url_for('inventory.removals', store_id=store_id))
+        
         product_id = request.form.get('product_id')
         quantity = request.form.get('quantity')
         reason = request.form.get('reason')
@@ -235,8 +287,9 @@ def removals(store_id):
             return redirect(url_for('inventory.removals', store_id=store_id))
         
         # Check if there's enough inventory
-        if product.current_quantity < quantity:
-            flash(f'Not enough inventory for {product.name}. Only {product.current_quantity} available.', 'danger')
+        available = product.get_available_quantity()
+        if available < quantity:
+            flash(f'Not enough inventory for {product.name}. Only {available} available.', 'danger')
             return redirect(url_for('inventory.removals', store_id=store_id))
         
         # Combine reason and notes
@@ -252,19 +305,21 @@ def removals(store_id):
             reference=f"Removal: {reason}",
             notes=full_notes,
             created_by=current_user.id,
-            movement_date=movement_date
+            movement_date=movement_date,
+            idempotency_key=idempotency_key
         )
         
-        # Update product quantity
-        product.current_quantity -= quantity
-        
-        db.session.add(movement)
-        db.session.commit()
+        # Save movement and update product quantity
+        movement, created = record_movement(movement, product)
+        if not created:
+            flash(f'Recorded removal of {movement.quantity} units of {movement.product.name} (already recorded).', 'info')
+            return redirect(url_for('inventory.removals', store_id=store_id))
         
         flash(f'Recorded removal of {quantity} units of {product.name}.', 'success')
         return redirect(url_for('inventory.removals', store_id=store_id))
     
-    return render_template('inventory/removals.html', store=store, products=products)
+    return render_template('inventory/removals.html', store=store, products=products,
+                           idempotency_key=uuid.uuid4().hex)
 
 
 @bp.route('/store/<int:store_id>/movements')
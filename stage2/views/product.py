@@ -1,6 +1,9 @@
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+import io
+
+from flask import Blueprint, Response, flash, redirect, render_template, request, stream_with_context, url_for
 from flask_login import current_user, login_required
 
+import catalog
 from app import db
 from models import Product, Store, InventoryMovement
 
@@ -200,9 +203,62 @@ def low_stock(store_id):
     # Get products with quantity at or below reorder level
     products = Product.query.filter(
         Product.store_id == store_id,
-        Product.current_quantity <= Product.reorder_level
+        Product.available_quantity <= Product.reorder_level
     ).all()
     
     return render_template('product/low_stock.html', 
                           products=products, 
-                          store=store)
\ No newline at end of file
+                          store=store)
+
+
+@bp.route('/store/<int:store_id>/import', methods=['GET', 'POST'])
+@login_required
+def import_products(store_id):
+    """Create and update a store's products from an uploaded CSV or JSONL catalog"""
+    store = Store.query.get_or_404(store_id)
+    
+    # Verify user has write access to this store
+    if not current_user.has_store_write_access(store_id):
+        flash('You do not have permission to import products into this store.', 'danger')
+        return redirect(url_for('product.list_products', store_id=store_id))
+    
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or JSONL file to import.', 'danger')
+            return redirect(url_for('product.import_products', store_id=store_id))
+        
+        fmt = request.form.get('format') or catalog.detect_format(upload.filename)
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            result = catalog.import_catalog(store_id, catalog.read_rows(stream, fmt),
+                                            dry_run=bool(request.form.get('dry_run')))
+        except (catalog.CatalogError, UnicodeDecodeError) as e:
+            flash(f'Could not read {upload.filename}: {e}', 'danger')
+            return redirect(url_for('product.import_products', store_id=store_id))
+        
+        flash(result.summary(), 'warning' if result.error_count else 'success')
+    
+    return render_template('product/import.html', store=store, result=result)
+
+
+@bp.route('/store/<int:store_id>/export')
+@login_required
+def export_products(store_id):
+    """Download a store's catalog in the import format, streamed as it is read"""
+    Store.query.get_or_404(store_id)
+    
+    # Verify user has access to this store
+    if not current_user.has_store_access(store_id):
+        flash('You do not have access to this store.', 'danger')
+        return redirect(url_for('store.select_store'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in catalog.FORMATS:
+        fmt = 'csv'
+    return Response(
+        stream_with_context(catalog.export_lines(store_id, fmt)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=catalog-store-{store_id}.{fmt}'}
+    )
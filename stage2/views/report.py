@@ -4,12 +4,47 @@ from flask_login import current_user, login_required
 from sqlalchemy import func, extract
 
 from app import db
-from models import Store, Product, InventoryMovement, SalesOrder, SalesOrderItem
+from archive import includes_archive, movement_ledger
+from models import Store, Product, InventoryMovement, InventoryMovementArchive, SalesOrder, SalesOrderItem
 
 # Create blueprint
 bp = Blueprint('report', __name__, url_prefix='/report')
 
 
+def fetch_movements(store_id, product_id=None, movement_type=None, category=None,
+                    start_date=None, end_date=None):
+    """Movements of a store, newest first, reading the archive only when needed"""
+    models = [InventoryMovement]
+    if includes_archive(store_id, start_date):
+        models.append(InventoryMovementArchive)
+    
+    movements = []
+    for model in models:
+        query = model.query.filter(model.store_id == store_id)
+        
+        if product_id:
+            query = query.filter(model.product_id == product_id)
+        
+        if movement_type:
+            query = query.filter(model.movement_type == movement_type)
+        
+        if category:
+            query = query.join(Product, Product.id == model.product_id).filter(Product.category == category)
+        
+        if start_date:
+            query = query.filter(model.movement_date >= start_date)
+        
+        if end_date:
+            query = query.filter(model.movement_date <= end_date)
+        
+        movements.extend(query.order_by(model.movement_date.desc()).all())
+    
+    if len(models) > 1:
+        movements.sort(key=lambda m: m.movement_date, reverse=True)
+    
+    return movements
+
+
 @bp.route('/store/<int:store_id>/inventory')
 @login_required
 def inventory_report(store_id):
@@ -25,18 +60,18 @@ def inventory_report(store_id):
     products = Product.query.filter_by(store_id=store_id).all()
     
     # Calculate total inventory value
-    total_value = sum(product.current_quantity * product.unit_price for product in products)
+    total_value = sum(product.get_stock_value() for product in products)
     
     # Count low stock products
     low_stock_count = Product.query.filter(
         Product.store_id == store_id,
-        Product.current_quantity <= Product.reorder_level
+        Product.available_quantity <= Product.reorder_level
     ).count()
     
     # Count out of stock products
-    out_of_stock_count = Product.query.filter_by(
-        store_id=store_id, 
-        current_quantity=0
+    out_of_stock_count = Product.query.filter(
+        Product.store_id == store_id,
+        Product.available_quantity == 0
     ).count()
     
     return render_template('report/inventory.html',
@@ -83,23 +118,12 @@ def movement_report(store_id):
         except ValueError:
             pass
     
-    # Build query
-    query = InventoryMovement.query.filter_by(store_id=store_id)
-    
-    if product_id:
-        query = query.filter_by(product_id=product_id)
-    
-    if movement_type:
-        query = query.filter_by(movement_type=movement_type)
-    
-    if start_date:
-        query = query.filter(InventoryMovement.movement_date >= start_date)
-    
-    if end_date:
-        query = query.filter(InventoryMovement.movement_date <= end_date)
-    
     # Get movements ordered by date
-    movements = query.order_by(InventoryMovement.movement_date.desc()).all()
+    movements = fetch_movements(store_id,
+                                product_id=product_id,
+                                movement_type=movement_type,
+                                start_date=start_date,
+                                end_date=end_date)
     
     # Calculate summary stats
     total_stock_in = sum(m.quantity for m in movements if m.movement_type == 'stock_in')
@@ -180,35 +204,28 @@ def sales_report(store_id):
         # Default to last 30 days
         start_date = end_date - timedelta(days=30)
     
-    # Build query for sales movements
-    query = InventoryMovement.query.filter(
-        InventoryMovement.store_id == store_id,
-        InventoryMovement.movement_type == 'sale',
-        InventoryMovement.movement_date.between(start_date, end_date)
-    )
-    
-    if product_id:
-        query = query.filter_by(product_id=product_id)
-    
-    if category:
-        query = query.join(Product).filter(Product.category == category)
-    
     # Get sales movements
-    sales = query.order_by(InventoryMovement.movement_date.desc()).all()
+    sales = fetch_movements(store_id,
+                            product_id=product_id,
+                            movement_type='sale',
+                            category=category,
+                            start_date=start_date,
+                            end_date=end_date)
     
     # Calculate summary stats
     total_quantity = sum(s.quantity for s in sales)
     total_value = sum(s.quantity * s.unit_price for s in sales)
     
     # Calculate sales by product
+    ledger = movement_ledger(includes_archive(store_id, start_date))
     sales_by_product = db.session.query(
         Product.name,
-        func.sum(InventoryMovement.quantity).label('quantity'),
-        func.sum(InventoryMovement.quantity * InventoryMovement.unit_price).label('value')
-    ).join(InventoryMovement).filter(
-        InventoryMovement.store_id == store_id,
-        InventoryMovement.movement_type == 'sale',
-        InventoryMovement.movement_date.between(start_date, end_date)
+        func.sum(ledger.c.quantity).label('quantity'),
+        func.sum(ledger.c.quantity * ledger.c.unit_price).label('value')
+    ).join(ledger, ledger.c.product_id == Product.id).filter(
+        ledger.c.store_id == store_id,
+        ledger.c.movement_type == 'sale',
+        ledger.c.movement_date.between(start_date, end_date)
     )
     
     if product_id:
@@ -217,7 +234,7 @@ def sales_report(store_id):
     if category:
         sales_by_product = sales_by_product.filter(Product.category == category)
     
-    sales_by_product = sales_by_product.group_by(Product.name).order_by(func.sum(InventoryMovement.quantity).desc()).all()
+    sales_by_product = sales_by_product.group_by(Product.name).order_by(func.sum(ledger.c.quantity).desc()).all()
     
     # Get products for filter dropdown
     products = Product.query.filter_by(store_id=store_id).order_by(Product.name).all()
@@ -277,22 +294,25 @@ def sales_chart_data(store_id):
         start_date = end_date - timedelta(days=30)
         group_by = 'day'
     
+    # Read the archive only if the period reaches past the archive horizon
+    ledger = movement_ledger(includes_archive(store_id, start_date))
+    
     # Build query based on grouping
     if group_by == 'day':
         # Group by day
         sales_data = db.session.query(
-            func.date(InventoryMovement.movement_date).label('date'),
-            func.sum(InventoryMovement.quantity * InventoryMovement.unit_price).label('value')
+            func.date(ledger.c.movement_date).label('date'),
+            func.sum(ledger.c.quantity * ledger.c.unit_price).label('value')
         ).filter(
-            InventoryMovement.store_id == store_id,
-            InventoryMovement.movement_type == 'sale',
-            InventoryMovement.movement_date.between(start_date, end_date)
+            ledger.c.store_id == store_id,
+            ledger.c.movement_type == 'sale',
+            ledger.c.movement_date.between(start_date, end_date)
         )
         
         if product_id:
-            sales_data = sales_data.filter(InventoryMovement.product_id == product_id)
+            sales_data = sales_data.filter(ledger.c.product_id == product_id)
         
-        sales_data = sales_data.group_by(func.date(InventoryMovement.movement_date)).order_by(func.date(InventoryMovement.movement_date)).all()
+        sales_data = sales_data.group_by(func.date(ledger.c.movement_date)).order_by(func.date(ledger.c.movement_date)).all()
         
         # Format for chart
         labels = [item[0].strftime('%Y-%m-%d') for item in sales_data]
@@ -301,18 +321,18 @@ def sales_chart_data(store_id):
     elif group_by == 'week':
         # Group by week
         sales_data = db.session.query(
-            func.date_trunc('week', InventoryMovement.movement_date).label('week'),
-            func.sum(InventoryMovement.quantity * InventoryMovement.unit_price).label('value')
+            func.date_trunc('week', ledger.c.movement_date).label('week'),
+            func.sum(ledger.c.quantity * ledger.c.unit_price).label('value')
         ).filter(
-            InventoryMovement.store_id == store_id,
-            InventoryMovement.movement_type == 'sale',
-            InventoryMovement.movement_date.between(start_date, end_date)
+            ledger.c.store_id == store_id,
+            ledger.c.movement_type == 'sale',
+            ledger.c.movement_date.between(start_date, end_date)
         )
         
         if product_id:
-            sales_data = sales_data.filter(InventoryMovement.product_id == product_id)
+            sales_data = sales_data.filter(ledger.c.product_id == product_id)
         
-        sales_data = sales_data.group_by(func.date_trunc('week', InventoryMovement.movement_date)).order_by(func.date_trunc('week', InventoryMovement.movement_date)).all()
+        sales_data = sales_data.group_by(func.date_trunc('week', ledger.c.movement_date)).order_by(func.date_trunc('week', ledger.c.movement_date)).all()
         
         # Format for chart
         labels = [item[0].strftime('Week of %Y-%m-%d') for item in sales_data]
@@ -321,18 +341,18 @@ def sales_chart_data(store_id):
     else:  # month
         # Group by month
         sales_data = db.session.query(
-            func.date_trunc('month', InventoryMovement.movement_date).label('month'),
-            func.sum(InventoryMovement.quantity * InventoryMovement.unit_price).label('value')
+            func.date_trunc('month', ledger.c.movement_date).label('month'),
+            func.sum(ledger.c.quantity * ledger.c.unit_price).label('value')
         ).filter(
-            InventoryMovement.store_id == store_id,
-            InventoryMovement.movement_type == 'sale',
-            InventoryMovement.movement_date.between(start_date, end_date)
+            ledger.c.store_id == store_id,
+            ledger.c.movement_type == 'sale',
+            ledger.c.movement_date.between(start_date, end_date)
         )
         
         if product_id:
-            sales_data = sales_data.filter(InventoryMovement.product_id == product_id)
+            sales_data = sales_data.filter(ledger.c.product_id == product_id)
         
-        sales_data = sales_data.group_by(func.date_trunc('month', InventoryMovement.movement_date)).order_by(func.date_trunc('month', InventoryMovement.movement_date)).all()
+        sales_data = sales_data.group_by(func.date_trunc('month', ledger.c.movement_date)).order_by(func.date_trunc('month', ledger.c.movement_date)).all()
         
         # Format for chart
         labels = [item[0].strftime('%Y-%m') for item in sales_data]
@@ -341,4 +361,39 @@ def sales_chart_data(store_id):
     return jsonify({
         "labels": labels,
         "values": values
-    })
\ No newline at end of file
+    })
+
+@bp.route('/consolidated')
+@login_required
+def consolidated_report():
+    """Chain-wide inventory and sales report across all stores (admin only)"""
+    if current_user.role.name != 'admin':
+        flash('Only administrators can view consolidated reports.', 'danger')
+        return redirect(url_for('store.select_store'))
+    
+    from consolidated import PERIODS, get_report
+    
+    period = request.args.get('period', 'last30')
+    refresh = request.args.get('refresh') == '1'
+    
+    report = get_report(period, refresh=refresh)
+    
+    return render_template('report/consolidated.html',
+                          report=report,
+                          periods=PERIODS,
+                          period=report['period'])
+
+
+@bp.route('/consolidated/data')
+@login_required
+def consolidated_report_data():
+    """JSON version of the consolidated report (admin only)"""
+    if current_user.role.name != 'admin':
+        return jsonify({"error": "Access denied"}), 403
+    
+    from consolidated import get_report
+    
+    period = request.args.get('period', 'last30')
+    refresh = request.args.get('refresh') == '1'
+    
+    return jsonify(get_report(period, refresh=refresh))
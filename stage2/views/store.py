@@ -2,7 +2,9 @@ from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 
 from app import db
+from identity import invalidate_user
 from models import Store, StorePermission, User, Product, InventoryMovement
+from tokens import revoke_user_tokens
 
 # Create blueprint
 bp = Blueprint('store', __name__, url_prefix='/store')
@@ -37,8 +39,8 @@ def dashboard(store_id):
     
     # Get low stock products
     low_stock_products = store.products.filter(
-        Product.current_quantity <= Product.reorder_level
-    ).order_by(Product.current_quantity).limit(5).all()
+        Product.available_quantity <= Product.reorder_level
+    ).order_by(Product.available_quantity).limit(5).all()
     
     # Get recent inventory movements
     recent_movements = store.inventory_movements.order_by(
@@ -50,7 +52,7 @@ def dashboard(store_id):
     
     # Get low stock count
     low_stock_count = store.products.filter(
-        Product.current_quantity <= Product.reorder_level
+        Product.available_quantity <= Product.reorder_level
     ).count()
     
     return render_template('store/dashboard.html',
@@ -236,6 +238,8 @@ def add_permission(store_id):
         flash(f'Permission added for {user.username}.', 'success')
     
     db.session.commit()
+    invalidate_user(user.id)
+    revoke_user_tokens(user.id)
     return redirect(url_for('store.store_permissions', store_id=store_id))
 
 
@@ -258,6 +262,8 @@ def delete_permission(store_id, permission_id):
     user = User.query.get(permission.user_id)
     db.session.delete(permission)
     db.session.commit()
+    invalidate_user(user.id)
+    revoke_user_tokens(user.id)
     
     flash(f'Permission removed for {user.username}.', 'success')
     return redirect(url_for('store.store_permissions', store_id=store_id))
\ No newline at end of file